@@ -1,10 +1,45 @@
 # scripts/__init__.py
+import importlib
+import os
+import sys
+
+# The modules in this folder import each other by plain module name, since they are
+# also run as scripts from this folder, so the folder must be on the import path
+_SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPTS_DIR not in sys.path:
+    sys.path.append(_SCRIPTS_DIR)
+
+# Makes main functions available directly from the python package. Each one is
+# imported on first access, so that importing the package stays fast
+_EXPORTS = {
+    'process_and_classify_files': 'pipeline',
+    'pdf_to_text_with_ocr': 'helper_functions',
+    'pull_text_from_html': 'helper_functions',
+    'read_text_files': 'helper_functions',
+    'calculate_ocr_quality': 'helper_functions',
+    'plot_ocr_quality_histogram': 'helper_functions',
+    'process_texts_to_dataframe': 'helper_functions',
+    'run_classification_model': 'helper_functions',
+    'run_clause_models': 'helper_functions',
+    'load_sentence_store': 'sentence_store',
+    'SentenceAnnIndex': 'ann_index',
+    'ExtractionService': 'service',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
 
-# Makes main functions available directly from the python package
-from .pipeline import process_and_classify_files
-from .helper_functions import pdf_to_text_with_ocr, pull_text_from_html, \
-    read_text_files, calculate_ocr_quality, plot_ocr_quality_histogram, \
-    process_texts_to_dataframe, run_classification_model
 
 # Define the package version
-__version__ = "0.1.0"
\ No newline at end of file
+__version__ = "0.1.0"
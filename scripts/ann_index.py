@@ -0,0 +1,411 @@
+import argparse
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+from document_cache import DocumentCache
+from models import SENT_EMB_MODEL_NAME
+
+
+class SentenceAnnIndex:
+    """
+    Persistent approximate nearest neighbor (Annoy) index of sentence embeddings, for
+    finding the sentences of all indexed contracts that are closest to a query sentence.
+
+    Annoy indexes cannot grow once built, so the index is a folder of shards, one per
+    batch of added documents:
+    - shard-<n>.ann: the Annoy index of the batch, memory-mapped when queried
+    - shard-<n>.parquet: the sidecar mapping each Annoy item id (its row) to the
+      'filename', 'sentence_index' and 'sentence_text' of the sentence
+    - meta.json: the dimension, metric and embedding model of the index, the shards and,
+      for each document, the shard it is in and a fingerprint of its sentences
+
+    Adding documents only indexes the new and changed ones (by fingerprint), so
+    rebuilding after new documents arrive costs one shard of those documents. The rows
+    of a replaced document stay in their shard but are skipped by queries. When there are
+    more than max_shards shards, all live rows are merged into a single shard (see compact).
+    meta.json is only replaced once the files of a change are written, so an interrupted
+    build leaves the index as it was before.
+
+    Args:
+        index_dir (str): Folder of the index (created if needed).
+        metric (str, optional): Annoy metric of new indexes, 'angular' (cosine) or
+                                'euclidean', 'manhattan', 'dot'. Defaults to 'angular'.
+        n_trees (int, optional): Number of trees per shard; more trees give more accurate
+                                 results and larger files. Defaults to 50.
+        model_id (str, optional): Identifier of the embedding model. Opening an index built
+                                  with another model is an error. Defaults to SENT_EMB_MODEL_NAME.
+        max_shards (int, optional): Number of shards beyond which they are merged. Defaults to 8.
+    """
+
+    SIDECAR_COLUMNS = ['filename', 'sentence_index', 'sentence_text']
+
+    def __init__(self, index_dir: str, metric: str = 'angular', n_trees: int = 50,
+                 model_id: str = SENT_EMB_MODEL_NAME, max_shards: int = 8):
+        if not model_id:
+            raise ValueError("The embedding model of the index (model_id) is required")
+        self.index_dir = index_dir
+        self.n_trees = n_trees
+        self.max_shards = max_shards
+        os.makedirs(index_dir, exist_ok=True)
+        self.meta = self.read_meta(index_dir) or {'dim': None, 'metric': metric, 'model_id': model_id,
+                                                  'next_shard': 0, 'shards': [], 'documents': {}}
+        if self.meta['model_id'] != model_id:
+            raise ValueError(f"Index in {index_dir} holds embeddings of '{self.meta['model_id']}', "
+                             f"not '{model_id}'")
+        self._loaded = {}  # shard name -> (AnnoyIndex, sidecar DataFrame)
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.index_dir, 'meta.json')
+
+    @staticmethod
+    def read_meta(index_dir: str):
+        """
+        Returns the meta.json of an index folder, or None when there is no index in it.
+        """
+        meta_path = os.path.join(index_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_meta(self, meta: dict):
+        tmp_path = f"{self._meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path)
+        self.meta = meta
+
+    def __len__(self) -> int:
+        """
+        Number of live (queryable) sentences in the index.
+        """
+        return sum(document['rows'] for document in self.meta['documents'].values())
+
+    @staticmethod
+    def fingerprint(sentences) -> str:
+        """
+        Returns the fingerprint of the sentences of a document, which tells whether a
+        document was changed since it was indexed.
+        """
+        return DocumentCache._hash('ann', *sentences)
+
+    # --- Building ---
+
+    def add(self, df: pd.DataFrame, embeddings: np.ndarray) -> int:
+        """
+        Adds the sentences of documents and their embeddings (one row of `embeddings`
+        per row of `df`, which has the SIDECAR_COLUMNS) to the index, as one new shard.
+        Documents indexed with the same sentences are skipped, and documents indexed
+        with other sentences are replaced.
+
+        Returns:
+            int: The number of documents added or replaced.
+        """
+        embeddings = np.asarray(embeddings)
+        if embeddings.ndim != 2 or len(embeddings) != len(df):
+            raise ValueError(f"Expected one embedding row per sentence, got {embeddings.shape} "
+                             f"for {len(df)} sentences")
+        dim = self.meta['dim'] if self.meta['dim'] is not None else int(embeddings.shape[1])
+        if embeddings.shape[1] != dim:
+            raise ValueError(f"Expected embeddings of dimension {dim}, got {embeddings.shape[1]}")
+
+        # Keep the rows of the documents that are new or changed since they were indexed
+        df = df[self.SIDECAR_COLUMNS].reset_index(drop=True)
+        positions = pd.Series(np.arange(len(df))).groupby(df['filename'].to_numpy(), sort=False)
+        changed, rows = {}, []
+        for filename, doc_rows in positions:
+            doc_rows = doc_rows.to_numpy()
+            fingerprint = self.fingerprint(df['sentence_text'].to_numpy()[doc_rows])
+            if self.meta['documents'].get(filename, {}).get('fingerprint') != fingerprint:
+                changed[filename] = {'fingerprint': fingerprint, 'rows': len(doc_rows)}
+                rows.append(doc_rows)
+        if not changed:
+            return 0
+        rows = np.concatenate(rows)
+
+        name = f"shard-{self.meta['next_shard']:05d}"
+        self._build_shard(name, df.iloc[rows].reset_index(drop=True), embeddings[rows], dim)
+
+        # Point the changed documents at the new shard, and drop shards left without live rows
+        documents = dict(self.meta['documents'])
+        shards = [dict(shard) for shard in self.meta['shards']]
+        for filename, document in changed.items():
+            previous = documents.get(filename)
+            if previous is not None:
+                next(shard for shard in shards if shard['name'] == previous['shard'])['live'] -= previous['rows']
+            documents[filename] = {'shard': name, **document}
+        shards.append({'name': name, 'rows': len(rows), 'live': len(rows)})
+        removed = [shard for shard in shards if shard['live'] == 0]
+        self._write_meta({**self.meta, 'dim': dim, 'next_shard': self.meta['next_shard'] + 1,
+                          'shards': [shard for shard in shards if shard['live'] > 0], 'documents': documents})
+        self._remove_shard_files(removed)
+
+        if len(self.meta['shards']) > self.max_shards:
+            self.compact()
+        return len(changed)
+
+    def remove(self, filenames) -> int:
+        """
+        Removes documents from the index. Their rows are skipped by queries until the
+        next compaction, or dropped with their shard when it has no other documents.
+
+        Returns:
+            int: The number of documents removed.
+        """
+        documents = dict(self.meta['documents'])
+        shards = [dict(shard) for shard in self.meta['shards']]
+        removed_documents = [documents.pop(filename) for filename in filenames if filename in documents]
+        for document in removed_documents:
+            next(shard for shard in shards if shard['name'] == document['shard'])['live'] -= document['rows']
+        self._write_meta({**self.meta, 'shards': [shard for shard in shards if shard['live'] > 0],
+                          'documents': documents})
+        self._remove_shard_files([shard for shard in shards if shard['live'] == 0])
+        return len(removed_documents)
+
+    def compact(self):
+        """
+        Merges the live rows of all shards into a single new shard, dropping the rows of
+        replaced and removed documents. The shards are read one at a time, straight into
+        the on-disk build of the new shard, so memory does not grow with the index.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if len(self.meta['shards']) <= 1 and all(s['rows'] == s['live'] for s in self.meta['shards']):
+            return
+        name = f"shard-{self.meta['next_shard']:05d}"
+        merged = self._new_shard_index(name, self.meta['dim'])
+        sidecar_writer = None
+        rows = 0
+        for shard in self.meta['shards']:
+            index, sidecar = self._load_shard(shard['name'])
+            live = np.flatnonzero(self._live_mask(shard['name'], sidecar))
+            for i in live:
+                merged.add_item(rows, index.get_item_vector(int(i)))
+                rows += 1
+            table = pa.Table.from_pandas(sidecar.iloc[live], preserve_index=False)
+            if sidecar_writer is None:
+                sidecar_writer = pq.ParquetWriter(os.path.join(self.index_dir, name + '.parquet'), table.schema)
+            sidecar_writer.write_table(table.cast(sidecar_writer.schema))
+            # Release the memory map of the shard before reading the next one
+            self._loaded.pop(shard['name'])
+            index.unload()
+        sidecar_writer.close()
+        merged.build(self.n_trees, n_jobs=-1)
+        merged.unload()
+
+        old_shards = self.meta['shards']
+        self._write_meta({**self.meta, 'next_shard': self.meta['next_shard'] + 1,
+                          'shards': [{'name': name, 'rows': rows, 'live': rows}],
+                          'documents': {filename: {**document, 'shard': name}
+                                        for filename, document in self.meta['documents'].items()}})
+        self._remove_shard_files(old_shards)
+        logging.info(f"Compacted {len(old_shards)} shards into {name} ({rows} sentences)")
+
+    def _new_shard_index(self, name: str, dim: int):
+        """
+        Returns an empty Annoy index of a shard, built on disk, so memory does not grow
+        with the size of the shard.
+        """
+        from annoy import AnnoyIndex
+
+        index = AnnoyIndex(dim, self.meta['metric'])
+        index.set_seed(0)
+        index.on_disk_build(os.path.join(self.index_dir, name + '.ann'))
+        return index
+
+    def _build_shard(self, name: str, sidecar: pd.DataFrame, embeddings: np.ndarray, dim: int):
+        """
+        Writes the Annoy index and the sidecar of a shard.
+        """
+        sidecar.to_parquet(os.path.join(self.index_dir, name + '.parquet'), index=False)
+        index = self._new_shard_index(name, dim)
+        # Convert the embeddings (possibly a float16 memory map) a chunk at a time
+        for start in range(0, len(embeddings), 65536):
+            chunk = np.asarray(embeddings[start:start + 65536], dtype=np.float32)
+            for i, vector in enumerate(chunk, start=start):
+                index.add_item(i, vector)
+        index.build(self.n_trees, n_jobs=-1)
+        index.unload()
+
+    def _remove_shard_files(self, shards):
+        for shard in shards:
+            self._loaded.pop(shard['name'], None)
+            for extension in ('.ann', '.parquet'):
+                path = os.path.join(self.index_dir, shard['name'] + extension)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    # --- Querying ---
+
+    def _load_shard(self, name: str):
+        """
+        Returns the memory-mapped Annoy index and the sidecar of a shard, loaded once.
+        """
+        if name not in self._loaded:
+            from annoy import AnnoyIndex
+
+            index = AnnoyIndex(self.meta['dim'], self.meta['metric'])
+            index.load(os.path.join(self.index_dir, name + '.ann'))
+            sidecar = pd.read_parquet(os.path.join(self.index_dir, name + '.parquet'))
+            self._loaded[name] = (index, sidecar)
+        return self._loaded[name]
+
+    def load(self):
+        """
+        Loads every shard ahead of the first query.
+        """
+        for shard in self.meta['shards']:
+            self._load_shard(shard['name'])
+
+    def _live_mask(self, name: str, sidecar: pd.DataFrame) -> np.ndarray:
+        """
+        Returns which rows of a shard belong to documents whose current rows are in it.
+        """
+        current = {filename for filename, document in self.meta['documents'].items() if document['shard'] == name}
+        return sidecar['filename'].isin(current).to_numpy()
+
+    def query(self, vector, k: int = 10, search_k: int = -1) -> pd.DataFrame:
+        """
+        Returns the k indexed sentences nearest to an embedding, across all shards.
+
+        Args:
+            vector (array-like): Query embedding, from the model the index was built with.
+            k (int, optional): Number of sentences returned. Defaults to 10.
+            search_k (int, optional): Nodes inspected per shard, which trades speed for
+                                      accuracy. Defaults to n_trees x n (Annoy's default).
+
+        Returns:
+            pd.DataFrame: One row per sentence, nearest first, with the columns 'rank',
+                          'filename', 'sentence_index', 'sentence_text' and 'distance'
+                          (plus 'similarity', the cosine similarity, for the angular metric).
+        """
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        if self.meta['dim'] is not None and len(vector) != self.meta['dim']:
+            raise ValueError(f"Expected a query of dimension {self.meta['dim']}, got {len(vector)}")
+
+        hits = []
+        for shard in self.meta['shards']:
+            index, sidecar = self._load_shard(shard['name'])
+            live = self._live_mask(shard['name'], sidecar) if shard['live'] < shard['rows'] else None
+            # Ask for more neighbors until k of them are live, or the shard has no more
+            n = k
+            while True:
+                ids, distances = index.get_nns_by_vector(vector, n, search_k=search_k, include_distances=True)
+                ids, distances = np.asarray(ids, dtype=np.int64), np.asarray(distances)
+                keep = live[ids] if live is not None else np.ones(len(ids), dtype=bool)
+                if keep.sum() >= k or len(ids) < n or n >= shard['rows']:
+                    break
+                n *= 2
+            hits.append(sidecar.iloc[ids[keep][:k]].assign(distance=distances[keep][:k]))
+
+        results = pd.concat(hits, ignore_index=True) if hits \
+            else pd.DataFrame(columns=self.SIDECAR_COLUMNS + ['distance'])
+        results = results.sort_values('distance', kind='stable').head(k).reset_index(drop=True)
+        results.insert(0, 'rank', np.arange(1, len(results) + 1))
+        if self.meta['metric'] == 'angular':
+            # Annoy's angular distance is sqrt(2 - 2 cos)
+            results['similarity'] = 1 - results['distance'].astype(float) ** 2 / 2
+        return results
+
+
+def build_index_from_store(store_dir: str, index_dir: str, model_id: str = SENT_EMB_MODEL_NAME,
+                           n_trees: int = 50) -> int:
+    """
+    Adds the sentences and embeddings of a sentence store (see sentence_store.py) to an
+    index, e.g. the one saved by each pipeline run in its output folder. model_id is
+    the embedding model of the store, which must be the model of the index.
+
+    Returns:
+        int: The number of documents added or replaced.
+    """
+    from sentence_store import load_sentence_store
+
+    df, embeddings = load_sentence_store(store_dir)
+    return SentenceAnnIndex(index_dir, model_id=model_id, n_trees=n_trees).add(df, embeddings)
+
+
+if __name__ == "__main__":
+    # Configure logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(
+        description="Build and query the nearest neighbor index of sentence embeddings."
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Add the documents of a sentence store to the index.")
+    build_parser.add_argument("--store_dir", type=str, required=True,
+                              help="Sentence store folder, e.g. the 'sentence_store' of a pipeline output folder.")
+    build_parser.add_argument("--index_dir", type=str, required=True,
+                              help="Folder of the index (created if needed).")
+    build_parser.add_argument("--n_trees", type=int, default=50,
+                              help="Number of trees per shard (default: 50).")
+    build_parser.add_argument("--model_id", type=str, default=SENT_EMB_MODEL_NAME,
+                              help="Identifier of the embedding model of the store, checked against the index "
+                                   f"(default: {SENT_EMB_MODEL_NAME}).")
+    build_parser.add_argument("--compact", action="store_true",
+                              help="Merge all shards into one after adding the documents.")
+
+    query_parser = subparsers.add_parser('query', help="Find the sentences nearest to a query sentence.")
+    query_parser.add_argument("--index_dir", type=str, required=True,
+                              help="Folder of the index.")
+    query_parser.add_argument("--text", type=str, required=True,
+                              help="Query sentence, embedded with the model the index was built with.")
+    query_parser.add_argument("--k", type=int, default=10,
+                              help="Number of sentences returned (default: 10).")
+    query_parser.add_argument("--search_k", type=int, default=-1,
+                              help="Nodes inspected per shard; higher is more accurate and slower "
+                                   "(default: -1, Annoy's default).")
+    query_parser.add_argument("--onnx_model_dir", type=str, default=None,
+                              help="Embed the query with the ONNX export in this folder (default: the PyTorch model).")
+    query_parser.add_argument("--onnx_quantized", action="store_true",
+                              help="Use the int8 quantized model of --onnx_model_dir.")
+    query_parser.add_argument("--output_csv", type=str, default=None,
+                              help="Also save the results to this CSV file.")
+
+    info_parser = subparsers.add_parser('info', help="Describe the shards and documents of the index.")
+    info_parser.add_argument("--index_dir", type=str, required=True,
+                             help="Folder of the index.")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        added = build_index_from_store(args.store_dir, args.index_dir, model_id=args.model_id,
+                                       n_trees=args.n_trees)
+        index = SentenceAnnIndex(args.index_dir, model_id=args.model_id)
+        if args.compact:
+            index.compact()
+        logging.info(f"Added {added} documents; the index holds {len(index)} sentences "
+                     f"in {len(index.meta['shards'])} shards")
+    elif args.command == 'query':
+        import time
+        from helper_functions import embed_sentences
+
+        if args.onnx_model_dir:
+            from onnx_embedding import OnnxSentenceEncoder
+            model = OnnxSentenceEncoder(args.onnx_model_dir, quantized=args.onnx_quantized)
+            model_id = model.model_id
+        else:
+            from models import get_sentence_model
+            model = get_sentence_model()
+            model_id = SENT_EMB_MODEL_NAME
+        # The query is embedded with the model of the index, or the index is refused
+        index = SentenceAnnIndex(args.index_dir, model_id=model_id)
+        vector = embed_sentences([args.text], model)[0]
+        index.load()
+        start = time.perf_counter()
+        results = index.query(vector, k=args.k, search_k=args.search_k)
+        logging.info(f"Searched {len(index)} sentences in {(time.perf_counter() - start) * 1000:.1f} ms")
+        print(results.to_string(index=False))
+        if args.output_csv:
+            results.to_csv(args.output_csv, index=False)
+    else:
+        meta = SentenceAnnIndex.read_meta(args.index_dir)
+        if meta is None:
+            parser.error(f"No index in {args.index_dir}")
+        print(json.dumps({'dim': meta['dim'], 'metric': meta['metric'], 'model_id': meta['model_id'],
+                          'sentences': sum(document['rows'] for document in meta['documents'].values()),
+                          'documents': len(meta['documents']), 'shards': meta['shards']}, indent=1))
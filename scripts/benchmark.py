@@ -0,0 +1,553 @@
+import argparse
+import glob
+import html
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import sys
+import time
+import pandas as pd
+
+# Unit of the throughput of each stage of the run report: documents/s, pages/s and/or
+# sentences/s. Stages of the report that are not listed are reported in seconds only.
+STAGE_RATES = {
+    'pdf': ['documents', 'pages'],
+    'html': ['documents'],
+    'quality': ['documents'],
+    'segment': ['documents', 'sentences'],
+    'embed': ['sentences'],
+    'score': ['sentences'],
+    'total': ['documents', 'pages', 'sentences'],
+}
+
+CORPUS_MANIFEST = 'corpus.json'
+RESULTS_FILE = 'benchmark_results.json'
+STAGES_FILE = 'benchmark_stages.csv'
+
+# Letter-size pages with one inch margins, like the contracts of the corpus
+PAGE_WIDTH, PAGE_HEIGHT, PAGE_MARGIN = 612, 792, 72
+
+
+def load_source_sentences(source_dir: str) -> list:
+    """
+    Collects the sentences of the HTML and text-layer PDF fixtures that synthetic
+    documents are assembled from. Scanned PDFs (without a text layer) are skipped.
+
+    Args:
+        source_dir (str): Folder of fixture documents, e.g. 'tests/docs'.
+
+    Returns:
+        list: Sentences of 5 to 80 words, in fixture order.
+    """
+    from helper_functions import html_to_text, pdf_to_text
+
+    texts = []
+    for path in sorted(glob.glob(os.path.join(source_dir, '*'))):
+        extension = os.path.splitext(path)[1].lower()
+        if extension in ('.htm', '.html'):
+            texts.append(html_to_text(path) or '')
+        elif extension == '.pdf':
+            texts.append(pdf_to_text(path, mode='native'))
+
+    # A plain regular expression split is enough to cut the fixtures into sentences
+    sentences = []
+    for text in texts:
+        for sentence in re.split(r'(?<=[.;:])\s+', ' '.join(text.split())):
+            if 5 <= len(sentence.split()) <= 80:
+                sentences.append(sentence)
+    if not sentences:
+        raise ValueError(f"No sentences found in the fixtures of {source_dir}")
+    return sentences
+
+
+def synthetic_contract(sentences: list, rng: random.Random, pages: int, paragraphs_per_page: int = 5) -> list:
+    """
+    Assembles the numbered sections of a contract-like document from randomly sampled
+    fixture sentences.
+
+    Returns:
+        list: One list of section paragraphs per page.
+    """
+    document = []
+    for page in range(pages):
+        document.append([f"{page * paragraphs_per_page + i + 1}. " + ' '.join(rng.sample(sentences, rng.randint(3, 5)))
+                         for i in range(paragraphs_per_page)])
+    return document
+
+
+def write_html_document(path: str, title: str, document: list):
+    """
+    Writes a synthetic document as an EDGAR-style HTML exhibit.
+    """
+    paragraphs = ''.join(f'<p style="margin-top:12pt">{html.escape(paragraph)}</p>\n'
+                         for page in document for paragraph in page)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'<html><head><meta charset="utf-8"><title>{title}</title></head>\n'
+                f'<body><p align="center"><b>{title}</b></p>\n{paragraphs}</body></html>\n')
+
+
+def write_pdf_document(path: str, title: str, document: list, scanned: bool = False, dpi: int = 150):
+    """
+    Writes a synthetic document as a PDF with a text layer, one page per entry of
+    document, or as a scanned PDF: the same pages rendered to grayscale images, with
+    no text layer, so that they go through OCR.
+    """
+    import fitz
+
+    rect = fitz.Rect(PAGE_MARGIN, PAGE_MARGIN, PAGE_WIDTH - PAGE_MARGIN, PAGE_HEIGHT - PAGE_MARGIN)
+    with fitz.open() as pdf_document:
+        for page_num, paragraphs in enumerate(document):
+            page = pdf_document.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            text = '\n\n'.join(([title] if page_num == 0 else []) + paragraphs)
+            # Shrink the font until the page text fits (insert_textbox writes nothing otherwise)
+            fontsize = 11
+            while page.insert_textbox(rect, text, fontsize=fontsize, fontname='helv') < 0 and fontsize > 5:
+                fontsize -= 1
+
+        if not scanned:
+            pdf_document.save(path)
+            return
+        with fitz.open() as scanned_document:
+            for page in pdf_document:
+                pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+                scanned_page = scanned_document.new_page(width=page.rect.width, height=page.rect.height)
+                scanned_page.insert_image(scanned_page.rect, pixmap=pixmap)
+            scanned_document.save(path, deflate=True)
+
+
+def generate_corpus(output_dir: str, num_documents: int = 20, pages_per_document: int = 3,
+                    html_fraction: float = 0.5, scanned_fraction: float = 0.25,
+                    source_dir: str = os.path.join('tests', 'docs'), seed: int = 0) -> dict:
+    """
+    Generates a reproducible synthetic corpus of contract-like documents from the
+    sentences of the fixtures: HTML exhibits, PDFs with a text layer and scanned PDFs.
+    The same arguments always give the same documents. A manifest of the corpus is
+    saved to corpus.json in the output folder.
+
+    Args:
+        output_dir (str): Folder the documents are written to (created if needed).
+        num_documents (int, optional): Number of documents. Defaults to 20.
+        pages_per_document (int, optional): Pages of each document (sections of the
+                                            HTML documents). Defaults to 3.
+        html_fraction (float, optional): Share of HTML documents. Defaults to 0.5.
+        scanned_fraction (float, optional): Share of scanned PDFs, the remaining
+                                            documents are PDFs with a text layer. Defaults to 0.25.
+        source_dir (str, optional): Folder of the fixtures. Defaults to 'tests/docs'.
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+
+    Returns:
+        dict: The manifest: the generation arguments and the type, pages and words of
+              each document.
+    """
+    sentences = load_source_sentences(source_dir)
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    num_html = round(num_documents * html_fraction)
+    num_scanned = min(round(num_documents * scanned_fraction), num_documents - num_html)
+    kinds = ['html'] * num_html + ['pdf_scanned'] * num_scanned + ['pdf_text'] * (num_documents - num_html - num_scanned)
+
+    documents = []
+    for i, kind in enumerate(kinds):
+        title = f"SERVICES AGREEMENT NO. {i + 1:05d}"
+        document = synthetic_contract(sentences, rng, pages_per_document)
+        filename = f"contract_{i + 1:05d}" + ('.htm' if kind == 'html' else '.pdf')
+        path = os.path.join(output_dir, filename)
+        if kind == 'html':
+            write_html_document(path, title, document)
+        else:
+            write_pdf_document(path, title, document, scanned=(kind == 'pdf_scanned'))
+        documents.append({'filename': filename, 'type': kind, 'pages': pages_per_document,
+                          'words': sum(len(paragraph.split()) for page in document for paragraph in page)})
+
+    manifest = {'seed': seed, 'source_dir': source_dir, 'num_documents': num_documents,
+                'pages_per_document': pages_per_document, 'html_fraction': html_fraction,
+                'scanned_fraction': scanned_fraction, 'documents': documents}
+    with open(os.path.join(output_dir, CORPUS_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def describe_corpus(corpus_dir: str) -> dict:
+    """
+    Counts the documents and PDF pages of a folder the way the pipeline finds them.
+    """
+    import fitz
+
+    pdf_files = glob.glob(os.path.join(corpus_dir, '*.pdf'))
+    html_files = glob.glob(os.path.join(corpus_dir, '*.html')) + glob.glob(os.path.join(corpus_dir, '*.htm'))
+    pages = 0
+    for pdf_file in pdf_files:
+        try:
+            with fitz.open(pdf_file) as pdf_document:
+                pages += pdf_document.page_count
+        except Exception as e:
+            logging.warning(f"Unable to open PDF {pdf_file}: {e}")
+    return {'path': os.path.abspath(corpus_dir), 'documents': len(pdf_files) + len(html_files),
+            'pdf_documents': len(pdf_files), 'html_documents': len(html_files), 'pdf_pages': pages}
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process and of its finished child
+    processes (e.g. OCR and embedding workers), in MB, or (None, None) where the
+    resource module is not available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def stage_rates(seconds: float, counts: dict, units: list) -> dict:
+    """
+    Returns the throughput of a stage in each of its units, e.g. {'documents_per_s': ...}.
+    """
+    return {f'{unit}_per_s': (counts[unit] / seconds if seconds > 0 else None) for unit in units}
+
+
+def run_benchmark(corpus_dir: str, output_dir: str, model_folder: str, sent_emb_model=None,
+                  repeats: int = 1, **pipeline_kwargs) -> dict:
+    """
+    Runs process_and_classify_files on a corpus and reports the time of each of its stages.
+
+    The stage times and counts are read from the run report the pipeline writes (see
+    instrumentation.py), so the benchmark measures exactly what production runs report.
+    The median time of each stage over the repeats is reported, with its throughput in
+    documents/s, pages/s and/or sentences/s (see STAGE_RATES) and its peak RSS, along
+    with the peak RSS of the process. The peak RSS of the process is its high-water mark,
+    so run one benchmark per process to compare it between runs. The results are saved
+    to benchmark_results.json and benchmark_stages.csv in the output folder.
+
+    Args:
+        corpus_dir (str): Folder of PDF and HTML documents (see generate_corpus).
+        output_dir (str): Folder of the results. Each repeat runs the pipeline in a fresh
+                          'run' subfolder.
+        model_folder (str): The path to the directory where the model files are stored.
+        sent_emb_model (SentenceTransformer, optional): Sentence embedding model, loaded
+                          before timing starts. Defaults to models.get_sentence_model().
+        repeats (int, optional): Number of runs. Defaults to 1.
+        **pipeline_kwargs: Other arguments of process_and_classify_files, e.g. pdf_mode
+                          or ocr_workers. The document cache is not used.
+
+    Returns:
+        dict: The results, as saved to benchmark_results.json.
+    """
+    import pipeline
+    from instrumentation import RUN_REPORT_FILE
+    from models import get_sentence_model
+
+    if pipeline_kwargs.get('cache_dir'):
+        raise ValueError("The benchmark times every stage, so it runs without the document cache")
+    if pipeline_kwargs.get('instrumentation') is not None:
+        raise ValueError("The benchmark reads the run report the pipeline writes by default")
+    if sent_emb_model is None:
+        sent_emb_model = get_sentence_model()
+    os.makedirs(output_dir, exist_ok=True)
+    corpus = describe_corpus(corpus_dir)
+
+    reports = []
+    for repeat in range(repeats):
+        run_dir = os.path.join(output_dir, 'run')
+        shutil.rmtree(run_dir, ignore_errors=True)
+        pipeline.process_and_classify_files(corpus_dir, run_dir, model_folder,
+                                            sent_emb_model=sent_emb_model, **pipeline_kwargs)
+        with open(os.path.join(run_dir, RUN_REPORT_FILE), 'r', encoding='utf-8') as f:
+            reports.append(json.load(f))
+        logging.info(f"Benchmark run {repeat + 1}/{repeats}: {reports[-1]['wall_seconds']:.2f}s")
+
+    # Counts of each stage, as recorded by the first run: the PDF stage only sees PDFs,
+    # the HTML stage only HTML, and segmentation counts the sentences before the prefilter
+    first = {stage['name']: stage for stage in reports[0]['stages']}
+    sentences = {'segment': first['segment']['items'], 'embed': first['embed']['items']}
+    documents = {'pdf': first['pdf']['items'], 'html': first['html']['items']}
+    stages = {}
+    for name in list(first) + ['total']:
+        if name == 'total':
+            seconds = statistics.median(report['wall_seconds'] for report in reports)
+            peak_rss = None
+        else:
+            runs = [next(stage for stage in report['stages'] if stage['name'] == name) for report in reports]
+            seconds = statistics.median(stage['wall_seconds'] for stage in runs)
+            peak_rss = max((stage['peak_rss_bytes'] for stage in runs if stage['peak_rss_bytes']), default=None)
+        counts = {'documents': documents.get(name, corpus['documents']),
+                  'pages': first['pdf']['pages'] or 0,
+                  'sentences': sentences.get(name, sentences['embed'])}
+        stages[name] = {'seconds': seconds, **stage_rates(seconds, counts, STAGE_RATES.get(name, [])),
+                        'peak_rss_mb': peak_rss / 1024 ** 2 if peak_rss else None}
+
+    peak_rss, peak_rss_children = peak_rss_mb()
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'processor': platform.processor(), 'cpu_count': os.cpu_count()},
+        'corpus': corpus,
+        'config': {'repeats': repeats, 'embedding_model': type(sent_emb_model).__name__,
+                   **{key: value for key, value in pipeline_kwargs.items() if key != 'prefilter'}},
+        'sentences': {'segmented': sentences['segment'], 'embedded': sentences['embed']},
+        'stages': stages,
+        'peak_rss_mb': peak_rss,
+        'peak_rss_children_mb': peak_rss_children,
+    }
+    with open(os.path.join(output_dir, RESULTS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=1, default=str)
+    pd.DataFrame([{'stage': stage, **metrics} for stage, metrics in stages.items()]) \
+        .to_csv(os.path.join(output_dir, STAGES_FILE), index=False)
+    return results
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float = 0.1) -> pd.DataFrame:
+    """
+    Compares benchmark results with a baseline. A metric regresses when it is worse than
+    the baseline by more than the tolerance: a throughput (…_per_s) below
+    (1 - tolerance) x baseline, or a time in seconds or the peak RSS above
+    (1 + tolerance) x baseline. Stages are compared on their throughput, or on their
+    time when they have none.
+
+    Args:
+        baseline (dict): Results of run_benchmark for the reference version.
+        current (dict): Results of run_benchmark for the version to check.
+        tolerance (float, optional): Relative change allowed. Defaults to 0.1.
+
+    Returns:
+        pd.DataFrame: One row per metric with the columns 'stage', 'metric', 'baseline',
+                      'current', 'change' (relative) and 'regression'.
+    """
+    rows = []
+
+    def compare(stage, metric, base, value, higher_is_better):
+        if base is None or value is None or base == 0:
+            return
+        change = value / base - 1
+        regression = change < -tolerance if higher_is_better else change > tolerance
+        rows.append({'stage': stage, 'metric': metric, 'baseline': base, 'current': value,
+                     'change': change, 'regression': regression})
+
+    for stage, base_metrics in baseline['stages'].items():
+        metrics = current['stages'].get(stage, {})
+        rates = [metric for metric, value in base_metrics.items() if metric.endswith('_per_s') and value]
+        for metric in rates or ['seconds']:
+            compare(stage, metric, base_metrics.get(metric), metrics.get(metric), metric in rates)
+    compare('process', 'peak_rss_mb', baseline.get('peak_rss_mb'), current.get('peak_rss_mb'), False)
+    return pd.DataFrame(rows, columns=['stage', 'metric', 'baseline', 'current', 'change', 'regression'])
+
+
+OCR_BENCHMARK_FILE = 'ocr_backends.csv'
+
+
+def render_corpus_pages(corpus_dir: str, max_pages: int = 16, render_options: dict = None) -> list:
+    """
+    Renders the PDF pages of a corpus that would be OCRed in 'auto' mode (pages without
+    a usable text layer), as page images for benchmark_ocr_backends.
+
+    Args:
+        corpus_dir (str): Folder of PDF documents.
+        max_pages (int, optional): Maximum number of pages rendered. Defaults to 16.
+        render_options (dict, optional): See helper_functions.RENDER_DEFAULTS.
+
+    Returns:
+        list: (image, dpi) of each page, with images that own their memory.
+    """
+    import fitz
+    from helper_functions import render_options_with_defaults, render_page_for_ocr, text_layer_is_usable
+
+    options = render_options_with_defaults(render_options)
+    pages = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, '*.pdf'))):
+        with fitz.open(path) as pdf_document:
+            for page in pdf_document:
+                if len(pages) >= max_pages:
+                    return pages
+                if text_layer_is_usable(page.get_text("words"), page=page):
+                    continue
+                image, dpi, _ = render_page_for_ocr(page, options)
+                pages.append((image.copy(), dpi))
+                image.close()
+    return pages
+
+
+def benchmark_ocr_backends(pages: list, backends: list = None, batch_size: int = 8, repeats: int = 3) -> pd.DataFrame:
+    """
+    Measures the per-page cost of each OCR backend on the same rendered pages, and its
+    fixed cost per call, taken as the median time to OCR a tiny blank image (process
+    start, language data loading and image transfer, with no text to read).
+
+    Backends that support batches get the pages batch_size at a time, the others one
+    at a time. Backends whose engine is not installed are reported as unavailable.
+
+    Args:
+        pages (list): (image, dpi) of each page, see render_corpus_pages.
+        backends (list, optional): Names of the backends. Defaults to all of ocr_backends.OCR_BACKENDS.
+        batch_size (int, optional): Pages per call of batching backends. Defaults to 8.
+        repeats (int, optional): Number of calls the fixed cost is the median of. Defaults to 3.
+
+    Returns:
+        pd.DataFrame: One row per backend with the columns 'backend', 'available', 'pages',
+                      'seconds', 'seconds_per_page', 'call_overhead_seconds' and 'words'.
+    """
+    from PIL import Image
+    from ocr_backends import OCR_BACKENDS, get_ocr_backend
+
+    images, dpis = [image for image, _ in pages], [dpi for _, dpi in pages]
+    tiny = Image.new('L', (32, 32), 255)
+    rows = []
+    for name in backends or list(OCR_BACKENDS):
+        row = {'backend': name, 'available': OCR_BACKENDS[name].is_available(), 'pages': len(images),
+               'seconds': None, 'seconds_per_page': None, 'call_overhead_seconds': None, 'words': None}
+        rows.append(row)
+        if not row['available']:
+            logging.warning(f"OCR backend '{name}' is not installed, skipping it")
+            continue
+        backend = get_ocr_backend(name)
+
+        overhead = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            backend.image_to_data(tiny, dpi=72)
+            overhead.append(time.perf_counter() - start)
+        row['call_overhead_seconds'] = statistics.median(overhead)
+
+        step = max(batch_size, 1) if backend.supports_batches else 1
+        words = 0
+        start = time.perf_counter()
+        for i in range(0, len(images), step):
+            for positions in backend.images_to_data(images[i:i + step], dpis[i:i + step]):
+                words += int(positions['text'].fillna('').str.strip().astype(bool).sum())
+        row['seconds'] = time.perf_counter() - start
+        row['seconds_per_page'] = row['seconds'] / len(images) if images else None
+        row['words'] = words
+    return pd.DataFrame(rows)
+
+
+def load_results(path: str) -> dict:
+    """
+    Loads benchmark results from a benchmark_results.json file, or from the folder it is in.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, RESULTS_FILE)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    # Configure logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic corpora, benchmark the pipeline stages and flag regressions against a baseline."
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help="Generate a synthetic contract corpus.")
+    generate_parser.add_argument("--output_dir", type=str, required=True,
+                                 help="Folder the documents are written to.")
+    generate_parser.add_argument("--documents", type=int, default=20,
+                                 help="Number of documents (default: 20).")
+    generate_parser.add_argument("--pages", type=int, default=3,
+                                 help="Pages per document (default: 3).")
+    generate_parser.add_argument("--html_fraction", type=float, default=0.5,
+                                 help="Share of HTML documents (default: 0.5).")
+    generate_parser.add_argument("--scanned_fraction", type=float, default=0.25,
+                                 help="Share of scanned PDFs; the rest are PDFs with a text layer (default: 0.25).")
+    generate_parser.add_argument("--source_dir", type=str, default=os.path.join('tests', 'docs'),
+                                 help="Folder of the fixtures the sentences are sampled from (default: tests/docs).")
+    generate_parser.add_argument("--seed", type=int, default=0,
+                                 help="Seed of the random generator (default: 0).")
+
+    run_parser = subparsers.add_parser('run', help="Time each stage of the pipeline on a corpus.")
+    run_parser.add_argument("--corpus_dir", type=str, required=True,
+                            help="Folder of PDF and HTML documents.")
+    run_parser.add_argument("--output_dir", type=str, required=True,
+                            help="Folder the results are written to.")
+    run_parser.add_argument("--model_folder", type=str, required=True,
+                            help="Path to the folder containing 'ml_classifier_gbc.pkl'.")
+    run_parser.add_argument("--repeats", type=int, default=1,
+                            help="Number of runs, the median time of each stage is reported (default: 1).")
+    run_parser.add_argument("--pdf_mode", type=str, default='auto', choices=['auto', 'ocr', 'native'],
+                            help="How PDF pages are read (default: auto).")
+    run_parser.add_argument("--ocr_workers", type=int, default=0,
+                            help="Number of worker processes PDF pages are spread over (default: 0).")
+    run_parser.add_argument("--ocr_backend", type=str, default='pytesseract',
+                            help="OCR engine of rendered PDF pages, see ocr_backends.py (default: pytesseract).")
+    run_parser.add_argument("--ocr_batch_size", type=int, default=8,
+                            help="Pages per tesseract run with the tesseract_batch backend (default: 8).")
+    run_parser.add_argument("--html_workers", type=int, default=0,
+                            help="Number of worker processes HTML files are parsed in (default: 0).")
+    run_parser.add_argument("--embedding_batch_size", type=int, default=64,
+                            help="Number of sentences encoded per forward pass (default: 64).")
+    run_parser.add_argument("--embedding_workers", type=int, default=0,
+                            help="Number of CPU worker processes used for the embeddings (default: 0).")
+    run_parser.add_argument("--onnx_model_dir", type=str, default=None,
+                            help="Embed with the ONNX export in this folder (default: the PyTorch model).")
+    run_parser.add_argument("--onnx_quantized", action="store_true",
+                            help="Use the int8 quantized model of --onnx_model_dir.")
+
+    ocr_parser = subparsers.add_parser('ocr', help="Compare the per-page cost of the OCR backends.")
+    ocr_parser.add_argument("--corpus_dir", type=str, required=True,
+                            help="Folder of PDF documents, whose pages without a text layer are OCRed.")
+    ocr_parser.add_argument("--output_dir", type=str, default=None,
+                            help=f"Folder {OCR_BENCHMARK_FILE} is written to (default: not written).")
+    ocr_parser.add_argument("--backends", type=str, nargs='+', default=None,
+                            help="OCR backends to compare (default: all).")
+    ocr_parser.add_argument("--pages", type=int, default=16,
+                            help="Maximum number of pages OCRed by each backend (default: 16).")
+    ocr_parser.add_argument("--batch_size", type=int, default=8,
+                            help="Pages per tesseract run of batching backends (default: 8).")
+
+    compare_parser = subparsers.add_parser('compare', help="Flag regressions against a baseline.")
+    compare_parser.add_argument("--baseline", type=str, required=True,
+                                help="Baseline benchmark_results.json (or the folder it is in).")
+    compare_parser.add_argument("--current", type=str, required=True,
+                                help="Benchmark_results.json to check (or the folder it is in).")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1,
+                                help="Relative change allowed before a metric is flagged (default: 0.1).")
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        manifest = generate_corpus(args.output_dir, num_documents=args.documents, pages_per_document=args.pages,
+                                   html_fraction=args.html_fraction, scanned_fraction=args.scanned_fraction,
+                                   source_dir=args.source_dir, seed=args.seed)
+        logging.info(f"Generated {len(manifest['documents'])} documents in {args.output_dir}")
+    elif args.command == 'run':
+        if args.onnx_model_dir:
+            from onnx_embedding import OnnxSentenceEncoder
+            model = OnnxSentenceEncoder(args.onnx_model_dir, quantized=args.onnx_quantized)
+        else:
+            model = None
+        results = run_benchmark(args.corpus_dir, args.output_dir, args.model_folder, sent_emb_model=model,
+                                repeats=args.repeats, pdf_mode=args.pdf_mode, ocr_workers=args.ocr_workers,
+                                ocr_backend=args.ocr_backend, ocr_batch_size=args.ocr_batch_size,
+                                html_workers=args.html_workers, embedding_batch_size=args.embedding_batch_size,
+                                embedding_workers=args.embedding_workers)
+        print(pd.DataFrame(results['stages']).T.to_string())
+        print(f"Peak RSS: {results['peak_rss_mb']} MB (workers: {results['peak_rss_children_mb']} MB)")
+    elif args.command == 'ocr':
+        pages = render_corpus_pages(args.corpus_dir, max_pages=args.pages)
+        if not pages:
+            parser.error(f"No PDF pages without a text layer in {args.corpus_dir}")
+        comparison = benchmark_ocr_backends(pages, backends=args.backends, batch_size=args.batch_size)
+        print(comparison.to_string(index=False))
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            comparison.to_csv(os.path.join(args.output_dir, OCR_BENCHMARK_FILE), index=False)
+    else:
+        baseline, current = load_results(args.baseline), load_results(args.current)
+        if baseline['corpus']['documents'] != current['corpus']['documents'] \
+                or baseline['corpus']['pdf_pages'] != current['corpus']['pdf_pages']:
+            logging.warning("The baseline was measured on a different corpus")
+        comparison = compare_results(baseline, current, tolerance=args.tolerance)
+        print(comparison.to_string(index=False))
+        regressions = comparison[comparison['regression']]
+        if len(regressions):
+            logging.error(f"{len(regressions)} metrics regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+        logging.info("No regressions.")
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import time
+from typing import List
+import numpy as np
+
+
+class DocumentCache:
+    """
+    Content-addressed, size-bounded on-disk cache for the per-document results of the
+    pipeline: the extracted text, the sentences and the sentence embeddings.
+
+    Every entry is keyed by a hash of its inputs, so entries never go stale:
+    - text: hash of the source file bytes + extraction code version + extraction options
+    - sentences: hash of the text + segmentation code version
+    - embeddings: hash of the sentences + embedding code version + embedding model id
+
+    A document whose bytes did not change finds all three entries and skips straight
+    to classification. Renaming or copying a file does not invalidate its entries.
+    When the cache grows past max_bytes, the least recently used entries are evicted.
+
+    Args:
+        cache_dir (str): Folder that holds the cache (created if needed).
+        max_bytes (int, optional): Size limit of the cache folder. Defaults to 5 GB.
+    """
+
+    STAGES = ('text', 'sentences', 'embeddings')
+
+    def __init__(self, cache_dir: str, max_bytes: int = 5 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = {stage: {'hits': 0, 'misses': 0} for stage in self.STAGES}
+        for stage in self.STAGES:
+            os.makedirs(os.path.join(cache_dir, stage), exist_ok=True)
+
+    # --- Keys ---
+
+    @staticmethod
+    def _hash(*parts) -> str:
+        """
+        Hashes strings and bytes into one hex key. Parts are length-prefixed so that
+        different splits of the same characters give different keys.
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            data = part if isinstance(part, bytes) else str(part).encode('utf-8')
+            digest.update(len(data).to_bytes(8, 'little'))
+            digest.update(data)
+        return digest.hexdigest()
+
+    @staticmethod
+    def file_hash(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+        """
+        Returns the sha256 hex digest of the bytes of a file, read in chunks.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def text_key(self, file_path: str, version: str, options: str = '') -> str:
+        return self._hash('text', self.file_hash(file_path), version, options)
+
+    def sentences_key(self, text: str, version: str) -> str:
+        return self._hash('sentences', text, version)
+
+    def embeddings_key(self, sentences: List, version: str, model_id: str) -> str:
+        return self._hash('embeddings', version, model_id, len(sentences), *sentences)
+
+    # --- Entries ---
+
+    def _path(self, stage: str, key: str, extension: str) -> str:
+        return os.path.join(self.cache_dir, stage, key[:2], key + extension)
+
+    def _lookup(self, stage: str, key: str, extension: str):
+        """
+        Returns the path of an entry and marks it as recently used, or None on a miss.
+        """
+        path = self._path(stage, key, extension)
+        if os.path.exists(path):
+            os.utime(path)
+            self.stats[stage]['hits'] += 1
+            return path
+        self.stats[stage]['misses'] += 1
+        return None
+
+    def _write(self, stage: str, key: str, extension: str, write_fn):
+        """
+        Writes an entry through a temporary file, so readers never see a partial entry.
+        """
+        path = self._path(stage, key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        write_fn(tmp_path)
+        os.replace(tmp_path, path)
+
+    def get_text(self, key: str):
+        path = self._lookup('text', key, '.txt')
+        if path is None:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def put_text(self, key: str, text: str):
+        def write(tmp_path):
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        self._write('text', key, '.txt', write)
+
+    def get_text_quality(self, key: str):
+        """
+        Returns the OCR quality metrics stored with a text entry, or None. Looked up
+        only after a text hit, so it does not count towards the cache statistics.
+        """
+        path = self._path('text', key, '.quality.json')
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def put_text_quality(self, key: str, quality: dict):
+        def write(tmp_path):
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(quality, f)
+        self._write('text', key, '.quality.json', write)
+
+    def get_sentences(self, key: str):
+        path = self._lookup('sentences', key, '.json')
+        if path is None:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def put_sentences(self, key: str, sentences: List):
+        def write(tmp_path):
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(list(sentences), f, ensure_ascii=False)
+        self._write('sentences', key, '.json', write)
+
+    def get_embeddings(self, key: str):
+        path = self._lookup('embeddings', key, '.npy')
+        if path is None:
+            return None
+        return np.load(path)
+
+    def put_embeddings(self, key: str, embeddings: np.ndarray):
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.asarray(embeddings, dtype=np.float32))
+        self._write('embeddings', key, '.npy', write)
+
+    # --- Eviction ---
+
+    def _entries(self):
+        for stage in self.STAGES:
+            for root, _, files in os.walk(os.path.join(self.cache_dir, stage)):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    def size(self) -> int:
+        """
+        Returns the total size in bytes of the cache entries.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def prune(self) -> int:
+        """
+        Evicts the least recently used entries until the cache fits in max_bytes.
+        Leftover temporary files older than an hour are removed as well.
+
+        Returns:
+            int: Number of files removed.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, mtime in entries:
+            is_stale_tmp = path.endswith('.tmp') and mtime < time.time() - 3600
+            if total <= self.max_bytes and not is_stale_tmp:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,106 @@
+import hashlib
+import re
+import sqlite3
+import time
+from typing import List
+import numpy as np
+
+
+def normalize_sentence(sentence: str) -> str:
+    """
+    Normalizes a sentence for embedding: strips it and collapses runs of whitespace
+    (spaces, tabs, newlines) into single spaces. The embedding tokenizer splits on
+    any whitespace, so the normalized sentence gets the same embedding.
+    """
+    return re.sub(r'\s+', ' ', sentence).strip()
+
+
+class SentenceEmbeddingCache:
+    """
+    Persistent memo of sentence embeddings, keyed by embedding model and normalized
+    sentence text, for corpora where thousands of documents share the same
+    boilerplate sentences.
+
+    Entries are kept in a SQLite file. When it holds more than max_entries entries,
+    the least recently used ones are evicted. Hit and miss counts of the current
+    process are kept in `stats`.
+
+    Args:
+        db_path (str): Path of the SQLite file (created if needed).
+        model_id (str): Identifier of the embedding model; embeddings of other models
+                        in the same file are never returned.
+        max_entries (int, optional): Number of embeddings kept. Defaults to 2,000,000.
+    """
+
+    _LOOKUP_CHUNK = 500
+
+    def __init__(self, db_path: str, model_id: str, max_entries: int = 2_000_000):
+        self.db_path = db_path
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.stats = {'sentences': 0, 'unique': 0, 'hits': 0, 'misses': 0}
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.conn.commit()
+
+    def key(self, normalized_sentence: str) -> str:
+        return hashlib.sha1(f"{self.model_id}\x00{normalized_sentence}".encode('utf-8')).hexdigest()
+
+    def get_many(self, keys: List) -> dict:
+        """
+        Looks up embeddings by key and marks the found ones as recently used.
+
+        Returns:
+            dict: key -> float32 embedding, for the keys found in the cache.
+        """
+        found = {}
+        for i in range(0, len(keys), self._LOOKUP_CHUNK):
+            chunk = keys[i:i + self._LOOKUP_CHUNK]
+            rows = self.conn.execute(
+                f"SELECT key, dim, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+            for key, dim, vector in rows:
+                found[key] = np.frombuffer(vector, dtype=np.float32, count=dim)
+
+        now = time.time()
+        self.conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+        self.conn.commit()
+        self.stats['hits'] += len(found)
+        self.stats['misses'] += len(keys) - len(found)
+        return found
+
+    def put_many(self, keys: List, embeddings: np.ndarray):
+        """
+        Stores one embedding (row of `embeddings`) per key, then evicts the least
+        recently used entries beyond max_entries.
+        """
+        now = time.time()
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, dim, vector, last_used) VALUES (?, ?, ?, ?)",
+            [(key, embeddings.shape[1], emb.tobytes(), now) for key, emb in zip(keys, embeddings)])
+
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+        self.conn.commit()
+
+    def hit_rate(self) -> float:
+        """
+        Share of sentences of this process that did not need a forward pass, either
+        because they repeat a sentence of the same run or were found in the cache.
+        """
+        if not self.stats['sentences']:
+            return 0.0
+        return 1 - self.stats['misses'] / self.stats['sentences']
+
+    def close(self):
+        self.conn.close()
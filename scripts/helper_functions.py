@@ -1,69 +1,108 @@
-import fitz
 import pandas as pd
-import pytesseract
-from pytesseract import Output
-from PIL import Image
-import spacy
 import os
-import matplotlib.pyplot as plt
 from typing import List
-from bs4 import BeautifulSoup
-import pickle
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import codecs
+import itertools
+import json
+import re
+from collections import deque
+import string
+import time
+from embedding_cache import normalize_sentence
+from models import get_spacy_pipeline, get_english_lexicon, get_classifier, load_clause_models
+from ocr_backends import get_ocr_backend
+from top_k import TopKReducer
 
-def pdf_to_text_with_ocr(pdf_path: str, output_txt_path: str):
+# Heavy dependencies (fitz, pytesseract, PIL, spaCy, matplotlib, BeautifulSoup) are
+# imported inside the functions that use them, so that importing this module stays fast.
+
+# Versions of the code behind each per-document stage. Bump a version whenever a change
+# alters the output of its stage, so that cached results (see document_cache.py) are
+# recomputed instead of reused.
+STAGE_VERSIONS = {'pdf': '4', 'html': '2', 'segment': '2', 'embed': '1'}
+
+def pdf_to_text_with_ocr(pdf_path: str, output_txt_path: str, mode: str = 'auto',
+                         export_excel: bool = False, render_options: dict = None,
+                         ocr_backend='pytesseract', ocr_batch_size: int = 8):
     """
-    Behavior:  The filename of the PDF is used to create two automatically saved output
-    files - a text file and an Excel file - to the designated folder.
-    Any errors are printed to the screen.
+    Behavior:  The filename of the PDF is used to create three automatically saved output
+    files - a text file, a Parquet file of word positions and an OCR quality file - to
+    the designated folder (see save_pdf_outputs). Any errors are printed to the screen.
+
+    Each page is read in one of these ways, recorded per page in the returned report
+    and in the 'method' column of the positions file:
+    - 'native': the text and word boxes are read directly from the PDF text layer
+    - 'ocr': the page is rendered as an image and read with Tesseract OCR
+    - 'blank': the rendered page has (almost) no dark pixels and is not OCRed
 
     Parameters:
     - pdf_path (str): filepath to the PDF on local disk
     - output_txt_path (str): filepath to the folder in which to save
+    - mode (str): 'auto' uses the text layer when it is usable and OCR otherwise,
+                  'ocr' always uses OCR and 'native' never does
+    - export_excel (bool): Also save the word positions as an Excel file
+    - render_options (dict): How pages are rendered for OCR, see RENDER_DEFAULTS
+    - ocr_backend (str or OcrBackend): OCR engine, see ocr_backends.OCR_BACKENDS
+    - ocr_batch_size (int): Number of rendered pages OCRed together by backends that
+                            support batches (such as 'tesseract_batch'), which caps the
+                            page images held in memory at once
 
-    Returns: None
+    Returns:
+    - page_report (DataFrame): One row per page with the columns 'page_num', 'method',
+                               'char_count', 'error', the page quality metrics
+                               (see ocr_quality_metrics) and the render DPI, share of
+                               dark pixels and render and OCR times (see PAGE_TIMING_COLUMNS)
 
     ## Example usage:
     # pdf_file_path = os.path.join(HOME_DIRECTORY, "test.pdf")
     # output_text_file_path = os.path.join(HOME_DIRECTORY, text_files)
     # pdf_to_text_with_ocr(pdf_file_path, output_text_file_path)
     """
+    if mode not in PDF_MODES:
+        raise ValueError(f"Unknown PDF mode '{mode}', expected one of {PDF_MODES}")
+    render_options = render_options_with_defaults(render_options)
+
+    import fitz
+
     try:
         # Open the PDF file using PyMuPDF
         pdf_document = fitz.open(pdf_path)
-        pdf_name = os.path.basename(pdf_path) + '.txt'
-        excel_name = os.path.basename(pdf_path) + '.xlsx'
-
-        # Initialize an empty string to store the text content
-        text_content = ""
-        # Initialize an empty pandas db to store positions
-        positions_df = pd.DataFrame()
-
-        # Iterate through each page in the PDF
-        for page_num in range(pdf_document.page_count):
-            # Get the current page
-            page = pdf_document[page_num]
+        pages = []
+        batch_size = max(ocr_batch_size, 1) if get_ocr_backend(ocr_backend).supports_batches else 1
+        to_ocr = []  # rendered pages waiting for OCR: (page index, image, timings)
 
-            # Render the page as an image
-            image = page.get_pixmap()
-            img = Image.frombytes("RGB", (image.width, image.height), image.samples)
-
-            # Perform OCR using pytesseract on the image
-            page_text = pytesseract.image_to_string(img, lang='eng')
-            positions = pytesseract.image_to_data(img, output_type=Output.DATAFRAME)
-
-            # Append the extracted text to the overall content
-            text_content += page_text
-            positions_df = pd.concat([positions_df, positions], ignore_index=True)
+        try:
+            # Iterate through each page in the PDF
+            for page_num in range(pdf_document.page_count):
+                # Get the current page and pull its text with the native text layer, or render it for OCR
+                page = pdf_document[page_num]
+                timings = {}
+                positions, method, image = prepare_pdf_page(page, mode=mode, render_options=render_options,
+                                                            timings=timings)
+                pages.append({'page_num': page_num + 1, 'positions': positions, 'method': method,
+                              'error': None, **timings})
+                if image is not None:
+                    to_ocr.append((page_num, image, timings))
 
-        # Save the text content to a text file
-        with open(os.path.join(output_txt_path, pdf_name), 'w', encoding='utf-8') as txt_file:
-            txt_file.write(text_content)
+                # OCR the rendered pages once a batch is full or the document is done
+                if to_ocr and (len(to_ocr) >= batch_size or page_num == pdf_document.page_count - 1):
+                    batch_timings = [timings for _, _, timings in to_ocr]
+                    ocr_page_images(ocr_backend, [image for _, image, _ in to_ocr], batch_timings)
+                    for (index, _, _), timings in zip(to_ocr, batch_timings):
+                        pages[index].update(timings)
+                    to_ocr = []
+        finally:
+            # Pages rendered but not OCRed when an error stopped the document
+            for _, image, _ in to_ocr:
+                image.close()
 
-        # Save positions to spreadsheet
-        positions_df.to_excel(os.path.join(output_txt_path, excel_name), index=False)
+        for page in pages:
+            page['text'], page['positions'], _ = finish_pdf_page(page['positions'], page['method'])
 
-        # Print a success message
-        print(f"OCR completed successfully. Text saved at: {os.path.join(output_txt_path, pdf_name)}")
+        # Save the text and positions, and print a success message
+        return save_pdf_outputs(pdf_path, output_txt_path, pages, export_excel=export_excel)
 
     except OSError as err:
         print("OS error:", err)
@@ -74,54 +113,874 @@ def pdf_to_text_with_ocr(pdf_path: str, output_txt_path: str):
         raise
 
 
-def pull_text_from_html(file_list):
+def save_pdf_outputs(pdf_path: str, output_txt_path: str, pages: List,
+                     export_excel: bool = False) -> pd.DataFrame:
     """
-    Extracts and cleans text content from a list of HTML files.
+    Behavior: Save the extracted pages of one PDF as a text file, a Parquet file of
+    word positions (see save_page_positions) and a JSON file of OCR quality metrics
+    (see ocr_quality_metrics), named after the PDF, in the designated folder.
 
-    This function iterates through a list of file paths, attempts to open each file,
-    and handles potential encoding errors by first trying 'windows-1252' and then
-    'utf-8'. It then uses BeautifulSoup to parse the HTML content and extract
-    all text, joining it into a single, clean string.
+    Parameters:
+    - pdf_path (str): filepath to the PDF on local disk
+    - output_txt_path (str): filepath to the folder in which to save
+    - pages (list): One dict per page, in page order, with the keys 'page_num', 'text',
+                    'positions', 'method' and 'error', and optionally those of PAGE_TIMING_COLUMNS
+    - export_excel (bool): Also save the word positions as an Excel file
 
-    Args:
-        file_list (list): A list of file paths to HTML documents.
+    Returns:
+    - page_report (DataFrame): One row per page with the columns 'page_num', 'method',
+                               'char_count', 'error', the page quality metrics and
+                               PAGE_TIMING_COLUMNS
+    """
+    pdf_name = os.path.basename(pdf_path) + '.txt'
+    excel_name = os.path.basename(pdf_path) + '.xlsx'
+    quality_name = os.path.basename(pdf_path) + QUALITY_SUFFIX
+
+    # Join the page texts and positions in page order
+    text_content = ''.join(page['text'] for page in pages)
+    positions_df = pd.concat([page['positions'] for page in pages], ignore_index=True) if pages \
+        else pd.DataFrame()
+
+    # Save the text content to a text file
+    with open(os.path.join(output_txt_path, pdf_name), 'w', encoding='utf-8') as txt_file:
+        txt_file.write(text_content)
+
+    # Save positions, one row group per page, and optionally to a spreadsheet
+    save_page_positions(os.path.join(output_txt_path, os.path.basename(pdf_path) + POSITIONS_SUFFIX), pages)
+    if export_excel:
+        positions_df.to_excel(os.path.join(output_txt_path, excel_name), index=False)
+
+    # Compute the quality metrics of each page and of the whole document from the
+    # word confidences and words already in the positions, and save them with the text
+    lexicon = _load_lexicon_or_none()
+    page_quality = [ocr_quality_metrics(page['positions'], lexicon) for page in pages]
+    quality = {'document': ocr_quality_metrics(positions_df, lexicon),
+               'pages': [{'page_num': page['page_num'], 'method': page['method'], **metrics}
+                         for page, metrics in zip(pages, page_quality)]}
+    with open(os.path.join(output_txt_path, quality_name), 'w', encoding='utf-8') as quality_file:
+        json.dump(quality, quality_file, indent=1)
+
+    # Print a success message
+    print(f"OCR completed successfully. Text saved at: {os.path.join(output_txt_path, pdf_name)}")
+
+    page_report = [{'page_num': page['page_num'], 'method': page['method'], **metrics,
+                    'char_count': len(page['text']), 'error': page['error'],
+                    **{column: page.get(column) for column in PAGE_TIMING_COLUMNS}}
+                   for page, metrics in zip(pages, page_quality)]
+    return pd.DataFrame(page_report, columns=['page_num', 'method', *OCR_QUALITY_METRICS, 'char_count', 'error',
+                                              *PAGE_TIMING_COLUMNS])
+
+
+# Render and OCR measurements of each page in the page report, see extract_pdf_page
+PAGE_TIMING_COLUMNS = ['dpi', 'ink_ratio', 'render_seconds', 'ocr_seconds']
+
+
+# Name suffix of the OCR quality file saved next to each PDF's text file
+QUALITY_SUFFIX = '.quality.json'
+
+# Name suffix of the word positions file saved next to each PDF's text file
+POSITIONS_SUFFIX = '.positions.parquet'
+
+# Columns of the word positions file and their types: Tesseract's image_to_data
+# layout with the page number of the PDF, plus the method the page was read with
+POSITION_COLUMNS = {'level': 'int32', 'page_num': 'int32', 'block_num': 'int32', 'par_num': 'int32',
+                    'line_num': 'int32', 'word_num': 'int32', 'left': 'int32', 'top': 'int32',
+                    'width': 'int32', 'height': 'int32', 'conf': 'float32', 'text': 'string',
+                    'method': 'string'}
+
+
+def typed_page_positions(positions: pd.DataFrame, page_num: int, method: str) -> pd.DataFrame:
+    """
+    Behavior: Give the positions of one page the columns and types of POSITION_COLUMNS,
+    with page_num set to the page of the PDF (Tesseract always reports page 1).
+
+    Parameters:
+    - positions (DataFrame): Word positions of the page, as returned by extract_pdf_page
+    - page_num (int): 1-based page number within the PDF
+    - method (str): How the page was read, used when positions has no 'method' column
 
     Returns:
-        list: A list of strings, where each string contains the cleaned text
-              content from the corresponding HTML file.
+    - positions (DataFrame): The typed word positions
+    """
+    typed = positions.reindex(columns=list(POSITION_COLUMNS))
+    typed['page_num'] = page_num
+    if 'method' not in positions:
+        typed['method'] = method
+    for column, dtype in POSITION_COLUMNS.items():
+        if dtype == 'int32':
+            typed[column] = typed[column].fillna(-1)
+    return typed.astype(POSITION_COLUMNS).reset_index(drop=True)
+
+
+def save_page_positions(positions_path: str, pages: List):
+    """
+    Behavior: Save the word positions of a PDF as a Parquet file with one row group per
+    page, written page by page. A single page can then be loaded without reading the
+    rest of the file (see load_page_positions).
+
+    Parameters:
+    - positions_path (str): filepath of the Parquet file
+    - pages (list): One dict per page, in page order, with the keys 'page_num',
+                    'positions' and 'method'
+
+    Returns: None
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    empty = typed_page_positions(pd.DataFrame(), 0, '')
+    schema = pa.Schema.from_pandas(empty, preserve_index=False)
+    with pq.ParquetWriter(positions_path, schema) as writer:
+        for page in pages:
+            typed = typed_page_positions(page['positions'], page['page_num'], page['method'])
+            if len(typed):
+                writer.write_table(pa.Table.from_pandas(typed, schema=schema, preserve_index=False))
+
+
+def load_page_positions(positions_path: str, page_num: int = None) -> pd.DataFrame:
+    """
+    Behavior: Load the word positions saved by save_pdf_outputs, for example to
+    highlight a sentence on its page. Row groups of other pages are skipped unread.
+
+    Parameters:
+    - positions_path (str): filepath of the Parquet positions file
+    - page_num (int): 1-based page number to load (defaults to all pages)
+
+    Returns:
+    - positions (DataFrame): Word positions with the columns of POSITION_COLUMNS
+    """
+    filters = [('page_num', '==', page_num)] if page_num is not None else None
+    return pd.read_parquet(positions_path, filters=filters)
+
+# Metrics computed by ocr_quality_metrics
+OCR_QUALITY_METRICS = ['word_count', 'mean_conf', 'p10_conf', 'p50_conf', 'dictionary_ratio']
+
+
+def ocr_quality_metrics(positions: pd.DataFrame, lexicon=None) -> dict:
+    """
+    Behavior: Compute OCR quality metrics from the words and word confidences that
+    Tesseract returned, without another pass over the text.
+
+    Parameters:
+    - positions (DataFrame): Word positions in Tesseract's image_to_data layout
+    - lexicon (set): Lowercase English words (see models.get_english_lexicon). Without
+                     a lexicon the dictionary ratio is left empty.
+
+    Returns:
+    - metrics (dict): 'word_count', the mean, 10th and 50th percentile of the word
+                      confidences (0-100, empty for pages read from the native text
+                      layer) and 'dictionary_ratio', the share of words that are
+                      English dictionary words (0-1)
+    """
+    metrics = dict.fromkeys(OCR_QUALITY_METRICS)
+    if 'text' not in positions:
+        metrics['word_count'] = 0
+        return metrics
+
+    words = positions[(positions['level'] == 5) & positions['text'].notna()]
+    words = words[words['text'].astype(str).str.strip() != '']
+    metrics['word_count'] = len(words)
+    if not len(words):
+        return metrics
+
+    # Confidence statistics of the OCR words (native words have no confidence)
+    confidences = pd.to_numeric(words['conf'], errors='coerce')
+    confidences = confidences[confidences >= 0].to_numpy(dtype=float)
+    if len(confidences):
+        metrics['mean_conf'] = float(confidences.mean())
+        metrics['p10_conf'], metrics['p50_conf'] = (float(v) for v in np.percentile(confidences, [10, 50]))
+
+    # Share of words (without surrounding punctuation) found in the English dictionary
+    if lexicon is not None:
+        stripped = (str(word).strip(string.punctuation) for word in words['text'])
+        english_words = sum(1 for word in stripped if word.isalpha() and word.lower() in lexicon)
+        metrics['dictionary_ratio'] = english_words / len(words)
+    return metrics
+
+
+def _load_lexicon_or_none():
+    """
+    Returns the English lexicon, or None (with a warning) when the spaCy model is missing.
+    """
+    try:
+        return get_english_lexicon()
+    except OSError as err:
+        print(f"English lexicon unavailable, dictionary ratios are not computed: {err}")
+        return None
+
+
+def read_ocr_quality(folder_path: str, filenames: List) -> List:
+    """
+    Behavior: Read the document-level dictionary ratio saved by save_pdf_outputs for
+    each text file, for use as its OCR quality score.
+
+    Parameters:
+    - folder_path (str): Path to the folder containing the .txt files
+    - filenames (list): Names of the text files, as returned by read_text_files
+
+    Returns:
+    - ocr_quality_scores (list): The score of each file, or None where no OCR quality
+                                 file (or no dictionary ratio) was saved
+    """
+    scores = []
+    for filename in filenames:
+        quality_path = os.path.join(folder_path, filename[:-len('.txt')] + QUALITY_SUFFIX)
+        try:
+            with open(quality_path, 'r', encoding='utf-8') as quality_file:
+                scores.append(json.load(quality_file)['document']['dictionary_ratio'])
+        except (OSError, ValueError, KeyError):
+            scores.append(None)
+    return scores
+
+
+# Documents kept open by each OCR pool worker, so that pages of the same PDF
+# do not reopen the file
+_worker_pdf_documents = {}
+_WORKER_MAX_OPEN_DOCUMENTS = 4
+
+
+def _init_ocr_worker():
+    """
+    Initializer for OCR pool workers: limits each Tesseract run to one thread, so
+    that N workers use N cores instead of competing for them.
+    """
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+
+
+def _extract_pdf_page_task(pdf_path: str, page_num: int, mode: str, render_options: dict = None,
+                           ocr_backend: str = 'pytesseract') -> dict:
+    """
+    Extracts one page (0-based page_num) of a PDF in an OCR pool worker. Errors are
+    returned with the page instead of raised, so one bad page does not fail its document.
+    """
+    import fitz
+
+    timings = {}
+    try:
+        pdf_document = _worker_pdf_documents.get(pdf_path)
+        if pdf_document is None:
+            if len(_worker_pdf_documents) >= _WORKER_MAX_OPEN_DOCUMENTS:
+                _worker_pdf_documents.pop(next(iter(_worker_pdf_documents))).close()
+            pdf_document = _worker_pdf_documents[pdf_path] = fitz.open(pdf_path)
+
+        page_text, positions, method = extract_pdf_page(pdf_document[page_num], mode=mode,
+                                                        render_options=render_options, timings=timings,
+                                                        ocr_backend=ocr_backend)
+        return {'page_num': page_num + 1, 'text': page_text, 'positions': positions,
+                'method': method, 'error': None, **timings}
+    except Exception as err:
+        return {**_failed_page(page_num, err), **timings}
+
+
+def _failed_page(page_num: int, err: Exception) -> dict:
+    """
+    Page result for a page that could not be extracted: no text and no positions.
+    """
+    return {'page_num': page_num + 1, 'text': '\f', 'positions': pd.DataFrame({'level': []}),
+            'method': 'failed', 'error': f"{type(err).__name__}: {err}"}
+
+
+def ocr_pdfs_parallel(pdf_files: List, output_txt_path: str, mode: str = 'auto',
+                      max_workers: int = None, max_pending_pages: int = None,
+                      export_excel: bool = False, render_options: dict = None,
+                      ocr_backend: str = 'pytesseract') -> dict:
+    """
+    Behavior: Extract the text of many PDFs by spreading their pages (document x page)
+    over a pool of worker processes. Pages are put back in order per document, and
+    each document is saved (see save_pdf_outputs) as soon as all of its pages are done.
+    A page that fails is saved as an empty page and reported with method 'failed',
+    while the rest of its document is kept.
+
+    Parameters:
+    - pdf_files (list): filepaths to the PDFs on local disk
+    - output_txt_path (str): filepath to the folder in which to save
+    - mode (str): 'auto', 'ocr' or 'native', see pdf_to_text_with_ocr
+    - max_workers (int): Number of worker processes (defaults to the number of CPUs)
+    - max_pending_pages (int): Maximum number of pages submitted to the pool and not yet
+                               collected, which caps the pages rendered or held in
+                               memory at once (defaults to 2 x max_workers)
+    - export_excel (bool): Also save the word positions as Excel files
+    - render_options (dict): How pages are rendered for OCR, see RENDER_DEFAULTS
+    - ocr_backend (str): Name of the OCR engine, see ocr_backends.OCR_BACKENDS. Each
+                         worker keeps its own engine and OCRs one page at a time
+
+    Returns:
+    - page_reports (dict): PDF filepath -> page report DataFrame (see save_pdf_outputs).
+                           PDFs that cannot be opened are left out.
     """
-    clean_texts = []
+    import fitz
 
-    # Iterate through each file path provided in the list
-    for f in file_list:
-        html_string = ''  # Initialize an empty string to hold the HTML content
+    if mode not in PDF_MODES:
+        raise ValueError(f"Unknown PDF mode '{mode}', expected one of {PDF_MODES}")
+    render_options = render_options_with_defaults(render_options)
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending_pages = max(max_pending_pages or 2 * max_workers, 1)
 
-        # First, try to open the file using the 'windows-1252' encoding
+    # Count the pages of each document, skipping files that are not readable PDFs
+    page_counts = {}
+    for pdf_path in pdf_files:
         try:
-            with open(f, 'r', encoding='windows-1252') as file:
-                html_string = file.read()
-        except Exception as e1:
-            print(f'Encoding error with windows-1252 for file {f}: {e1}')
+            with fitz.open(pdf_path) as pdf_document:
+                page_counts[pdf_path] = pdf_document.page_count
+        except Exception as err:
+            print(f"Unable to open PDF {pdf_path}: {err}")
+
+    tasks = ((pdf_path, page_num) for pdf_path, count in page_counts.items() for page_num in range(count))
+    done_pages = {pdf_path: {} for pdf_path in page_counts}
+    page_reports = {}
+
+    # Documents without pages are saved straight away
+    for pdf_path in [pdf_path for pdf_path, count in page_counts.items() if count == 0]:
+        page_reports[pdf_path] = save_pdf_outputs(pdf_path, output_txt_path, [], export_excel=export_excel)
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_ocr_worker) as executor:
+        pending = {}
+        while True:
+            # Keep at most max_pending_pages pages in flight
+            for pdf_path, page_num in itertools.islice(tasks, max_pending_pages - len(pending)):
+                future = executor.submit(_extract_pdf_page_task, pdf_path, page_num, mode, render_options,
+                                         ocr_backend)
+                pending[future] = (pdf_path, page_num)
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                pdf_path, page_num = pending.pop(future)
+                try:
+                    page = future.result()
+                except Exception as err:
+                    page = _failed_page(page_num, err)
+                done_pages[pdf_path][page_num] = page
+
+                # Save the document once all of its pages are in
+                if len(done_pages[pdf_path]) == page_counts[pdf_path]:
+                    pages = [done_pages[pdf_path][i] for i in range(page_counts[pdf_path])]
+                    del done_pages[pdf_path]
+                    try:
+                        page_reports[pdf_path] = save_pdf_outputs(pdf_path, output_txt_path, pages,
+                                                                  export_excel=export_excel)
+                    except Exception as err:
+                        print(f"Error saving outputs for PDF {pdf_path}: {err}")
+
+    return page_reports
+
+
+def pdf_to_text(pdf_path: str, mode: str = 'auto', render_options: dict = None,
+                ocr_backend='pytesseract') -> str:
+    """
+    Behavior: Pull the text of a PDF like pdf_to_text_with_ocr, but return it instead
+    of saving text and positions files. Errors are raised to the caller.
+
+    Parameters:
+    - pdf_path (str): filepath to the PDF on local disk
+    - mode (str): 'auto', 'ocr' or 'native', see pdf_to_text_with_ocr
+    - render_options (dict): How pages are rendered for OCR, see RENDER_DEFAULTS
+    - ocr_backend (str or OcrBackend): OCR engine, see ocr_backends.OCR_BACKENDS
+
+    Returns:
+    - text_content (str): Text of all pages, in page order
+    """
+    if mode not in PDF_MODES:
+        raise ValueError(f"Unknown PDF mode '{mode}', expected one of {PDF_MODES}")
+
+    import fitz
+
+    with fitz.open(pdf_path) as pdf_document:
+        return ''.join(extract_pdf_page(page, mode=mode, render_options=render_options,
+                                        ocr_backend=ocr_backend)[0]
+                       for page in pdf_document)
+
+
+# Ways of reading the pages of a PDF, see pdf_to_text_with_ocr
+PDF_MODES = ('auto', 'ocr', 'native')
+
 
-            # If 'windows-1252' fails, try 'utf-8' encoding
+# Rendering of pages for OCR, see render_page_for_ocr. Any of these can be overridden
+# with the render_options of the PDF functions.
+RENDER_DEFAULTS = {
+    'dpi': 'auto',             # Fixed DPI, or 'auto' to follow the resolution of the page's scan
+    'min_dpi': 150,            # Range of the 'auto' DPI: below 150 dpi small print is lost,
+    'max_dpi': 300,            # and above 300 dpi OCR gets slower without getting better
+    'default_dpi': 300,        # 'auto' DPI of pages without a scanned image
+    'grayscale': True,         # Render one gray channel instead of RGB
+    'binarize': False,         # Threshold the gray page to black and white (Otsu's method)
+    'blank_ink_ratio': 0.0001  # Pages with a lower share of dark pixels are not OCRed (0 OCRs every
+                               # page). A short heading line covers about 0.001 of a letter page.
+}
+
+# Gray level below which a pixel counts as ink in the blank page check
+INK_LEVEL = 128
+
+
+def render_options_with_defaults(render_options: dict = None) -> dict:
+    """
+    Behavior: Merge render options over RENDER_DEFAULTS, rejecting unknown options.
+    """
+    unknown = set(render_options or {}) - set(RENDER_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown render options {sorted(unknown)}, expected some of {list(RENDER_DEFAULTS)}")
+    return {**RENDER_DEFAULTS, **(render_options or {})}
+
+
+def page_render_dpi(page, options: dict) -> int:
+    """
+    Behavior: Choose the DPI a page is rendered at for OCR. A fixed 'dpi' is used as is.
+    With 'auto', the page is rendered at the resolution of its largest embedded image
+    (the scan), since rendering above it adds no detail and rendering below it loses
+    small print, within [min_dpi, max_dpi]. Pages without images get default_dpi.
+
+    Parameters:
+    - page (fitz.Page): page of an open PyMuPDF document
+    - options (dict): render options, see RENDER_DEFAULTS
+
+    Returns:
+    - dpi (int): The render resolution
+    """
+    if options['dpi'] != 'auto':
+        return int(options['dpi'])
+
+    best_area, dpi = 0, options['default_dpi']
+    for image in page.get_image_info():
+        x0, y0, x1, y1 = image['bbox']
+        area = (x1 - x0) * (y1 - y0)
+        if area > best_area and x1 > x0:
+            best_area, dpi = area, image['width'] * 72 / (x1 - x0)
+    return int(round(min(max(dpi, options['min_dpi']), options['max_dpi'])))
+
+
+def render_page_for_ocr(page, options: dict):
+    """
+    Behavior: Render a page for OCR at the DPI chosen by page_render_dpi, in grayscale
+    (or RGB), and measure its share of dark pixels. The image wraps the pixmap's memory
+    without copying it, unless it is binarized, so close the image when done with it.
+
+    Parameters:
+    - page (fitz.Page): page of an open PyMuPDF document
+    - options (dict): render options, see RENDER_DEFAULTS
+
+    Returns:
+    - image (PIL.Image): The rendered page ('L' or 'RGB')
+    - dpi (int): The render resolution
+    - ink_ratio (float): Share of pixels darker than INK_LEVEL
+    """
+    import fitz
+    from PIL import Image
+
+    dpi = page_render_dpi(page, options)
+    colorspace = fitz.csGRAY if options['grayscale'] or options['binarize'] else fitz.csRGB
+    pixmap = page.get_pixmap(dpi=dpi, colorspace=colorspace, alpha=False)
+
+    # View the samples as a (height, width, channels) array, skipping row padding
+    samples = np.frombuffer(pixmap.samples_mv, dtype=np.uint8).reshape(pixmap.height, pixmap.stride)
+    pixels = samples[:, :pixmap.width * pixmap.n].reshape(pixmap.height, pixmap.width, pixmap.n)
+    gray = pixels[:, :, 0] if pixmap.n == 1 else pixels.min(axis=2)
+    ink_ratio = float((gray < INK_LEVEL).mean()) if gray.size else 0.0
+
+    if options['binarize']:
+        image = Image.fromarray(np.where(gray > otsu_threshold(gray), 255, 0).astype(np.uint8), 'L')
+    else:
+        mode = 'L' if pixmap.n == 1 else 'RGB'
+        image = Image.frombuffer(mode, (pixmap.width, pixmap.height), pixmap.samples_mv, 'raw', mode,
+                                 pixmap.stride, 1)
+        image.pixmap = pixmap  # Keep the pixmap memory alive as long as the image
+    return image, dpi, ink_ratio
+
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    """
+    Behavior: Gray level that best separates ink from paper (Otsu's method), from the
+    histogram of a grayscale image.
+    """
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    weight_dark = np.cumsum(histogram)
+    weight_light = weight_dark[-1] - weight_dark
+    levels_sum = np.cumsum(histogram * np.arange(256))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_dark = levels_sum / weight_dark
+        mean_light = (levels_sum[-1] - levels_sum) / weight_light
+        between = weight_dark * weight_light * (mean_dark - mean_light) ** 2
+    return int(np.nanargmax(between)) if np.isfinite(between).any() else INK_LEVEL
+
+
+def extract_pdf_page(page, mode: str = 'auto', render_options: dict = None, timings: dict = None,
+                     ocr_backend='pytesseract'):
+    """
+    Behavior: Pull the text and word positions from a single PDF page, either from
+    the native text layer or through OCR of the rendered page (see render_page_for_ocr).
+    Rendered pages with almost no dark pixels are blank and are not OCRed.
+
+    Parameters:
+    - page (fitz.Page): page of an open PyMuPDF document
+    - mode (str): 'auto', 'ocr' or 'native', see pdf_to_text_with_ocr
+    - render_options (dict): options of the page rendering, see RENDER_DEFAULTS
+    - timings (dict): when given, filled with the 'dpi', 'ink_ratio', 'render_seconds'
+                      and 'ocr_seconds' of the page (None for native pages)
+    - ocr_backend (str or OcrBackend): OCR engine, see ocr_backends.OCR_BACKENDS
+
+    Returns:
+    - page_text (str): Text of the page, laid out like Tesseract's text output
+    - positions (DataFrame): Word positions in Tesseract's image_to_data layout, in
+                             PDF points, plus a 'method' column
+    - method (str): 'native', 'ocr' or 'blank', the method used for the page
+    """
+    # Filled as the page goes, so the render measurements are kept when OCR fails
+    page_timings = timings if timings is not None else {}
+    positions, method, image = prepare_pdf_page(page, mode=mode, render_options=render_options,
+                                                timings=page_timings)
+    if image is not None:
+        ocr_page_images(ocr_backend, [image], [page_timings])
+        positions = page_timings.pop('positions')
+    return finish_pdf_page(positions, method)
+
+
+def prepare_pdf_page(page, mode: str = 'auto', render_options: dict = None, timings: dict = None):
+    """
+    Behavior: First half of extract_pdf_page: read the page from its text layer, or
+    render it for OCR and tell blank pages apart. The OCR itself is left to the caller
+    (see ocr_page_images), so that the pages of a document can be OCRed in batches.
+
+    Parameters:
+    - page (fitz.Page): page of an open PyMuPDF document
+    - mode (str): 'auto', 'ocr' or 'native', see pdf_to_text_with_ocr
+    - render_options (dict): options of the page rendering, see RENDER_DEFAULTS
+    - timings (dict): when given, filled like in extract_pdf_page (ocr_seconds stays None)
+
+    Returns:
+    - positions (DataFrame): Word positions of native and blank pages, None for pages to OCR
+    - method (str): 'native', 'ocr' or 'blank'
+    - image (PIL.Image): The rendered page to OCR, None for native and blank pages. The
+                         caller closes it once OCRed
+    """
+    options = render_options_with_defaults(render_options)
+    page_timings = timings if timings is not None else {}
+    page_timings.update(dpi=None, ink_ratio=None, render_seconds=None, ocr_seconds=None)
+    words = page.get_text("words") if mode != 'ocr' else []
+
+    if mode == 'native' or (mode == 'auto' and text_layer_is_usable(words, page=page)):
+        return native_words_to_data(words), 'native', None
+
+    start = time.perf_counter()
+    image, dpi, ink_ratio = render_page_for_ocr(page, options)
+    page_timings.update(dpi=dpi, ink_ratio=ink_ratio, render_seconds=time.perf_counter() - start)
+    if ink_ratio < options['blank_ink_ratio']:
+        # Release the image's view of the pixmap memory before the pixmap is freed
+        image.close()
+        return native_words_to_data([]), 'blank', None
+    return None, 'ocr', image
+
+
+def ocr_page_images(ocr_backend, images: List, timings: List):
+    """
+    Behavior: OCR rendered pages (see prepare_pdf_page) with one call to the backend,
+    which backends that support batches run as a single Tesseract job. The word
+    positions of each page are stored under 'positions' in its timings, scaled to
+    PDF points, and the OCR time of the call is shared evenly between the pages.
+    The images are closed, also when the OCR fails.
+
+    Parameters:
+    - ocr_backend (str or OcrBackend): OCR engine, see ocr_backends.OCR_BACKENDS
+    - images (list): The rendered page images
+    - timings (list): The timings dict of each page, with the 'dpi' it was rendered at
+    """
+    try:
+        start = time.perf_counter()
+        results = get_ocr_backend(ocr_backend).images_to_data(images, [t['dpi'] for t in timings])
+        ocr_seconds = (time.perf_counter() - start) / len(images)
+        for positions, page_timings in zip(results, timings):
+            scale_boxes_to_points(positions, page_timings['dpi'])
+            page_timings.update(ocr_seconds=ocr_seconds, positions=positions)
+    finally:
+        # Release the images' view of the pixmap memory before the pixmaps are freed
+        for image in images:
+            image.close()
+
+
+def finish_pdf_page(positions: pd.DataFrame, method: str):
+    """
+    Behavior: Last step of extract_pdf_page: rebuild the page text from its word
+    positions and record the method used in the positions.
+
+    Returns:
+    - page_text (str), positions (DataFrame), method (str), as in extract_pdf_page
+    """
+    page_text = ocr_data_to_text(positions)
+    positions['method'] = method
+    return page_text, positions, method
+
+
+def scale_boxes_to_points(positions: pd.DataFrame, dpi: int):
+    """
+    Behavior: Convert the pixel boxes of OCR at a given DPI to PDF points (1/72 inch),
+    in place, so that OCR and native positions share one coordinate system.
+    """
+    if dpi == 72:
+        return
+    for column in ('left', 'top', 'width', 'height'):
+        if column in positions:
+            positions[column] = (positions[column] * (72 / dpi)).round().astype(positions[column].dtype)
+
+
+def text_layer_is_usable(words: List, min_chars: int = 50, min_clean_ratio: float = 0.9, page=None,
+                         max_image_coverage: float = 0.5, min_text_coverage: float = 0.02) -> bool:
+    """
+    Behavior: Decide whether the native text layer of a page can be used instead of OCR.
+    Scanned pages have no (or almost no) text layer, and some PDFs carry a broken
+    layer made of unmapped glyphs, which shows up as replacement or control characters.
+    A scanned page can also carry a little real text - a typed header, a Bates stamp
+    or a fragment of an OCR layer - so when the page is given, a page mostly covered
+    by images whose words cover only a small part of it is OCRed as well.
+
+    Parameters:
+    - words (list): Output of PyMuPDF's page.get_text("words")
+    - min_chars (int): Minimum number of characters the text layer must hold
+    - min_clean_ratio (float): Minimum share of characters that are printable and not
+                               the Unicode replacement character
+    - page (fitz.Page): the page the words come from, to compare text and image coverage
+    - max_image_coverage (float): Share of the page covered by images from which the
+                                  page counts as scanned
+    - min_text_coverage (float): Minimum share of a scanned page the word boxes must
+                                 cover for its text layer to be used
+
+    Returns:
+    - usable (bool): True if the page text can be taken from the text layer
+    """
+    text = ''.join(word[4] for word in words)
+    if len(text) < min_chars:
+        return False
+
+    clean_chars = sum(1 for char in text if char.isprintable() and char != '\ufffd')
+    if clean_chars / len(text) < min_clean_ratio:
+        return False
+
+    if page is not None and page_coverage(page, [info['bbox'] for info in page.get_image_info()]) \
+            >= max_image_coverage:
+        return page_coverage(page, [word[:4] for word in words]) >= min_text_coverage
+    return True
+
+
+def page_coverage(page, boxes: List) -> float:
+    """
+    Behavior: Share of the area of a page covered by boxes (x0, y0, x1, y1), each one
+    clipped to the page. Overlaps are counted once per box, so the share is capped at 1.
+    """
+    import fitz
+
+    page_area = page.rect.width * page.rect.height
+    if not page_area:
+        return 0.0
+    covered = sum((fitz.Rect(box) & page.rect).get_area() for box in boxes)
+    return min(covered / page_area, 1.0)
+
+
+def native_words_to_data(words: List) -> pd.DataFrame:
+    """
+    Behavior: Convert PyMuPDF word boxes to the word rows of Tesseract's image_to_data
+    output, so native and OCR pages share one positions layout. Each text block of
+    the PDF becomes a paragraph. Coordinates are in PDF points, the coordinates OCR
+    boxes are scaled to (see scale_boxes_to_points). Confidence does not apply to
+    native text and is left empty.
+
+    Parameters:
+    - words (list): Output of PyMuPDF's page.get_text("words")
+
+    Returns:
+    - positions (DataFrame): Word positions in Tesseract's image_to_data layout
+    """
+    data = {'level': [], 'page_num': [], 'block_num': [], 'par_num': [], 'line_num': [],
+            'word_num': [], 'left': [], 'top': [], 'width': [], 'height': [], 'conf': [], 'text': []}
+
+    for x0, y0, x1, y1, text, block_no, line_no, word_no in words:
+        data['level'].append(5)
+        data['page_num'].append(1)
+        data['block_num'].append(block_no + 1)
+        data['par_num'].append(1)
+        data['line_num'].append(line_no + 1)
+        data['word_num'].append(word_no + 1)
+        data['left'].append(int(round(x0)))
+        data['top'].append(int(round(y0)))
+        data['width'].append(int(round(x1 - x0)))
+        data['height'].append(int(round(y1 - y0)))
+        data['conf'].append(np.nan)
+        data['text'].append(text)
+
+    return pd.DataFrame(data)
+
+
+def ocr_data_to_text(positions: pd.DataFrame) -> str:
+    """
+    Rebuilds the page text from the output of pytesseract.image_to_data, in the same
+    layout as pytesseract.image_to_string: words on a line are joined by a space,
+    each line ends with a newline, paragraphs are separated by an empty line and
+    the page ends with a form feed.
+
+    Parameters:
+    - positions (DataFrame): Tesseract word data with the 'level', 'block_num', 'par_num',
+                             'line_num' and 'text' columns
+
+    Returns:
+    - page_text (str): Text of the page
+    """
+    # Keep the word-level rows that contain text, in reading order
+    words = positions[(positions['level'] == 5) & positions['text'].notna()]
+    words = words[words['text'].astype(str).str.strip() != '']
+
+    paragraphs = []
+    for _, paragraph in words.groupby(['block_num', 'par_num'], sort=False):
+        lines = paragraph.groupby('line_num', sort=False)['text'].agg(lambda x: ' '.join(map(str, x)))
+        paragraphs.append(''.join(line + '\n' for line in lines))
+
+    return '\n'.join(paragraphs) + '\f'
+
+
+# Byte order marks, checked before any other encoding hint
+HTML_BOMS = [(b'\xef\xbb\xbf', 'utf-8'), (b'\xff\xfe', 'utf-16-le'), (b'\xfe\xff', 'utf-16-be')]
+
+# <meta charset="..."> or <meta http-equiv="Content-Type" content="text/html; charset=...">,
+# searched for in the first bytes of the document like browsers do
+HTML_META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_.:-]+)', re.IGNORECASE)
+HTML_SNIFF_BYTES = 4096
+
+
+def decode_html_bytes(data: bytes) -> str:
+    """
+    Behavior: Decode the raw bytes of an HTML file, with the encoding detected from the
+    bytes themselves: a byte order mark, then the charset of a <meta> tag, then UTF-8
+    when the bytes are valid UTF-8, and windows-1252 otherwise (undecodable bytes are
+    replaced). Like browsers, a declared ISO-8859-1 or ASCII is read as windows-1252,
+    which is a superset of both.
+
+    Parameters:
+    - data (bytes): The content of the file
+
+    Returns:
+    - text (str): The decoded document
+    """
+    for bom, encoding in HTML_BOMS:
+        if data.startswith(bom):
+            return data[len(bom):].decode(encoding, errors='replace')
+
+    match = HTML_META_CHARSET.search(data[:HTML_SNIFF_BYTES])
+    if match:
+        try:
+            encoding = codecs.lookup(match.group(1).decode('ascii')).name
+        except LookupError:
+            encoding = None
+        if encoding in ('latin-1', 'iso8859-1', 'ascii'):
+            encoding = 'cp1252'
+        if encoding:
             try:
-                with open(f, 'r', encoding='utf-8') as file:
-                    html_string = file.read()
-                    print(f'Successfully read file {f} with utf-8 encoding.')
-            except Exception as e2:
-                print(f'Encoding error with utf-8 for file {f}: {e2}')
-                # If both encodings fail, the html_string remains empty, and the loop continues.
-
-        # Use BeautifulSoup to parse the HTML and extract all text
-        # .stripped_strings removes leading/trailing whitespace and empty strings
-        # ' '.join() combines all the extracted strings into one single string
-        if html_string:  # Only proceed if we successfully read content
-            clean_text = ' '.join(BeautifulSoup(html_string, "html.parser").stripped_strings)
-            clean_texts.append(clean_text)
-        else:
-            clean_texts.append(None)  # Append None or an empty string if file couldn't be read
+                return data.decode(encoding)
+            except UnicodeDecodeError:
+                pass  # The declaration is wrong, fall back to the byte checks
+
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('cp1252', errors='replace')
+
+
+def html_parser_backend() -> str:
+    """
+    Behavior: Name of the BeautifulSoup parser to use: the C-based 'lxml' when it is
+    installed, and the pure-Python 'html.parser' otherwise.
+    """
+    try:
+        import lxml  # noqa: F401
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+
+def html_to_text(file_path: str):
+    """
+    Behavior: Read an HTML file (once, as bytes), decode it (see decode_html_bytes)
+    and join its visible strings into one clean text. Any errors are printed to the screen.
+
+    Parameters:
+    - file_path (str): filepath to the HTML document on local disk
+
+    Returns:
+    - text (str): The cleaned text, or None when the file cannot be read or is empty
+    """
+    from bs4 import BeautifulSoup
+
+    try:
+        with open(file_path, 'rb') as file:
+            data = file.read()
+    except Exception as e:
+        print(f'Unable to read file {file_path}: {e}')
+        return None
+    if not data:
+        return None
 
-    return clean_texts
+    # .stripped_strings removes leading/trailing whitespace and empty strings
+    # ' '.join() combines all the extracted strings into one single string
+    try:
+        return ' '.join(BeautifulSoup(decode_html_bytes(data), html_parser_backend()).stripped_strings)
+    except Exception as e:
+        print(f'Unable to parse file {file_path}: {e}')
+        return None
+
+
+def iter_text_from_html(file_list: List, num_workers: int = 0, max_pending: int = None):
+    """
+    Behavior: Extract the clean text of HTML files (see html_to_text) as a stream, in
+    the order of file_list, optionally spread over a pool of worker processes. Only a
+    bounded number of documents is in flight at once, so texts are not all kept in memory.
+
+    Parameters:
+    - file_list (list): filepaths to the HTML documents on local disk
+    - num_workers (int): Number of worker processes (0 parses in the current process)
+    - max_pending (int): Maximum number of files submitted to the pool and not yet
+                         yielded (defaults to 2 x num_workers)
+
+    Yields:
+    - (file_path, text): text is None for files that cannot be read or are empty
+    """
+    if num_workers <= 0 or len(file_list) < 2:
+        for file_path in file_list:
+            yield file_path, html_to_text(file_path)
+        return
+
+    max_pending = max(max_pending or 2 * num_workers, 1)
+    files = iter(file_list)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        while True:
+            for file_path in itertools.islice(files, max_pending - len(pending)):
+                pending.append((file_path, executor.submit(html_to_text, file_path)))
+            if not pending:
+                break
+            file_path, future = pending.popleft()
+            try:
+                text = future.result()
+            except Exception as e:
+                print(f'Error processing file {file_path}: {e}')
+                text = None
+            yield file_path, text
+
+
+def pull_text_from_html(file_list, num_workers: int = 0):
+    """
+    Extracts and cleans text content from a list of HTML files.
+
+    Each file is read once as bytes, its encoding is detected from those bytes
+    (see decode_html_bytes), and it is parsed with BeautifulSoup, using lxml when it
+    is installed, to extract all text and join it into a single, clean string.
+    See iter_text_from_html for a streaming version.
+
+    Args:
+        file_list (list): A list of file paths to HTML documents.
+        num_workers (int, optional): Number of worker processes the files are spread
+                                     over (0 processes them in the current process).
+
+    Returns:
+        list: A list of strings, where each string contains the cleaned text
+              content from the corresponding HTML file (None for files that
+              could not be read or are empty).
+    """
+    return [text for _, text in iter_text_from_html(file_list, num_workers=num_workers)]
 
 
 def read_text_files(folder_path: str):
@@ -156,6 +1015,9 @@ def read_text_files(folder_path: str):
 def calculate_ocr_quality(texts: List):
     """
     Behavior: Calculate OCR quality scores for a list of texts based on recognized English words.
+    Texts are split into words on whitespace, like the word boxes of PDF pages, and
+    scored with ocr_quality_metrics, so that texts without saved quality metrics (e.g.
+    HTML) get the same dictionary ratio as PDFs with the same text.
 
     Parameters:
     - texts (list): List of OCR-generated texts.
@@ -163,17 +1025,12 @@ def calculate_ocr_quality(texts: List):
     Returns:
     - ocr_quality_scores (list): List of OCR quality scores ranging from 0 to 1
     """
-    nlp = spacy.load("en_core_web_sm")
+    lexicon = get_english_lexicon()
     ocr_quality_scores = []
-
     for text in texts:
-        doc = nlp(text)
-        english_word_count = sum(1 for token in doc if token.is_alpha and token.text.lower() in nlp.vocab)
-        total_word_count = len(doc)
-
-        # Calculate OCR quality as the ratio of recognized English words to total words
-        quality_score = english_word_count / total_word_count if total_word_count > 0 else 0
-        ocr_quality_scores.append(quality_score)
+        words = text.split()
+        metrics = ocr_quality_metrics(pd.DataFrame({'level': 5, 'conf': -1, 'text': words}), lexicon)
+        ocr_quality_scores.append(metrics['dictionary_ratio'] or 0)
 
     return ocr_quality_scores
 
@@ -192,6 +1049,8 @@ def plot_ocr_quality_histogram(ocr_quality_scores: List, output_folder: str):
         print("Error: No OCR quality scores provided.")
         return
 
+    import matplotlib.pyplot as plt
+
     # Plot the histogram
     plt.hist(ocr_quality_scores, bins=20, range=(0, 1), edgecolor='black', alpha=0.7)
 
@@ -204,36 +1063,244 @@ def plot_ocr_quality_histogram(ocr_quality_scores: List, output_folder: str):
     plt.savefig(os.path.join(output_folder, "OCR_quality_distribution.png"))
     return
 
-def process_texts_to_dataframe(texts: List, filenames: List):
+# Longest text segmented as a single spaCy Doc. Longer texts (large scanned exhibits)
+# are segmented chunk by chunk, which keeps memory bounded and stays below nlp.max_length
+SEGMENT_CHUNK_CHARS = 100_000
+
+# Chunk boundaries, from safest to least safe: page breaks, blank lines and line breaks
+SEGMENT_BREAKS = ('\f', '\n\n', '\n')
+
+
+def safe_chunk_end(text: str, start: int, max_chars: int) -> int:
+    """
+    Behavior: Find where the chunk of a text starting at `start` ends: at the end of
+    the text when it fits in max_chars, otherwise after the last page break, blank
+    line, line break or space (in that order of preference) in the second half of
+    the chunk, and at max_chars when there is none.
+
+    Returns:
+    - end (int): Offset in the text of the end of the chunk (exclusive)
+    """
+    limit = start + max_chars
+    if limit >= len(text):
+        return len(text)
+    for separator in (*SEGMENT_BREAKS, ' '):
+        cut = text.rfind(separator, start + max_chars // 2, limit)
+        if cut != -1:
+            return cut + len(separator)
+    return limit
+
+
+def iter_chunked_sentences(nlp, text: str, max_chars: int = SEGMENT_CHUNK_CHARS):
+    """
+    Behavior: Yield the sentences of a text segmented in chunks of at most max_chars
+    characters cut on safe boundaries (see safe_chunk_end). The last sentence of each
+    chunk may run on into the next one, so it is carried over: the next chunk starts
+    where that sentence starts. Only one chunk's Doc is held at a time.
+
+    Parameters:
+    - nlp (spacy.Language): pipeline that sets sentence boundaries
+    - text (str): the text to segment
+    - max_chars (int): maximum number of characters per chunk
+
+    Yields:
+    - sentence_text (str): Text of each sentence, in order
+    """
+    start = 0
+    while start < len(text):
+        end = safe_chunk_end(text, start, max_chars)
+        sentences = list(nlp(text[start:end]).sents)
+        next_start = end
+        if end < len(text) and len(sentences) > 1:
+            next_start = start + sentences.pop().start_char
+        for sentence in sentences:
+            yield sentence.text
+        start = next_start
+
+
+def process_texts_to_dataframe(texts: List, filenames: List, batch_size: int = 32, n_process: int = 1,
+                               max_chars: int = SEGMENT_CHUNK_CHARS):
     """
     Tokenize sentences in a list of texts and save the results in a Pandas DataFrame.
+    Texts are split with the shared tokenizer + sentencizer pipeline
+    (models.get_spacy_pipeline('sentences')) through nlp.pipe. Texts longer than
+    max_chars are segmented in chunks instead (see iter_chunked_sentences), with their
+    sentence indices running on from chunk to chunk.
 
     Parameters:
     - texts (list): List of texts to be processed.
     - filenames (list): List of corresponding filenames.
+    - batch_size (int): Number of texts per batch passed to spaCy's nlp.pipe
+    - n_process (int): Number of processes spaCy splits texts with
+    - max_chars (int): Longest text segmented as a single spaCy Doc
 
     Returns:
-    - df (DataFrame): Pandas DataFrame containing columns: 'filename', 'sentence_index', 'sentence_text'.
+    - df (DataFrame): Pandas DataFrame containing columns: 'filename', 'sentence_index' (int32), 'sentence_text'.
     """
-    nlp = spacy.load('en_core_web_sm', exclude=["parser"])
-    config = {"punct_chars": ['\n\n', '.', '?', '!']}
-    nlp.add_pipe("sentencizer", config=config)
-
-    data = {'filename': [], 'sentence_index': [], 'sentence_text': []}
+    nlp = get_spacy_pipeline('sentences')
+    max_chars = min(max_chars, nlp.max_length)
 
-    for filename, text in zip(filenames, texts):
-        for i, sentence in enumerate(nlp(text).sents):
-            data['filename'].append(filename)
-            data['sentence_index'].append(i)
-            data['sentence_text'].append(sentence.text)
+    # Long texts are left out of nlp.pipe (as empty texts, to keep the order) and segmented in chunks
+    docs = nlp.pipe((text if len(text) <= max_chars else '' for text in texts),
+                    batch_size=batch_size, n_process=n_process)
+    sentence_texts = []
+    counts = np.zeros(len(filenames), dtype=np.int64)
+    for i, (text, doc) in enumerate(zip(texts, docs)):
+        before = len(sentence_texts)
+        if len(text) <= max_chars:
+            sentence_texts.extend(sentence.text for sentence in doc.sents)
+        else:
+            sentence_texts.extend(iter_chunked_sentences(nlp, text, max_chars))
+        counts[i] = len(sentence_texts) - before
 
-    df = pd.DataFrame(data)
+    # Build the filename and index columns from the sentence counts of each document
+    starts = np.cumsum(counts) - counts
+    df = pd.DataFrame({
+        'filename': np.repeat(np.asarray(filenames, dtype=object), counts),
+        'sentence_index': (np.arange(len(sentence_texts)) - np.repeat(starts, counts)).astype(np.int32),
+        'sentence_text': sentence_texts,
+    })
     return df
 
 
+# Embedding model held by each worker process of the embedding pool
+_worker_emb_model = None
+
+
+def _init_embedding_worker(sent_emb_model):
+    """
+    Initializer for embedding pool workers: keeps a copy of the embedding model in
+    the worker process and limits torch to one thread, so that N workers do not
+    oversubscribe the CPU cores.
+    """
+    global _worker_emb_model
+    _worker_emb_model = sent_emb_model
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+
+def _encode_batch(sentences: List, sent_emb_model=None):
+    """
+    Encodes one batch of sentences as a single forward pass, using the worker's model
+    when no model is given.
+    """
+    model = sent_emb_model if sent_emb_model is not None else _worker_emb_model
+    embeddings = model.encode(sentences, batch_size=len(sentences), convert_to_numpy=True,
+                              show_progress_bar=False)
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def embed_sentences(sentences: List, sent_emb_model, batch_size: int = 64,
+                    num_workers: int = 0, cache=None) -> np.ndarray:
+    """
+    Encodes a list of sentences into one contiguous float32 embedding matrix.
+
+    Sentences are normalized (see embedding_cache.normalize_sentence) and each distinct
+    sentence is encoded only once, which pays off on boilerplate-heavy corpora. With a
+    SentenceEmbeddingCache, sentences embedded in earlier runs are not encoded again.
+    The sentences left to encode are sorted by length before they are cut into batches,
+    so that each batch holds sentences of similar length and little compute is spent
+    on padding. The rows of the returned matrix are in the original sentence order, so
+    row i of the matrix is the embedding of sentences[i] (and of row i of the
+    sentence DataFrame it was taken from).
+
+    Args:
+        sentences (list): List of sentence strings to encode.
+        sent_emb_model (SentenceTransformer): Model used to create the embeddings.
+        batch_size (int, optional): Number of sentences encoded per forward pass.
+                                    Defaults to 64.
+        num_workers (int, optional): Number of CPU worker processes to spread the
+                                     batches over. 0 encodes in the current process.
+        cache (SentenceEmbeddingCache, optional): Persistent memo of sentence embeddings.
+                                     Its stats are updated with the hits and misses.
+
+    Returns:
+        np.ndarray: Array of shape (len(sentences), embedding_dim) and dtype float32.
+    """
+    sentences = list(sentences)
+    if not sentences:
+        dim = sent_emb_model.get_sentence_embedding_dimension() or 0
+        return np.empty((0, dim), dtype=np.float32)
+
+    # Map every sentence to its distinct normalized form
+    unique_index = {}
+    inverse = np.array([unique_index.setdefault(normalize_sentence(s), len(unique_index)) for s in sentences])
+    unique_sentences = list(unique_index)
+
+    # Look up the distinct sentences in the cache, and encode the others
+    found = {}
+    if cache is not None:
+        keys = [cache.key(s) for s in unique_sentences]
+        found = cache.get_many(keys)
+        cache.stats['sentences'] += len(sentences)
+        cache.stats['unique'] += len(unique_sentences)
+        to_encode = [i for i, key in enumerate(keys) if key not in found]
+    else:
+        to_encode = list(range(len(unique_sentences)))
+
+    encoded = _encode_sorted([unique_sentences[i] for i in to_encode], sent_emb_model,
+                             batch_size, num_workers)
+    if cache is not None and to_encode:
+        cache.put_many([keys[i] for i in to_encode], encoded)
+
+    # Put the distinct embeddings together, then expand them to one row per sentence
+    dim = encoded.shape[1] if to_encode else len(next(iter(found.values())))
+    unique_embeddings = np.empty((len(unique_sentences), dim), dtype=np.float32)
+    if to_encode:
+        unique_embeddings[to_encode] = encoded
+    if found:
+        for i, key in enumerate(keys):
+            if key in found:
+                unique_embeddings[i] = found[key]
+
+    return unique_embeddings[inverse]
+
+
+def _encode_sorted(sentences: List, sent_emb_model, batch_size: int, num_workers: int):
+    """
+    Encodes sentences in length-sorted batches, in this process or across a pool of
+    worker processes, and returns their embeddings in the original order.
+    """
+    if not sentences:
+        return None
+
+    # Sort sentences by length (longest first) and cut them into batches
+    order = np.argsort([-len(s) for s in sentences], kind='stable')
+    batch_indices = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    batches = [[sentences[i] for i in idx] for idx in batch_indices]
+
+    # Encode the batches, either in this process or across a pool of worker processes
+    if num_workers and num_workers > 0 and len(batches) > 1:
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_embedding_worker,
+                                 initargs=(sent_emb_model,)) as executor:
+            batch_embeddings = executor.map(_encode_batch, batches)
+            embeddings = _scatter_batches(batch_indices, batch_embeddings, len(sentences))
+    else:
+        batch_embeddings = (_encode_batch(batch, sent_emb_model) for batch in batches)
+        embeddings = _scatter_batches(batch_indices, batch_embeddings, len(sentences))
+
+    return embeddings
+
+
+def _scatter_batches(batch_indices: List, batch_embeddings, n_rows: int) -> np.ndarray:
+    """
+    Writes the embeddings of each (length-sorted) batch back into their original rows
+    of a single preallocated float32 matrix.
+    """
+    embeddings = None
+    for idx, batch_emb in zip(batch_indices, batch_embeddings):
+        if embeddings is None:
+            embeddings = np.empty((n_rows, batch_emb.shape[1]), dtype=np.float32)
+        embeddings[idx] = batch_emb
+    return embeddings
+
+
 def run_classification_model(df: pd.DataFrame, model_folder: str,
                              model_name: str = "ml_classifier_gbc.pkl",
-                             threshold: float=0.5) -> pd.DataFrame:
+                             threshold: float=0.5, clf_model=None, embeddings=None) -> pd.DataFrame:
     """
     Loads a pre-trained machine learning model and uses it to predict
     the top sentence from each document.
@@ -248,35 +1315,168 @@ def run_classification_model(df: pd.DataFrame, model_folder: str,
         df (pd.DataFrame): The input DataFrame. It must contain 'filename',
                            and 'Embedding' columns. The 'Embedding' column should
                            contain numerical representations (e.g., word embeddings or
-                           TF-IDF vectors) of the text.
+                           TF-IDF vectors) of the text. The 'Embedding' column is not
+                           needed when embeddings is given.
         model_folder (str): The path to the directory where the pre-trained model file is stored.
         model_name (str, optional): The name of the pickled model file.
                                      Defaults to "ml_classifier_gbc.pkl".
         threshold (float, optional): Probability threshold below which to ignore/mask model predictions
+        clf_model (optional): An already loaded classification model. When given, the model
+                              is not loaded from model_folder. Otherwise the model is taken
+                              from the in-memory cache of models.get_classifier, so repeated
+                              calls only load it again when the file changes.
+        embeddings (np.ndarray, optional): Embedding matrix with one row per row of df.
+                              Scored directly, without gathering the 'Embedding' column.
 
     Returns:
         pd.DataFrame: A DataFrame containing the top predicted sentences for each
                       unique filename, along with their corresponding probability scores.
     """
-    # Load the pre-trained classification model using pickle
-    model_path = os.path.join(model_folder, model_name)
-    with open(model_path, 'rb') as f:
-        clf_model = pickle.load(f)
+    # Get the pre-trained classification model, unpickled once per process and file version
+    if clf_model is None:
+        clf_model = get_classifier(os.path.join(model_folder, model_name))
+
+    # Score the sentences and keep only the top-scoring sentence of each document
+    # as the scores arrive (see top_k.TopKReducer)
+    candidates = rank_top_sentences(df, None, k=1, context=0, clf_model=clf_model, embeddings=embeddings)
+    return top_sentence_results(df, candidates, threshold)
+
+
+# Number of sentences scored per predict_proba call
+SCORING_CHUNK_SIZE = 8192
+
+
+def rank_top_sentences(df: pd.DataFrame, model_folder: str, model_name: str = "ml_classifier_gbc.pkl",
+                       k: int = 3, context: int = 1, clf_model=None, embeddings=None,
+                       document_sentences: dict = None) -> pd.DataFrame:
+    """
+    Scores every sentence with the classification model and returns the k best
+    sentences of each document, ranked, with their neighboring sentences.
+
+    Sentences are scored in chunks of SCORING_CHUNK_SIZE and reduced as they are
+    scored, so no probability column is added to df and only k candidates per
+    document are kept in memory.
+
+    Args:
+        df (pd.DataFrame): Sentences with 'filename', 'sentence_index', 'sentence_text'
+                           and (unless embeddings is given) 'Embedding' columns, in
+                           sentence order within each document.
+        model_folder (str): The path to the directory where the pre-trained model file is stored.
+        model_name (str, optional): The name of the pickled model file.
+        k (int, optional): Number of candidates per document. Defaults to 3.
+        context (int, optional): Number of neighboring sentences on each side of a
+                                 candidate. Defaults to 1.
+        clf_model (optional): An already loaded classification model.
+        embeddings (np.ndarray, optional): Embedding matrix with one row per row of df.
+        document_sentences (dict, optional): Filename -> all sentence texts of the document,
+                           by sentence index, for the context of a df that only holds some
+                           sentences of each document (see top_k.TopKReducer).
+
+    Returns:
+        pd.DataFrame: The ranked candidates, see top_k.TopKReducer.results. 'row' is the
+                      position of the candidate's row in df.
+    """
+    if clf_model is None:
+        clf_model = get_classifier(os.path.join(model_folder, model_name))
+    return rank_top_sentences_by_clause(df, {model_name: clf_model}, k=k, context=context,
+                                        embeddings=embeddings, document_sentences=document_sentences)[model_name]
 
-    # Use the loaded model to predict the probability for each sentence's embedding.
-    # The [:, 1] is used to get the probabilities of the positive class.
-    df['Probability'] = clf_model.predict_proba(df['Embedding'].to_list())[:, 1]
 
-    # Find the index of the row with the maximum 'Probability' for each 'filename'.
-    # This identifies the top-scoring sentence for each document.
-    top_doc_preds_indices = df.groupby('filename')['Probability'].idxmax()
+def rank_top_sentences_by_clause(df: pd.DataFrame, clf_models: dict, k: int = 3, context: int = 1,
+                                 embeddings=None, document_sentences: dict = None) -> dict:
+    """
+    Like rank_top_sentences, for several clause classifiers in one pass over the
+    embeddings: each chunk of embeddings is prepared once and scored by every
+    classifier, so each extra clause costs one predict_proba call per chunk.
+
+    Args:
+        df (pd.DataFrame): Sentences, see rank_top_sentences.
+        clf_models (dict): Clause name -> loaded classification model.
+        k (int, optional): Number of candidates per clause and document. Defaults to 3.
+        context (int, optional): Number of neighboring sentences on each side of a
+                                 candidate. Defaults to 1.
+        embeddings (np.ndarray, optional): Embedding matrix with one row per row of df.
+        document_sentences (dict, optional): All sentence texts of each document, see
+                                             rank_top_sentences.
+
+    Returns:
+        dict: Clause name -> ranked candidates (see top_k.TopKReducer.results).
+    """
+    reducers = {clause: TopKReducer(k=k, context=context, document_sentences=document_sentences)
+                for clause in clf_models}
+    filenames = df['filename'].to_numpy()
+    sentence_indices = df['sentence_index'].to_numpy()
+    sentence_texts = df['sentence_text'].to_numpy()
+    for start in range(0, len(df), SCORING_CHUNK_SIZE):
+        stop = start + SCORING_CHUNK_SIZE
+        chunk = embeddings[start:stop] if embeddings is not None \
+            else np.vstack(df['Embedding'].iloc[start:stop].to_list())
+
+        # Score a contiguous float32 matrix (the dtype the tree models predict in), which
+        # is not copied when the embeddings already are float32.
+        # The [:, 1] is used to get the probabilities of the positive class.
+        chunk = np.asarray(chunk, dtype=np.float32)
+        for clause, clf_model in clf_models.items():
+            probabilities = clf_model.predict_proba(chunk)[:, 1]
+            reducers[clause].add_batch(filenames[start:stop], sentence_indices[start:stop],
+                                       sentence_texts[start:stop], probabilities)
+    return {clause: reducer.results() for clause, reducer in reducers.items()}
+
+
+def run_clause_models(df: pd.DataFrame, model_folder: str, clause_models: dict = None,
+                      threshold=0.5, embeddings=None) -> pd.DataFrame:
+    """
+    Predicts the top sentence of each document for every clause of a registry of
+    clause classifiers, scoring all of them against the same embeddings in one pass.
+
+    Args:
+        df (pd.DataFrame): Sentences, see run_classification_model.
+        model_folder (str): The path to the directory where the model files are stored.
+        clause_models (dict, optional): Clause name -> model file name. Defaults to
+                                        models.CLAUSE_MODELS.
+        threshold (float or dict, optional): Probability threshold below which to mask
+                                             predictions, or clause name -> threshold.
+        embeddings (np.ndarray, optional): Embedding matrix with one row per row of df.
+
+    Returns:
+        pd.DataFrame: One row per clause and document, in the format of
+                      run_classification_model with a leading 'clause' column.
+    """
+    candidates = rank_top_sentences_by_clause(df, load_clause_models(model_folder, clause_models),
+                                              k=1, context=0, embeddings=embeddings)
+    return clause_results(df, candidates, threshold)
+
+
+def clause_results(df: pd.DataFrame, candidates: dict, threshold=0.5) -> pd.DataFrame:
+    """
+    Builds the long-format output of run_clause_models from the ranked candidates of
+    each clause (see rank_top_sentences_by_clause).
+    """
+    results = []
+    for clause, clause_candidates in candidates.items():
+        clause_threshold = threshold[clause] if isinstance(threshold, dict) else threshold
+        clause_top = top_sentence_results(df, clause_candidates, clause_threshold)
+        clause_top.insert(0, 'clause', clause)
+        results.append(clause_top)
+    return pd.concat(results, ignore_index=True)
+
+
+def top_sentence_results(df: pd.DataFrame, candidates: pd.DataFrame, threshold: float = 0.5) -> pd.DataFrame:
+    """
+    Builds the output of run_classification_model from ranked candidates (see
+    rank_top_sentences): the row of df of each document's best sentence, with its
+    'Probability', masked when below the threshold.
+    """
+    top = candidates[candidates['rank'] == 1]
 
-    # Use the indices to select the corresponding rows from the original DataFrame.
-    top_doc_preds = df.loc[top_doc_preds_indices].reset_index(drop=True)
+    # Use the row positions to select the corresponding rows from the original DataFrame.
+    top_doc_preds = df.iloc[top['row'].to_numpy()].reset_index(drop=True)
+    top_doc_preds['Probability'] = top['Probability'].to_numpy()
 
     # Mask any rows with a probability less than a given prob threshold (default 0.5)
     mask = top_doc_preds['Probability'] < threshold
-    cols_to_mask = ['sentence_index', 'sentence_text', 'Embedding', 'Probability']
+    cols_to_mask = [col for col in ['sentence_index', 'sentence_text', 'Embedding', 'Probability']
+                    if col in top_doc_preds]
     top_doc_preds.loc[mask, cols_to_mask] = pd.NA
 
     return top_doc_preds
@@ -0,0 +1,426 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+RUN_REPORT_FILE = 'run_report.json'
+PROFILERS = ('sampling', 'cprofile')
+
+
+def current_rss_bytes():
+    """
+    Returns the resident set size of this process in bytes, read from /proc (Linux), or
+    None where it is not available.
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_rss_bytes():
+    """
+    Returns the peak resident set size of this process so far in bytes, or None where
+    the resource module is not available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def children_cpu_seconds() -> float:
+    """
+    Returns the CPU time (user + system) of the finished child processes, e.g. OCR and
+    embedding workers.
+    """
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class MemoryMonitor:
+    """
+    Background thread that polls the resident set size of the process, to give the
+    peak memory of each stage rather than only the high-water mark of the whole run.
+    A poll is one read of /proc/self/statm, so the default interval costs next to nothing.
+
+    Args:
+        interval (float, optional): Seconds between polls. Defaults to 0.05.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self._peak = current_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._peak is None:
+            return self  # No /proc, only the process high-water mark is reported
+        self._thread = threading.Thread(target=self._run, name='memory-monitor', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def poll(self):
+        rss = current_rss_bytes()
+        if rss is not None and (self._peak is None or rss > self._peak):
+            self._peak = rss
+        return rss
+
+    def reset(self) -> int:
+        """
+        Starts a new measurement window and returns the current RSS.
+        """
+        self._peak = current_rss_bytes()
+        return self._peak
+
+    def peak(self):
+        """
+        Returns the peak RSS in bytes since the last reset.
+        """
+        self.poll()
+        return self._peak
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler of one thread: a background thread takes a snapshot of the
+    thread's call stack every `interval` seconds and counts the stacks. Unlike cProfile,
+    the profiled code does not run any slower, and the cost of a snapshot is paid by the
+    sampler, so it can stay on in production. The result is written in the collapsed
+    stack format that flamegraph.pl and speedscope read.
+
+    Args:
+        interval (float, optional): Seconds between samples. Defaults to 0.01.
+        thread_id (int, optional): Thread to profile. Defaults to the calling thread.
+    """
+
+    def __init__(self, interval: float = 0.01, thread_id: int = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write_collapsed(self, path: str):
+        """
+        Writes the sampled stacks, one '<frame>;<frame>;... <count>' line per stack.
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class StageRecord:
+    """
+    Measurements of one stage of a run: wall time, CPU time of the process and of its
+    finished child processes, items processed (e.g. sentences), pages, peak memory and
+    per-document records. Code inside the stage sets `items` and `pages`, and adds
+    documents with `document` or `record_document`.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = None
+        self.pages = None
+        self.documents = []
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.children_cpu_seconds = None
+        self.peak_rss_bytes = None
+        self.profile_path = None
+        self.error = None
+
+    def record_document(self, filename: str, wall_seconds: float = None, cpu_seconds: float = None,
+                        items: int = None, pages: int = None):
+        """
+        Adds the measurements of one document.
+        """
+        self.documents.append({'filename': os.path.basename(filename), 'wall_seconds': wall_seconds,
+                               'cpu_seconds': cpu_seconds, 'items': items, 'pages': pages})
+
+    @contextmanager
+    def document(self, filename: str):
+        """
+        Times the processing of one document. Yields a dict in which 'items' and 'pages'
+        can be set.
+        """
+        counts = {'items': None, 'pages': None}
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield counts
+        finally:
+            self.record_document(filename, time.perf_counter() - wall, time.process_time() - cpu, **counts)
+
+    def timed_documents(self, iterable, filename=lambda item: item[0]):
+        """
+        Yields the items of an iterable (e.g. a stream of extracted documents) and
+        records, for each item, the time it took the iterable to produce it.
+        """
+        iterator = iter(iterable)
+        while True:
+            wall, cpu = time.perf_counter(), time.process_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record_document(filename(item), time.perf_counter() - wall, time.process_time() - cpu)
+            yield item
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'wall_seconds': self.wall_seconds, 'cpu_seconds': self.cpu_seconds,
+                'children_cpu_seconds': self.children_cpu_seconds, 'items': self.items, 'pages': self.pages,
+                'peak_rss_bytes': self.peak_rss_bytes, 'profile_path': self.profile_path, 'error': self.error,
+                'documents': self.documents}
+
+
+class Instrumentation:
+    """
+    Records the stages of a pipeline run and exports a report of them at the end.
+
+        instrumentation = Instrumentation(exporters=[JsonReportExporter('run_report.json')])
+        with instrumentation.stage('embed') as stage:
+            embeddings = embed_sentences(sentences, model)
+            stage.items = len(sentences)
+        instrumentation.finish()
+
+    Each stage costs a few clock and rusage reads, and memory is polled by a background
+    thread (see MemoryMonitor), so it can stay on in production. One stage can also be
+    profiled: with the 'sampling' profiler (see SamplingProfiler), which is cheap enough
+    for production runs, or with cProfile, which is exact but slows Python code down.
+
+    Args:
+        exporters (list, optional): Objects with an export(report) method, called by
+                                    finish (see JsonReportExporter, PrometheusTextfileExporter).
+        profile_stage (str, optional): Name of the stage to profile. Defaults to none.
+        profiler (str, optional): 'sampling' or 'cprofile'. Defaults to 'sampling'.
+        profile_dir (str, optional): Folder the profile is written to. Defaults to the
+                                     current folder.
+        sample_interval (float, optional): Seconds between samples of the sampling
+                                           profiler. Defaults to 0.01.
+        memory_interval (float, optional): Seconds between memory polls, 0 to only
+                                           report the process high-water mark. Defaults to 0.05.
+        labels (dict, optional): Extra fields of the report, e.g. the input folder.
+    """
+
+    def __init__(self, exporters=None, profile_stage: str = None, profiler: str = 'sampling',
+                 profile_dir: str = None, sample_interval: float = 0.01, memory_interval: float = 0.05,
+                 labels: dict = None):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{profiler}', expected one of {list(PROFILERS)}")
+        self.exporters = list(exporters or [])
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.sample_interval = sample_interval
+        self.labels = dict(labels or {})
+        self.stages = []
+        self.run_id = uuid.uuid4().hex
+        self.status = 'running'
+        self._started_at = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._children_cpu = children_cpu_seconds()
+        self._memory = MemoryMonitor(memory_interval).start() if memory_interval else None
+        self._finished = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measures a stage of the run. Yields its StageRecord.
+        """
+        record = StageRecord(name)
+        self.stages.append(record)
+        if self._memory is not None:
+            self._memory.reset()
+        profiler = self._start_profiler() if name == self.profile_stage else None
+        wall, cpu, children_cpu = time.perf_counter(), time.process_time(), children_cpu_seconds()
+        try:
+            yield record
+        except BaseException as e:
+            record.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record.wall_seconds = time.perf_counter() - wall
+            record.cpu_seconds = time.process_time() - cpu
+            record.children_cpu_seconds = children_cpu_seconds() - children_cpu
+            record.peak_rss_bytes = self._memory.peak() if self._memory is not None else peak_rss_bytes()
+            if profiler is not None:
+                record.profile_path = self._stop_profiler(profiler, name)
+
+    def _start_profiler(self):
+        if self.profiler == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        return SamplingProfiler(self.sample_interval).start()
+
+    def _stop_profiler(self, profiler, name: str) -> str:
+        profile_dir = self.profile_dir or '.'
+        os.makedirs(profile_dir, exist_ok=True)
+        if self.profiler == 'cprofile':
+            profiler.disable()
+            path = os.path.join(profile_dir, f'profile_{name}.prof')
+            profiler.dump_stats(path)  # Read with pstats or snakeviz
+        else:
+            profiler.stop()
+            path = os.path.join(profile_dir, f'profile_{name}.folded')
+            profiler.write_collapsed(path)
+        return path
+
+    def report(self) -> dict:
+        """
+        Returns the run report: the run totals and the records of all stages.
+        """
+        finished = self._finished or time.perf_counter()
+        return {
+            'run_id': self.run_id,
+            'status': self.status,
+            'started_at': self._started_at,
+            'wall_seconds': finished - self._wall,
+            'cpu_seconds': time.process_time() - self._cpu,
+            'children_cpu_seconds': children_cpu_seconds() - self._children_cpu,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'labels': self.labels,
+            'stages': [stage.to_dict() for stage in self.stages],
+        }
+
+    def finish(self, status: str = 'success') -> dict:
+        """
+        Ends the run, exports its report to every exporter and returns the report.
+        An exporter that fails does not stop the others.
+        """
+        self.status = status
+        self._finished = time.perf_counter()
+        if self._memory is not None:
+            self._memory.stop()
+        report = self.report()
+        for exporter in self.exporters:
+            try:
+                exporter.export(report)
+            except Exception as e:
+                print(f"Error exporting the run report with {type(exporter).__name__}: {e}")
+        return report
+
+
+def _write_atomically(path: str, content: str):
+    """
+    Writes a file through a temporary file and a rename, so readers never see a
+    partial file.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+class JsonReportExporter:
+    """
+    Writes the run report, including the per-document records, as a JSON file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, report: dict):
+        _write_atomically(self.path, json.dumps(report, indent=1, default=str))
+
+
+class PrometheusTextfileExporter:
+    """
+    Writes the run totals and per-stage measurements in the Prometheus text format, for
+    the textfile collector of node_exporter. Per-document records are left out, since
+    one series per document would not scale.
+
+    Args:
+        path (str): The .prom file to write.
+        prefix (str, optional): Prefix of the metric names. Defaults to 'contract_pipeline'.
+    """
+
+    def __init__(self, path: str, prefix: str = 'contract_pipeline'):
+        self.path = path
+        self.prefix = prefix
+
+    def export(self, report: dict):
+        lines = []
+
+        def gauge(name, help_text, samples):
+            samples = [(labels, value) for labels, value in samples if value is not None]
+            if not samples:
+                return
+            lines.append(f"# HELP {self.prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{_escape_label(val)}"' for key, val in labels.items())
+                lines.append(f"{self.prefix}_{name}{{{label_text}}} {float(value)!r}" if label_text
+                             else f"{self.prefix}_{name} {float(value)!r}")
+
+        gauge('run_success', "1 if the last run finished successfully, 0 otherwise.",
+              [({}, report['status'] == 'success')])
+        gauge('run_started_timestamp_seconds', "Start time of the last run.", [({}, report['started_at'])])
+        gauge('run_wall_seconds', "Wall time of the last run.", [({}, report['wall_seconds'])])
+        gauge('run_cpu_seconds', "CPU time of the last run, excluding child processes.",
+              [({}, report['cpu_seconds'])])
+        gauge('run_children_cpu_seconds', "CPU time of the child processes of the last run.",
+              [({}, report['children_cpu_seconds'])])
+        gauge('run_peak_rss_bytes', "Peak resident set size of the last run.", [({}, report['peak_rss_bytes'])])
+
+        stages = report['stages']
+        gauge('stage_wall_seconds', "Wall time of each stage of the last run.",
+              [({'stage': s['name']}, s['wall_seconds']) for s in stages])
+        gauge('stage_cpu_seconds', "CPU time of each stage of the last run, excluding child processes.",
+              [({'stage': s['name']}, s['cpu_seconds']) for s in stages])
+        gauge('stage_children_cpu_seconds', "CPU time of the child processes of each stage of the last run.",
+              [({'stage': s['name']}, s['children_cpu_seconds']) for s in stages])
+        gauge('stage_items', "Items (e.g. sentences) processed by each stage of the last run.",
+              [({'stage': s['name']}, s['items']) for s in stages])
+        gauge('stage_pages', "Pages processed by each stage of the last run.",
+              [({'stage': s['name']}, s['pages']) for s in stages])
+        gauge('stage_documents', "Documents recorded by each stage of the last run.",
+              [({'stage': s['name']}, len(s['documents']) or None) for s in stages])
+        gauge('stage_peak_rss_bytes', "Peak resident set size during each stage of the last run.",
+              [({'stage': s['name']}, s['peak_rss_bytes']) for s in stages])
+        _write_atomically(self.path, '\n'.join(lines) + '\n')
+
+
+def _escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
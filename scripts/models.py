@@ -0,0 +1,166 @@
+import logging
+import os
+import pickle
+import threading
+
+# Name of the SentenceTransformer model used for the classifier's input features
+SENT_EMB_MODEL_NAME = 'paraphrase-MiniLM-L6-v2'
+
+# Models loaded so far in this process, by name
+_sentence_models = {}
+_lock = threading.Lock()
+
+
+def get_sentence_model(model_name: str = SENT_EMB_MODEL_NAME, local_files_only: bool = False):
+    """
+    Returns the SentenceTransformer model with the given name, loading it on first use.
+
+    sentence_transformers (and torch) are only imported by the first call, so modules
+    that import this one stay fast to import. Later calls return the same model object.
+
+    Args:
+        model_name (str, optional): Name or local path of the model.
+                                    Defaults to SENT_EMB_MODEL_NAME.
+        local_files_only (bool, optional): Load the model from the local cache only, never
+                                           from the Hugging Face Hub. Defaults to False.
+
+    Returns:
+        SentenceTransformer: The loaded model.
+    """
+    with _lock:
+        if model_name not in _sentence_models:
+            from sentence_transformers import SentenceTransformer
+            _sentence_models[model_name] = SentenceTransformer(model_name, local_files_only=local_files_only)
+            logging.info(f"SentenceTransformer model '{model_name}' loaded successfully.")
+        return _sentence_models[model_name]
+
+
+# Classifiers loaded so far in this process, by absolute path: (file version, model)
+_classifiers = {}
+
+
+def get_classifier(model_path: str):
+    """
+    Returns the pickled classifier at model_path, loading it on first use.
+
+    The model stays in memory for later calls, which only check the file's
+    modification time and size. When the file has changed since it was loaded,
+    it is loaded again.
+
+    Args:
+        model_path (str): Path of the pickled classifier.
+
+    Returns:
+        The unpickled classifier.
+    """
+    model_path = os.path.abspath(model_path)
+    stat = os.stat(model_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _classifiers.get(model_path)
+        if cached is None or cached[0] != version:
+            with open(model_path, 'rb') as f:
+                _classifiers[model_path] = (version, pickle.load(f))
+            logging.info(f"Classifier '{model_path}' loaded successfully.")
+        return _classifiers[model_path][1]
+
+
+# Registry of clause classifiers: clause name -> pickled model file in the model folder.
+# Clauses added here (or passed to the pipeline) are scored against the same embeddings.
+CLAUSE_MODELS = {
+    'payment_terms': 'ml_classifier_gbc.pkl',
+}
+
+
+def load_clause_models(model_folder: str, clause_models: dict = None) -> dict:
+    """
+    Returns the loaded classifier of each clause (see get_classifier).
+
+    Args:
+        model_folder (str): The path to the directory where the model files are stored.
+        clause_models (dict, optional): Clause name -> model file name. Defaults to CLAUSE_MODELS.
+
+    Returns:
+        dict: Clause name -> classifier.
+    """
+    clause_models = clause_models or CLAUSE_MODELS
+    return {clause: get_classifier(os.path.join(model_folder, model_name))
+            for clause, model_name in clause_models.items()}
+
+
+# Sentence boundary characters of the segmentation pipeline
+SENTENCE_PUNCT_CHARS = ['\n\n', '.', '?', '!']
+
+# spaCy pipelines and word lists loaded so far in this process, by task
+_spacy_pipelines = {}
+_english_lexicon = None
+
+
+def _make_sentence_pipeline():
+    """
+    Minimal segmentation pipeline: the English tokenizer and a rule-based sentencizer.
+    The tagger, NER and other trained components of en_core_web_sm never set sentence
+    boundaries, so leaving them out gives the same sentences at a fraction of the cost.
+    """
+    import spacy
+    nlp = spacy.blank('en')
+    nlp.add_pipe("sentencizer", config={"punct_chars": SENTENCE_PUNCT_CHARS})
+    return nlp
+
+
+def _make_tokenizer_pipeline():
+    """
+    Tokenizer-only pipeline, for tasks that only need tokens and their lexical
+    attributes (e.g. is_alpha).
+    """
+    import spacy
+    return spacy.blank('en')
+
+
+# Factories of the preconfigured pipelines, by task
+SPACY_PIPELINE_FACTORIES = {
+    'sentences': _make_sentence_pipeline,
+    'tokens': _make_tokenizer_pipeline,
+}
+
+
+def get_spacy_pipeline(task: str = 'sentences'):
+    """
+    Returns the process-wide spaCy pipeline for a task, building it on first use.
+
+    Each task gets a pipeline with only the components it needs (see
+    SPACY_PIPELINE_FACTORIES):
+    - 'sentences': tokenizer + sentencizer, used to split texts into sentences
+    - 'tokens': tokenizer only
+
+    Args:
+        task (str, optional): Name of the task. Defaults to 'sentences'.
+
+    Returns:
+        spacy.Language: The shared pipeline.
+    """
+    if task not in SPACY_PIPELINE_FACTORIES:
+        raise ValueError(f"Unknown spaCy task '{task}', expected one of {list(SPACY_PIPELINE_FACTORIES)}")
+    with _lock:
+        if task not in _spacy_pipelines:
+            _spacy_pipelines[task] = SPACY_PIPELINE_FACTORIES[task]()
+            logging.info(f"spaCy pipeline for '{task}' loaded successfully.")
+        return _spacy_pipelines[task]
+
+
+def get_english_lexicon(model_name: str = "en_core_web_sm") -> frozenset:
+    """
+    Returns the set of strings known to a trained spaCy English model, loaded once.
+
+    Only the model's vocabulary is kept, none of its components. The set is taken
+    right after loading, so it does not grow with the texts processed later.
+    """
+    global _english_lexicon
+    with _lock:
+        if _english_lexicon is None:
+            import spacy
+            nlp = spacy.load(model_name, exclude=["tok2vec", "tagger", "parser", "senter",
+                                                  "attribute_ruler", "lemmatizer", "ner"])
+            _english_lexicon = frozenset(nlp.vocab.strings)
+            logging.info(f"English lexicon of '{model_name}' loaded successfully.")
+        return _english_lexicon
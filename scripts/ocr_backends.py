@@ -0,0 +1,230 @@
+import csv
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from typing import List
+import pandas as pd
+
+# Columns of Tesseract's TSV output (pytesseract.image_to_data)
+TSV_COLUMNS = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+               'left', 'top', 'width', 'height', 'conf', 'text']
+
+
+def read_tesseract_tsv(tsv: str, header: bool = True) -> pd.DataFrame:
+    """
+    Parses Tesseract's TSV output like pytesseract.image_to_data does, with the text
+    column read as strings.
+    """
+    if not tsv.strip():
+        return pd.DataFrame(columns=TSV_COLUMNS)
+    return pd.read_csv(io.StringIO(tsv), sep='\t', quoting=csv.QUOTE_NONE, dtype={'text': str},
+                       header=0 if header else None, names=None if header else TSV_COLUMNS)
+
+
+class OcrBackend:
+    """
+    Interface of the OCR engines behind pdf_to_text_with_ocr. A backend turns page
+    images into word positions in Tesseract's image_to_data layout (one DataFrame per
+    image, with page_num 1). Backends that can OCR many images at a lower cost than one
+    at a time set supports_batches, and the pages of a PDF are then sent to them in batches.
+    """
+
+    name = None
+    supports_batches = False
+
+    @classmethod
+    def is_available(cls) -> bool:
+        """
+        Returns True when the engine of the backend is installed.
+        """
+        return True
+
+    def image_to_data(self, image, dpi: int = None) -> pd.DataFrame:
+        """
+        OCRs one page image rendered at `dpi`.
+        """
+        raise NotImplementedError
+
+    def images_to_data(self, images: List, dpis: List = None) -> List:
+        """
+        OCRs many page images, returning one DataFrame per image in the same order.
+        """
+        dpis = dpis or [None] * len(images)
+        return [self.image_to_data(image, dpi=dpi) for image, dpi in zip(images, dpis)]
+
+
+class PytesseractBackend(OcrBackend):
+    """
+    One tesseract process per page through pytesseract: each call writes the image to
+    a temporary file, starts tesseract and loads the language data again.
+
+    Args:
+        lang (str, optional): Tesseract language. Defaults to 'eng'.
+        config (str, optional): Extra tesseract command line options. Defaults to ''.
+    """
+
+    name = 'pytesseract'
+
+    def __init__(self, lang: str = 'eng', config: str = ''):
+        self.lang = lang
+        self.config = config
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return shutil.which(os.environ.get('TESSERACT_CMD', 'tesseract')) is not None
+
+    def image_to_data(self, image, dpi: int = None) -> pd.DataFrame:
+        import pytesseract
+        from pytesseract import Output
+
+        # pytesseract saves the image with its info, so the DPI reaches tesseract
+        if dpi:
+            image.info['dpi'] = (dpi, dpi)
+        return pytesseract.image_to_data(image, lang=self.lang, config=self.config, output_type=Output.DATAFRAME,
+                                         pandas_config={'dtype': {'text': str}})
+
+
+class TesseractBatchBackend(OcrBackend):
+    """
+    Many pages per tesseract process: the images of a batch are written to a temporary
+    folder, listed in a text file, and read by a single tesseract run, whose TSV output
+    is split back into pages by its page_num column. The process start and the loading
+    of the language data are paid once per batch instead of once per page. Tesseract's
+    adaptive classifier carries over from page to page within a run, so the words read
+    can differ slightly from those of one run per page.
+
+    Args:
+        lang (str, optional): Tesseract language. Defaults to 'eng'.
+        config (str, optional): Extra tesseract command line options. Defaults to ''.
+        tesseract_cmd (str, optional): The tesseract executable. Defaults to $TESSERACT_CMD
+                                       or 'tesseract'.
+        timeout (float, optional): Seconds a batch may take before tesseract is stopped.
+                                   Defaults to no limit.
+    """
+
+    name = 'tesseract_batch'
+    supports_batches = True
+
+    def __init__(self, lang: str = 'eng', config: str = '', tesseract_cmd: str = None, timeout: float = None):
+        self.lang = lang
+        self.config = config
+        self.tesseract_cmd = tesseract_cmd or os.environ.get('TESSERACT_CMD', 'tesseract')
+        self.timeout = timeout
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return shutil.which(os.environ.get('TESSERACT_CMD', 'tesseract')) is not None
+
+    def image_to_data(self, image, dpi: int = None) -> pd.DataFrame:
+        return self.images_to_data([image], [dpi])[0]
+
+    def images_to_data(self, images: List, dpis: List = None) -> List:
+        if not images:
+            return []
+        dpis = dpis or [None] * len(images)
+        with tempfile.TemporaryDirectory(prefix='ocr_batch_') as tmp_dir:
+            # Fast PNG compression: the files are read once, right away. The DPI of each
+            # page is saved in its file, so pages of different resolutions can share a batch
+            image_paths = []
+            for i, (image, dpi) in enumerate(zip(images, dpis)):
+                path = os.path.join(tmp_dir, f'page_{i:05d}.png')
+                image.save(path, format='PNG', compress_level=1, **({'dpi': (dpi, dpi)} if dpi else {}))
+                image_paths.append(path)
+            list_path = os.path.join(tmp_dir, 'pages.txt')
+            with open(list_path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(image_paths) + '\n')
+
+            output_base = os.path.join(tmp_dir, 'output')
+            command = [self.tesseract_cmd, list_path, output_base, '-l', self.lang, *self.config.split(), 'tsv']
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=self.timeout)
+            if result.returncode != 0:
+                raise RuntimeError(f"tesseract failed with exit code {result.returncode}: "
+                                   f"{result.stderr.decode('utf-8', errors='replace').strip()}")
+            with open(output_base + '.tsv', 'r', encoding='utf-8') as f:
+                data = read_tesseract_tsv(f.read())
+
+        # Split the pages of the batch, each one numbered page 1 like a single image
+        pages = []
+        for page_num in range(1, len(images) + 1):
+            page = data[data['page_num'] == page_num].reset_index(drop=True)
+            page['page_num'] = 1
+            pages.append(page)
+        return pages
+
+
+class TesserocrBackend(OcrBackend):
+    """
+    Tesseract in the current process through the tesserocr bindings (optional, not in
+    requirements.txt): the engine and its language data are loaded once per process and
+    pages are passed as images in memory, with no temporary file and no process start.
+    Tesseract's API is not thread-safe, so pages are read one at a time.
+
+    Args:
+        lang (str, optional): Tesseract language. Defaults to 'eng'.
+        path (str, optional): Folder of the tessdata language files. Defaults to
+                              tesserocr's default.
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self, lang: str = 'eng', path: str = None):
+        import tesserocr
+
+        self._api = tesserocr.PyTessBaseAPI(lang=lang, **({'path': path} if path else {}))
+        self._lock = threading.Lock()
+
+    @classmethod
+    def is_available(cls) -> bool:
+        try:
+            import tesserocr  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def image_to_data(self, image, dpi: int = None) -> pd.DataFrame:
+        with self._lock:
+            self._api.SetImage(image)
+            if dpi:
+                self._api.SetSourceResolution(dpi)
+            tsv = self._api.GetTSVText(0)
+        return read_tesseract_tsv(tsv, header=False)
+
+    def __del__(self):
+        api = getattr(self, '_api', None)
+        if api is not None:
+            api.End()
+
+
+OCR_BACKENDS = {backend.name: backend for backend in (PytesseractBackend, TesseractBatchBackend, TesserocrBackend)}
+
+# Backends created by get_ocr_backend, one per name and process
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_ocr_backend(backend='pytesseract') -> OcrBackend:
+    """
+    Returns the process-wide OCR backend of a name (see OCR_BACKENDS), creating it on
+    first use, so that engines with a costly start (tesserocr) start once per process.
+    'auto' picks tesserocr when it is installed and pytesseract otherwise. A backend
+    instance is returned as is.
+
+    Args:
+        backend (str or OcrBackend, optional): Name of the backend. Defaults to 'pytesseract'.
+
+    Returns:
+        OcrBackend: The backend.
+    """
+    if isinstance(backend, OcrBackend):
+        return backend
+    if backend == 'auto':
+        backend = 'tesserocr' if TesserocrBackend.is_available() else 'pytesseract'
+    if backend not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR backend '{backend}', expected 'auto' or one of {list(OCR_BACKENDS)}")
+    with _backends_lock:
+        if backend not in _backends:
+            _backends[backend] = OCR_BACKENDS[backend]()
+        return _backends[backend]
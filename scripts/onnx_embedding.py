@@ -0,0 +1,318 @@
+import argparse
+import json
+import logging
+import os
+from typing import List
+import numpy as np
+import pandas as pd
+
+# onnxruntime (and, for the export, torch, onnx and sentence_transformers) are
+# imported by the functions that use them, so this module imports without them.
+
+# Files of an exported model folder
+ONNX_MODEL_FILE = 'model.onnx'
+ONNX_QUANTIZED_MODEL_FILE = 'model.int8.onnx'
+ONNX_CONFIG_FILE = 'onnx_config.json'
+
+# Pooling modes of sentence_transformers' Pooling module that the ONNX encoder applies
+POOLING_MODES = ('mean', 'cls', 'max')
+
+
+def _pooling_mode(pooling_module) -> str:
+    """
+    Returns the pooling mode of a sentence_transformers Pooling module. Newer versions
+    store it as 'pooling_mode', older ones as one 'pooling_mode_<mode>_token(s)' flag.
+    """
+    config = pooling_module.get_config_dict()
+    mode = config.get('pooling_mode')
+    if not isinstance(mode, str):
+        flags = [key for key, value in config.items() if key.startswith('pooling_mode_') and value is True]
+        mode = flags[0][len('pooling_mode_'):].split('_')[0] if len(flags) == 1 else None
+    if mode not in POOLING_MODES:
+        raise ValueError(f"Unsupported pooling configuration {config}, expected one of {list(POOLING_MODES)}")
+    return mode
+
+
+def export_onnx_model(model_path: str, output_dir: str, quantize: bool = False, opset_version: int = 17) -> str:
+    """
+    Exports a SentenceTransformer model to an ONNX model folder for OnnxSentenceEncoder.
+
+    The transformer is exported with dynamic batch and sequence axes; tokenization,
+    pooling and normalization are redone by the encoder from the saved tokenizer and
+    configuration. The model is only read from local files.
+
+    Args:
+        model_path (str): Local path (or name of a locally cached model) of the
+                          SentenceTransformer, e.g. of paraphrase-MiniLM-L6-v2.
+        output_dir (str): Folder the ONNX model is written to (created if needed).
+        quantize (bool, optional): Also write a copy with dynamic int8 quantization
+                                   of the weights. Defaults to False.
+        opset_version (int, optional): ONNX opset of the export. Defaults to 17.
+
+    Returns:
+        str: output_dir.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_path, device='cpu', local_files_only=True)
+    model.eval()
+    transformer, modules = model[0], list(model)
+    pooling = next((m for m in modules if type(m).__name__ == 'Pooling'), None)
+    if pooling is None:
+        raise ValueError(f"Model {model_path} has no Pooling module")
+
+    # Export the transformer alone, returning the token embeddings
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            return self.auto_model(input_ids=input_ids, attention_mask=attention_mask,
+                                   token_type_ids=token_type_ids).last_hidden_state
+
+    tokenizer = model.tokenizer
+    input_names = ['input_ids', 'attention_mask']
+    if 'token_type_ids' in tokenizer.model_input_names:
+        input_names.append('token_type_ids')
+    dummy = tokenizer(['An example sentence.'], return_tensors='pt')
+    os.makedirs(output_dir, exist_ok=True)
+    onnx_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(TokenEmbeddings(transformer.auto_model).eval(),
+                          tuple(dummy[name] for name in input_names), onnx_path,
+                          input_names=input_names, output_names=['token_embeddings'],
+                          dynamic_axes={**{name: {0: 'batch', 1: 'sequence'} for name in input_names},
+                                        'token_embeddings': {0: 'batch', 1: 'sequence'}},
+                          opset_version=opset_version, dynamo=False)
+
+    tokenizer.save_pretrained(output_dir)
+    dummy_embedding = model.encode('An example sentence.')
+    config = {'source_model': model_path, 'input_names': input_names,
+              'max_seq_length': transformer.max_seq_length, 'pooling_mode': _pooling_mode(pooling),
+              'normalize': any(type(m).__name__ == 'Normalize' for m in modules),
+              'dimension': int(dummy_embedding.shape[-1])}
+    with open(os.path.join(output_dir, ONNX_CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=1)
+    logging.info(f"Exported {model_path} to ONNX at: {onnx_path}")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(onnx_path, os.path.join(output_dir, ONNX_QUANTIZED_MODEL_FILE),
+                         weight_type=QuantType.QInt8)
+        logging.info(f"Wrote int8 quantized model to: {os.path.join(output_dir, ONNX_QUANTIZED_MODEL_FILE)}")
+    return output_dir
+
+
+class OnnxSentenceEncoder:
+    """
+    Sentence embedding model run with ONNX Runtime on CPU, a drop-in replacement for
+    the SentenceTransformer in the pipeline's sent_emb_model slot: it provides the
+    encode() and get_sentence_embedding_dimension() methods the pipeline uses.
+
+    Loads a folder written by export_onnx_model, from local files only. The session is
+    created on first use and is not pickled, so the encoder can be passed to embedding
+    worker processes (set intra_op_threads=1 then, so workers do not oversubscribe).
+
+    Args:
+        model_dir (str): Folder written by export_onnx_model.
+        quantized (bool, optional): Use the int8 quantized model. Defaults to False.
+        intra_op_threads (int, optional): Threads per inference call. Defaults to the
+                                          ONNX Runtime default (one per core).
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = False, intra_op_threads: int = None):
+        self.model_dir = model_dir
+        self.quantized = quantized
+        self.intra_op_threads = intra_op_threads
+        with open(os.path.join(model_dir, ONNX_CONFIG_FILE), 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        self.model_path = os.path.join(model_dir, ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"No ONNX model found at {self.model_path}")
+        self._session = None
+        self._tokenizer = None
+
+    @property
+    def model_id(self) -> str:
+        """
+        Identifier of the encoder for the embedding caches, distinct from the PyTorch model's.
+        """
+        return f"onnx{'-int8' if self.quantized else ''}:{self.config['source_model']}"
+
+    def __getstate__(self):
+        return {**self.__dict__, '_session': None, '_tokenizer': None}
+
+    def _load(self):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        options = onnxruntime.SessionOptions()
+        if self.intra_op_threads:
+            options.intra_op_num_threads = self.intra_op_threads
+        self._session = onnxruntime.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        self._tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, 'tokenizer.json'))
+        self._tokenizer.enable_truncation(self.config['max_seq_length'])
+        self._tokenizer.enable_padding()
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config['dimension']
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        """
+        Encodes one sentence or a list of sentences, batch_size sentences per inference
+        call, into float32 embeddings.
+        """
+        if self._session is None:
+            self._load()
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        batches = [self._encode(sentences[i:i + batch_size]) for i in range(0, len(sentences), batch_size)]
+        embeddings = np.concatenate(batches) if batches else np.empty((0, self.config['dimension']), np.float32)
+        return embeddings[0] if single else embeddings
+
+    def _encode(self, sentences: List) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(sentences)
+        inputs = {'input_ids': np.array([e.ids for e in encodings], dtype=np.int64),
+                  'attention_mask': np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                  'token_type_ids': np.array([e.type_ids for e in encodings], dtype=np.int64)}
+        (token_embeddings,) = self._session.run(None, {name: inputs[name] for name in self.config['input_names']})
+
+        # Pool the token embeddings like sentence_transformers' Pooling module
+        mask = inputs['attention_mask'][:, :, None].astype(np.float32)
+        if self.config['pooling_mode'] == 'mean':
+            embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        elif self.config['pooling_mode'] == 'cls':
+            embeddings = token_embeddings[:, 0]
+        else:
+            embeddings = np.where(mask > 0, token_embeddings, -1e9).max(axis=1)
+        if self.config['normalize']:
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32)
+
+
+def compare_embedding_backends(texts: List, filenames: List, reference_model, candidate_model, clf_model,
+                               labels=None, threshold: float = 0.5) -> dict:
+    """
+    Checks that a candidate embedding backend (e.g. an OnnxSentenceEncoder) can replace
+    the reference PyTorch model, by scoring the same documents with both.
+
+    Args:
+        texts (list): Texts of the documents.
+        filenames (list): Names of the documents.
+        reference_model: The SentenceTransformer the classifier was trained with.
+        candidate_model: The backend to check.
+        clf_model: The loaded classification model.
+        labels (pd.DataFrame, optional): 0/1 'Label' of each sentence, by 'filename' and
+                                       'sentence_index', one row per sentence. When given,
+                                       the AUC of both backends against the labels is reported.
+        threshold (float, optional): Probability threshold of the classifier.
+
+    Returns:
+        dict: 'documents', 'sentences', 'top_sentence_agreement' (share of documents with
+              the same top sentence), 'mean_cosine_similarity' and 'max_probability_diff'
+              of the two backends, 'auc_vs_reference' (AUC of the candidate's probabilities
+              against the reference's decisions at the threshold) and, with labels,
+              'auc_reference' and 'auc_candidate'. AUCs are None when only one class occurs.
+    """
+    from sklearn.metrics import roc_auc_score
+    from helper_functions import process_texts_to_dataframe, embed_sentences
+
+    def auc(y_true, y_score):
+        return float(roc_auc_score(y_true, y_score)) if len(set(y_true)) == 2 else None
+
+    df = process_texts_to_dataframe(texts, filenames)
+    sentences = df['sentence_text'].tolist()
+    reference = embed_sentences(sentences, reference_model)
+    candidate = embed_sentences(sentences, candidate_model)
+    p_reference = clf_model.predict_proba(reference)[:, 1]
+    p_candidate = clf_model.predict_proba(candidate)[:, 1]
+
+    top_reference = pd.Series(p_reference).groupby(df['filename']).idxmax()
+    top_candidate = pd.Series(p_candidate).groupby(df['filename']).idxmax()
+    cosine = (reference * candidate).sum(axis=1) / np.clip(
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1), 1e-12, None)
+
+    report = {
+        'documents': len(top_reference),
+        'sentences': len(df),
+        'top_sentence_agreement': float((top_reference == top_candidate).mean()) if len(df) else None,
+        'mean_cosine_similarity': float(cosine.mean()) if len(df) else None,
+        'max_probability_diff': float(np.abs(p_reference - p_candidate).max()) if len(df) else None,
+        'auc_vs_reference': auc((p_reference >= threshold).astype(int), p_candidate),
+    }
+    if labels is not None:
+        # Join on the sentence keys, since the order of the documents is not fixed
+        if len(labels) != len(df):
+            raise ValueError(f"Expected one label per sentence, got {len(labels)} labels for {len(df)} sentences")
+        labeled = df[['filename', 'sentence_index']].merge(
+            labels[['filename', 'sentence_index', 'Label']].astype({'sentence_index': df['sentence_index'].dtype}),
+            on=['filename', 'sentence_index'], how='left', validate='one_to_one')
+        if labeled['Label'].isna().any():
+            raise ValueError(f"No label for {int(labeled['Label'].isna().sum())} sentences")
+        labels = labeled['Label'].astype(int).to_numpy()
+        report['auc_reference'] = auc(labels, p_reference)
+        report['auc_candidate'] = auc(labels, p_candidate)
+    return report
+
+
+if __name__ == "__main__":
+    # Configure logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from models import CLAUSE_MODELS
+
+    parser = argparse.ArgumentParser(
+        description="Export the sentence embedding model to ONNX, and check the ONNX backend against PyTorch."
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Export a local SentenceTransformer model to ONNX.")
+    export_parser.add_argument("--model", type=str, required=True,
+                               help="Local path (or locally cached name) of the SentenceTransformer model.")
+    export_parser.add_argument("--output_dir", type=str, required=True,
+                               help="Folder the ONNX model is written to.")
+    export_parser.add_argument("--quantize", action="store_true",
+                               help="Also write a dynamically int8 quantized model.")
+
+    check_parser = subparsers.add_parser('check', help="Compare the ONNX backend with the PyTorch model.")
+    check_parser.add_argument("--model", type=str, required=True,
+                              help="Local path (or locally cached name) of the SentenceTransformer model.")
+    check_parser.add_argument("--onnx_dir", type=str, required=True,
+                              help="Folder written by the export command.")
+    check_parser.add_argument("--quantized", action="store_true",
+                              help="Check the int8 quantized model.")
+    check_parser.add_argument("--text_folder", type=str, required=True,
+                              help="Folder of .txt files to score (e.g. the 'text_files' output folder).")
+    check_parser.add_argument("--model_folder", type=str, required=True,
+                              help="Path to the folder containing the clause classifiers.")
+    check_parser.add_argument("--clause", type=str, choices=list(CLAUSE_MODELS), default='payment_terms',
+                              help="Clause whose classifier in models.CLAUSE_MODELS scores the sentences "
+                                   "(default: payment_terms).")
+    check_parser.add_argument("--model_name", type=str, default=None,
+                              help="Classifier file in --model_folder, instead of the one of --clause.")
+    check_parser.add_argument("--labels", type=str, default=None,
+                              help="Optional CSV with 'filename', 'sentence_index' and 'Label' (1 for clause "
+                                   "sentences) columns, one row per sentence.")
+    check_parser.add_argument("--threshold", type=float, default=0.5,
+                              help="Probability threshold for model predictions (default: 0.5).")
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_onnx_model(args.model, args.output_dir, quantize=args.quantize)
+    else:
+        from sentence_transformers import SentenceTransformer
+        from helper_functions import read_text_files
+        from models import get_classifier
+
+        texts, filenames = read_text_files(args.text_folder)
+        labels = pd.read_csv(args.labels) if args.labels else None
+        report = compare_embedding_backends(
+            texts, filenames,
+            SentenceTransformer(args.model, device='cpu', local_files_only=True),
+            OnnxSentenceEncoder(args.onnx_dir, quantized=args.quantized),
+            get_classifier(os.path.join(args.model_folder, args.model_name or CLAUSE_MODELS[args.clause])),
+            labels=labels, threshold=args.threshold)
+        print(json.dumps(report, indent=1))
@@ -1,25 +1,40 @@
 import glob
+import json
 import os
-import pickle
-from sentence_transformers import SentenceTransformer
+import pandas as pd
+import numpy as np
 import argparse
+import queue
+import threading
 import logging # Import the logging module
 
-from helper_functions import pdf_to_text_with_ocr, pull_text_from_html, read_text_files, calculate_ocr_quality, plot_ocr_quality_histogram, process_texts_to_dataframe, run_classification_model
+from helper_functions import pdf_to_text_with_ocr, pdf_to_text, ocr_pdfs_parallel, iter_text_from_html, html_to_text, read_text_files, calculate_ocr_quality, read_ocr_quality, QUALITY_SUFFIX, plot_ocr_quality_histogram, process_texts_to_dataframe, RENDER_DEFAULTS, run_classification_model, rank_top_sentences, rank_top_sentences_by_clause, top_sentence_results, clause_results, embed_sentences, STAGE_VERSIONS
+from document_cache import DocumentCache
+from embedding_cache import SentenceEmbeddingCache
+from sentence_store import SentenceStore
+from ann_index import SentenceAnnIndex
+from onnx_embedding import OnnxSentenceEncoder
+from prefilter import SentencePrefilter, PATTERN_SETS
+from ocr_backends import OCR_BACKENDS
+from instrumentation import Instrumentation, JsonReportExporter, PrometheusTextfileExporter, RUN_REPORT_FILE, PROFILERS
+from models import get_sentence_model, get_spacy_pipeline, get_classifier, load_clause_models, SENT_EMB_MODEL_NAME
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Load the SentenceTransformer model for model input features. This model needs to be loaded once.
-try:
-    sent_emb_model = SentenceTransformer('paraphrase-MiniLM-L6-v2')
-    logging.info("SentenceTransformer model loaded successfully.")
-except Exception as e:
-    logging.error(f"Error loading SentenceTransformer model: {e}")
-    exit(1)  # Exit if the model cannot be loaded
+# The SentenceTransformer model for model input features is loaded once, on first use,
+# through models.get_sentence_model()
 
 def process_and_classify_files(input_folder, output_folder, model_folder,
-                               sent_emb_model = sent_emb_model, threshold=0.5):
+                               sent_emb_model = None, threshold=0.5,
+                               embedding_batch_size=64, embedding_workers=0, pdf_mode='auto',
+                               ocr_workers=0, cache_dir=None, cache_max_bytes=5 * 1024 ** 3,
+                               embedding_model_id=SENT_EMB_MODEL_NAME, embedding_cache_path=None,
+                               embedding_cache_max_entries=2_000_000, spacy_batch_size=32, spacy_workers=1,
+                               embedding_store_dtype='float32', export_positions_excel=False, prefilter=None,
+                               top_k=1, context_sentences=1, clause_models=None, html_workers=0,
+                               instrumentation=None, render_options=None, ocr_backend='pytesseract',
+                               ocr_batch_size=8, ann_index_dir=None):
     """
     Orchestrates the entire process of ingesting files, plotting OCR quality,
     running a classification model, and outputting the results.
@@ -35,11 +50,82 @@ def process_and_classify_files(input_folder, output_folder, model_folder,
         output_folder (str): Path to the folder where the final Excel output
                              will be saved.
         model_folder (str): The path to the directory where the pre-trained model file is stored.
-        sent_emb_model (SentenceTransformer): SentenceTransformer object that is used to create
-                            embeddings which are used as input features for the model
+        sent_emb_model (SentenceTransformer, optional): SentenceTransformer object that is used to create
+                            embeddings which are used as input features for the model. Defaults to
+                            the shared model from models.get_sentence_model()
         threshold (float, optional): Probability threshold below which to ignore/mask model predictions
+        embedding_batch_size (int, optional): Number of sentences encoded per forward pass
+        embedding_workers (int, optional): Number of CPU worker processes used for the embeddings
+                            (0 encodes in the current process)
+        pdf_mode (str, optional): How PDF pages are read - 'auto' (text layer when usable, OCR
+                            otherwise), 'ocr' or 'native'
+        ocr_workers (int, optional): Number of worker processes that PDF pages are spread over
+                            (0 processes the PDFs one page at a time in the current process)
+        cache_dir (str, optional): Folder of the incremental document cache. When set, the text,
+                            sentences and embeddings of unchanged documents are reused from the
+                            cache instead of being recomputed (see document_cache.py)
+        cache_max_bytes (int, optional): Size limit of the cache, beyond which the least recently
+                            used entries are evicted
+        embedding_model_id (str, optional): Identifier of sent_emb_model, part of the cache key
+                            of the embeddings
+        embedding_cache_path (str, optional): SQLite file of the sentence-level embedding cache.
+                            When set, embeddings of sentences seen in earlier runs are reused
+                            (see embedding_cache.py)
+        embedding_cache_max_entries (int, optional): Number of sentence embeddings kept in that
+                            cache, beyond which the least recently used ones are evicted
+        spacy_batch_size (int, optional): Number of texts per batch passed to spaCy's nlp.pipe
+        spacy_workers (int, optional): Number of processes spaCy splits and tokenizes texts with
+        embedding_store_dtype (str, optional): 'float32' or 'float16', the dtype the embeddings
+                            are saved in, in the sentence store of the output folder
+                            (see sentence_store.py)
+        export_positions_excel (bool, optional): Also save the word positions of each PDF as an
+                            Excel file, next to its Parquet positions file
+        prefilter (SentencePrefilter, optional): Cheap candidate filter applied after segmentation;
+                            only the sentences it keeps are embedded and classified
+                            (see prefilter.py). With clause_models, it must have a pattern set
+                            named after every clause. Defaults to embedding every sentence.
+        top_k (int, optional): When above 1, the top_k best sentences of each document are also
+                            saved, ranked and with their neighboring sentences, to
+                            'model_top_candidates.xlsx'
+        context_sentences (int, optional): Number of neighboring sentences saved on each side
+                            of those candidates
+        clause_models (dict, optional): Clause name -> model file name in model_folder. When set,
+                            every clause classifier is scored against the same embeddings in one
+                            pass, and the results have one row per clause and document, with a
+                            leading 'clause' column (see models.CLAUSE_MODELS). Defaults to the
+                            single model_results.xlsx classifier.
+        html_workers (int, optional): Number of worker processes HTML files are parsed in
+                            (0 parses them one at a time in the current process)
+        instrumentation (Instrumentation, optional): Records the wall time, CPU time, items,
+                            pages and peak memory of each stage, and of each document where it
+                            can be separated, and exports the run report when the run succeeds
+                            (see instrumentation.py). Defaults to writing 'run_report.json' to
+                            the output folder.
+        render_options (dict, optional): How PDF pages are rendered for OCR - DPI, grayscale,
+                            binarization and the blank page threshold (see
+                            helper_functions.RENDER_DEFAULTS). Defaults to RENDER_DEFAULTS.
+        ocr_backend (str, optional): OCR engine of rendered PDF pages - 'pytesseract' (one
+                            tesseract process per page), 'tesseract_batch' (one per batch of pages),
+                            'tesserocr' (in-process, if installed) or 'auto' (see ocr_backends.py).
+                            Defaults to 'pytesseract'.
+        ocr_batch_size (int, optional): Number of pages of a PDF OCRed together by the
+                            'tesseract_batch' backend when ocr_workers is 0. Defaults to 8.
+        ann_index_dir (str, optional): Folder of a persistent nearest neighbor index of sentence
+                            embeddings, kept across runs. When set, the sentences of new and changed
+                            documents are added to it, for clause search with ann_index.py.
+                            Defaults to no index.
     """
     logging.info(f"Starting file processing for input folder: {input_folder}")
+    if instrumentation is None:
+        instrumentation = Instrumentation(exporters=[JsonReportExporter(os.path.join(output_folder, RUN_REPORT_FILE))],
+                                          labels={'input_folder': input_folder})
+    if clause_models and prefilter is not None:
+        uncovered = [clause for clause in clause_models if clause not in prefilter.pattern_sets]
+        if uncovered:
+            raise ValueError(f"The prefilter has no pattern set for the clauses {uncovered}, whose "
+                             f"sentences it would drop before scoring")
+    if sent_emb_model is None:
+        sent_emb_model = get_sentence_model()
 
     # Create a directory for text file output
     text_dir = os.path.join(output_folder, 'text_files')
@@ -48,78 +134,554 @@ def process_and_classify_files(input_folder, output_folder, model_folder,
 
     # 1. Ingest PDF and HTML files
     logging.info("Ingesting files...")
-    # Process PDFs with OCR
     pdf_files = glob.glob(os.path.join(input_folder, '*.pdf'))
-    for pdf_file in pdf_files:
-        try:
-            pdf_to_text_with_ocr(pdf_file, text_dir)
-            logging.info(f"Successfully processed PDF file: {pdf_file}")
-        except Exception as e:
-            logging.error(f"Error processing PDF file {pdf_file}: {e}")
-
-    # Process HTML files
     html_files1 = glob.glob(os.path.join(input_folder, '*.html'))
     html_files2 = glob.glob(os.path.join(input_folder, '*.htm'))
     html_files = html_files1 + html_files2
-    html_texts = pull_text_from_html(html_files)
-    for html_file, text_content in zip(html_files, html_texts):
-        if text_content:
-            if html_file.lower().endswith('.html'):
-                file_name = os.path.basename(html_file).replace('.html', '.txt')
-            elif html_file.lower().endswith('.htm'):
-                file_name = os.path.basename(html_file).replace('.htm', '.txt')
-            output_file_path = os.path.join(text_dir, file_name)
-            try:
-                with open(output_file_path, 'w', encoding='utf-8') as f:
-                    f.write(text_content)
-                logging.info(f"Successfully processed HTML file: {html_file} and saved to {output_file_path}")
-            except Exception as e:
-                logging.error(f"Error saving HTML content from {html_file} to {output_file_path}: {e}")
+
+    # Restore the texts of unchanged files from the cache, and only ingest the others
+    cache = DocumentCache(cache_dir, max_bytes=cache_max_bytes) if cache_dir else None
+    text_keys = {}
+    if cache is not None:
+        pdf_files = restore_cached_texts(cache, pdf_files, text_dir, 'pdf',
+                                         pdf_cache_options(pdf_mode, render_options, ocr_backend), text_keys)
+        html_files = restore_cached_texts(cache, html_files, text_dir, 'html', '', text_keys)
+        logging.info(f"Restored {len(text_keys) - len(pdf_files) - len(html_files)} texts from the cache, "
+                     f"{len(pdf_files) + len(html_files)} files left to ingest.")
+
+    # Process PDFs with OCR
+    page_reports = []
+    with instrumentation.stage('pdf') as stage:
+        if ocr_workers and ocr_workers > 0:
+            # Spread the pages of all PDFs over a pool of worker processes
+            pdf_page_reports = ocr_pdfs_parallel(pdf_files, text_dir, mode=pdf_mode, max_workers=ocr_workers,
+                                                 export_excel=export_positions_excel,
+                                                 render_options=render_options, ocr_backend=ocr_backend)
         else:
-            logging.warning(f"No content extracted from HTML file: {html_file}. Skipping save.")
-
-    # 2. Read all ingested text files
-    logging.info("Reading ingested text files...")
-    texts, filenames = read_text_files(text_dir)
-    logging.info(f"Read {len(texts)} text files.")
-    df = process_texts_to_dataframe(texts, filenames)
-    logging.info("Processed texts into DataFrame.")
-    df['Embedding'] = df['sentence_text'].apply(lambda x: sent_emb_model.encode(x))
-    logging.info("Generated sentence embeddings.")
-
-    # Save DataFrame for debugging/future use
-    data_df_path = os.path.join(output_folder, 'data_df.pkl')
-    try:
-        with open(data_df_path, 'wb') as pkl:
-            pickle.dump(df, pkl)
-        logging.info(f"DataFrame with embeddings saved to: {data_df_path}")
-    except Exception as e:
-        logging.error(f"Error saving DataFrame to {data_df_path}: {e}")
+            pdf_page_reports = {}
+            for pdf_file in pdf_files:
+                with stage.document(pdf_file) as document:
+                    try:
+                        page_report = pdf_to_text_with_ocr(pdf_file, text_dir, mode=pdf_mode,
+                                                           export_excel=export_positions_excel,
+                                                           render_options=render_options,
+                                                           ocr_backend=ocr_backend,
+                                                           ocr_batch_size=ocr_batch_size)
+                        pdf_page_reports[pdf_file] = page_report
+                        document['pages'] = len(page_report) if page_report is not None else None
+                    except Exception as e:
+                        logging.error(f"Error processing PDF file {pdf_file}: {e}")
+
+        for pdf_file, page_report in pdf_page_reports.items():
+            if page_report is None:
+                continue
+            if ocr_workers and ocr_workers > 0:
+                # Pages are interleaved across documents in the pool, so only their count is recorded
+                stage.record_document(pdf_file, pages=len(page_report))
+            page_report.insert(0, 'filename', os.path.basename(pdf_file))
+            page_reports.append(page_report)
+            method_counts = page_report['method'].value_counts().to_dict()
+            logging.info(f"Successfully processed PDF file: {pdf_file} (pages by method: {method_counts})")
+            for _, failed in page_report[page_report['error'].notna()].iterrows():
+                logging.error(f"Error processing page {failed['page_num']} of PDF file {pdf_file}: {failed['error']}")
+        stage.items = len(pdf_page_reports)
+        stage.pages = sum(len(page_report) for page_report in pdf_page_reports.values() if page_report is not None)
 
+        # Save the per-page report, so throughput and OCR quality can be split by method
+        if page_reports:
+            page_report_path = os.path.join(output_folder, 'page_report.csv')
+            all_pages = pd.concat(page_reports, ignore_index=True)
+            all_pages.to_csv(page_report_path, index=False)
+            logging.info(f"Per-page extraction report saved to: {page_report_path}")
+            logging.info(f"Rendered {all_pages['render_seconds'].notna().sum()} pages in "
+                         f"{all_pages['render_seconds'].sum():.1f}s, OCR took {all_pages['ocr_seconds'].sum():.1f}s, "
+                         f"{(all_pages['method'] == 'blank').sum()} blank pages skipped.")
 
-    # 3. Create output plot of OCR quality
+    # Process HTML files
+    # Each text is written as soon as it is extracted, rather than all kept in memory
+    with instrumentation.stage('html') as stage:
+        for html_file, text_content in stage.timed_documents(iter_text_from_html(html_files,
+                                                                                 num_workers=html_workers)):
+            if text_content:
+                output_file_path = os.path.join(text_dir, text_file_name(html_file))
+                try:
+                    with open(output_file_path, 'w', encoding='utf-8') as f:
+                        f.write(text_content)
+                    logging.info(f"Successfully processed HTML file: {html_file} and saved to {output_file_path}")
+                except Exception as e:
+                    logging.error(f"Error saving HTML content from {html_file} to {output_file_path}: {e}")
+            else:
+                logging.warning(f"No content extracted from HTML file: {html_file}. Skipping save.")
+        stage.items = len(html_files)
+
+    # Store the texts of the newly ingested files in the cache
+    with instrumentation.stage('read_texts') as stage:
+        if cache is not None:
+            for file_path in pdf_files + html_files:
+                output_file_path = os.path.join(text_dir, text_file_name(file_path))
+                if os.path.exists(output_file_path):
+                    with open(output_file_path, 'r', encoding='utf-8') as f:
+                        cache.put_text(text_keys[file_path], f.read())
+                quality_path = os.path.join(text_dir, os.path.basename(file_path) + QUALITY_SUFFIX)
+                if os.path.exists(quality_path):
+                    with open(quality_path, 'r', encoding='utf-8') as f:
+                        cache.put_text_quality(text_keys[file_path], json.load(f))
+
+        # 2. Read all ingested text files
+        logging.info("Reading ingested text files...")
+        texts, filenames = read_text_files(text_dir)
+        logging.info(f"Read {len(texts)} text files.")
+        stage.items = len(texts)
+    embedding_cache = SentenceEmbeddingCache(embedding_cache_path, embedding_model_id,
+                                             max_entries=embedding_cache_max_entries) \
+        if embedding_cache_path else None
+    if cache is None:
+        with instrumentation.stage('segment') as stage:
+            df = process_texts_to_dataframe(texts, filenames, batch_size=spacy_batch_size, n_process=spacy_workers)
+            logging.info("Processed texts into DataFrame.")
+            stage.items = len(df)
+            for filename, count in df.groupby('filename', sort=False).size().items():
+                stage.record_document(filename, items=int(count))
+            # The context of the ranked candidates comes from all sentences, not only the kept ones
+            document_sentences = None
+            if prefilter is not None:
+                document_sentences = df.groupby('filename', sort=False)['sentence_text'].apply(list).to_dict()
+                df = prefilter.filter_dataframe(df)
+        with instrumentation.stage('embed') as stage:
+            embeddings = embed_sentences(df['sentence_text'].tolist(), sent_emb_model,
+                                         batch_size=embedding_batch_size, num_workers=embedding_workers,
+                                         cache=embedding_cache)
+            stage.items = len(embeddings)
+    else:
+        # Cache misses are segmented and embedded in one step, which is measured as one stage
+        with instrumentation.stage('segment_embed') as stage:
+            df, embeddings, document_sentences = segment_and_embed_with_cache(
+                texts, filenames, sent_emb_model, cache, embedding_model_id, embedding_batch_size,
+                embedding_workers, embedding_cache, spacy_batch_size, spacy_workers, prefilter)
+            logging.info(f"Processed texts into DataFrame. Cache statistics: {cache.stats}")
+            stage.items = len(df)
+    if prefilter is not None:
+        logging.info(f"Prefilter kept {prefilter.stats['kept']} of {prefilter.stats['sentences']} sentences "
+                     f"({prefilter.stats['fallback_documents']} documents without candidates kept in full).")
+    if embedding_cache is not None:
+        logging.info(f"Sentence embedding cache: {embedding_cache.stats}, "
+                     f"hit rate {embedding_cache.hit_rate():.1%}")
+        embedding_cache.close()
+    # Each row of the DataFrame holds a view into the contiguous embedding matrix
+    df['Embedding'] = list(embeddings)
+    logging.info(f"Generated sentence embeddings for {embeddings.shape[0]} sentences.")
+
+    # Save the sentences and embeddings for debugging/re-scoring (see load_sentence_store)
+    store_dir = os.path.join(output_folder, 'sentence_store')
+    with instrumentation.stage('sentence_store') as stage:
+        try:
+            store = SentenceStore(store_dir, dtype=embedding_store_dtype)
+            store.clear(dtype=embedding_store_dtype)
+            store.append(df, embeddings)
+            stage.items = len(df)
+            logging.info(f"Sentences and embeddings saved to: {store_dir}")
+        except Exception as e:
+            logging.error(f"Error saving sentences and embeddings to {store_dir}: {e}")
+
+    # Add the new and changed documents to the nearest neighbor index (see ann_index.py)
+    if ann_index_dir:
+        with instrumentation.stage('ann_index') as stage:
+            try:
+                ann_index = SentenceAnnIndex(ann_index_dir, model_id=embedding_model_id)
+                added = ann_index.add(df, embeddings)
+                stage.items = len(df)
+                logging.info(f"Added {added} documents to the index in {ann_index_dir}, "
+                             f"which holds {len(ann_index)} sentences")
+            except Exception as e:
+                logging.error(f"Error adding sentences to the index in {ann_index_dir}: {e}")
+
+    # 3. Create output plot of OCR quality. PDFs come with the scores computed during
+    # OCR; only the other texts (e.g. HTML) are scored here, with the same metric.
     logging.info("Calculating and plotting OCR quality...")
-    ocr_scores = calculate_ocr_quality(texts)
-    plot_ocr_quality_histogram(ocr_scores, output_folder)
+    with instrumentation.stage('quality') as stage:
+        ocr_scores = read_ocr_quality(text_dir, filenames)
+        unscored = [i for i, score in enumerate(ocr_scores) if score is None]
+        if unscored:
+            computed_scores = calculate_ocr_quality([texts[i] for i in unscored])
+            for i, score in zip(unscored, computed_scores):
+                ocr_scores[i] = score
+        logging.info(f"Read {len(ocr_scores) - len(unscored)} precomputed OCR quality scores, "
+                     f"calculated {len(unscored)}.")
+        plot_ocr_quality_histogram(ocr_scores, output_folder)
+        stage.items = len(ocr_scores)
     logging.info("OCR quality histogram generated.")
 
     # 4. Run classification model
     logging.info("Processing texts and running classification model...")
-    df_model_results = run_classification_model(df, model_folder, threshold=threshold)
+    with instrumentation.stage('score') as stage:
+        if clause_models:
+            # One scoring pass over the embeddings for all clauses, one predict_proba per clause
+            clause_candidates = rank_top_sentences_by_clause(df, load_clause_models(model_folder, clause_models),
+                                                             k=max(top_k, 1), context=context_sentences,
+                                                             embeddings=embeddings,
+                                                             document_sentences=document_sentences)
+            df_model_results = clause_results(df, clause_candidates, threshold)
+            logging.info(f"Scored {len(clause_candidates)} clauses: {', '.join(clause_candidates)}")
+            if top_k > 1:
+                candidates = pd.concat([c.assign(clause=clause) for clause, c in clause_candidates.items()],
+                                       ignore_index=True)
+                candidates = candidates[['clause'] + [c for c in candidates.columns if c != 'clause']]
+        elif top_k > 1:
+            # One scoring pass gives both the ranked candidates and the top sentence results
+            candidates = rank_top_sentences(df, model_folder, k=top_k, context=context_sentences,
+                                            embeddings=embeddings, document_sentences=document_sentences)
+            df_model_results = top_sentence_results(df, candidates, threshold)
+        else:
+            df_model_results = run_classification_model(df, model_folder, threshold=threshold,
+                                                         embeddings=embeddings)
+        stage.items = len(df)
     logging.info("Classification model run successfully.")
 
     # 5. Output the results to Excel
-    output_excel_path = os.path.join(output_folder, 'model_results.xlsx')
-    try:
-        df_model_results.to_excel(output_excel_path, index=False)
-        logging.info(f"Classification results saved to: {output_excel_path}")
-    except Exception as e:
-        logging.error(f"Error saving classification results to {output_excel_path}: {e}")
+    with instrumentation.stage('write_excel') as stage:
+        if top_k > 1:
+            candidates_path = os.path.join(output_folder, 'model_top_candidates.xlsx')
+            try:
+                candidates.drop(columns=['row']).to_excel(candidates_path, index=False)
+                logging.info(f"Top {top_k} candidates per document saved to: {candidates_path}")
+            except Exception as e:
+                logging.error(f"Error saving top candidates to {candidates_path}: {e}")
+
+        output_excel_path = os.path.join(output_folder, 'model_results.xlsx')
+        try:
+            df_model_results.to_excel(output_excel_path, index=False)
+            logging.info(f"Classification results saved to: {output_excel_path}")
+        except Exception as e:
+            logging.error(f"Error saving classification results to {output_excel_path}: {e}")
+        stage.items = len(df_model_results)
+
+    # Keep the cache within its size limit
+    if cache is not None:
+        removed = cache.prune()
+        logging.info(f"Evicted {removed} least recently used cache files.")
 
     logging.info("File processing and classification pipeline finished.")
+    report = instrumentation.finish()
+    logging.info("Stage timings: " + ', '.join(f"{stage['name']} {stage['wall_seconds']:.2f}s"
+                                               for stage in report['stages']))
     return df_model_results
 
 
+def stream_process_and_classify_files(input_folder, output_folder, model_folder,
+                                      sent_emb_model=None, threshold=0.5,
+                                      model_name="ml_classifier_gbc.pkl", pdf_mode='auto',
+                                      embedding_batch_size=64, embedding_cache_path=None,
+                                      embedding_model_id=SENT_EMB_MODEL_NAME, max_queue_size=4, prefilter=None,
+                                      render_options=None, ocr_backend='pytesseract'):
+    """
+    Streaming version of process_and_classify_files that handles one document at a time.
+
+    Each document flows through a chain of generator stages - ingest -> segment ->
+    embed -> score -> emit - and each stage runs in its own thread, connected to the
+    next one by a queue of at most max_queue_size documents. Nothing is written to a
+    'text_files' folder and no corpus-wide DataFrame is built, so memory stays flat
+    as the corpus grows, and the result of the first document is available as soon
+    as that document is scored. Results are appended to 'model_results.csv' in the
+    output folder as they arrive. The OCR quality histogram is not produced in this mode.
+
+    Args:
+        input_folder (str): Path to the folder containing PDF and HTML files.
+        output_folder (str): Path to the folder where the CSV output will be saved.
+        model_folder (str): The path to the directory where the pre-trained model file is stored.
+        sent_emb_model (SentenceTransformer, optional): Model used to create the sentence embeddings.
+                            Defaults to the shared model from models.get_sentence_model()
+        threshold (float, optional): Probability threshold below which to ignore/mask model predictions
+        model_name (str, optional): The name of the pickled model file
+        pdf_mode (str, optional): How PDF pages are read - 'auto', 'ocr' or 'native'
+        embedding_batch_size (int, optional): Number of sentences encoded per forward pass
+        embedding_cache_path (str, optional): SQLite file of the sentence-level embedding cache
+        embedding_model_id (str, optional): Identifier of sent_emb_model, used by that cache
+        max_queue_size (int, optional): Number of documents a stage may work ahead of the next one
+        prefilter (SentencePrefilter, optional): Cheap candidate filter applied after segmentation
+        render_options (dict, optional): How PDF pages are rendered for OCR (see
+                            helper_functions.RENDER_DEFAULTS)
+        ocr_backend (str, optional): OCR engine of rendered PDF pages (see ocr_backends.py)
+
+    Yields:
+        pd.DataFrame: The one-row result of each document, in input order.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    input_files = glob.glob(os.path.join(input_folder, '*.pdf')) + \
+        glob.glob(os.path.join(input_folder, '*.html')) + glob.glob(os.path.join(input_folder, '*.htm'))
+    logging.info(f"Streaming {len(input_files)} files from input folder: {input_folder}")
+
+    # Load the models once for the whole stream
+    if sent_emb_model is None:
+        sent_emb_model = get_sentence_model()
+    get_spacy_pipeline('sentences')
+    clf_model = get_classifier(os.path.join(model_folder, model_name))
+    embedding_cache = SentenceEmbeddingCache(embedding_cache_path, embedding_model_id) \
+        if embedding_cache_path else None
+
+    # Chain the stages, each one running ahead of its consumer in a background thread
+    docs = run_stage_in_thread(ingest_stage(input_files, pdf_mode, render_options, ocr_backend), max_queue_size)
+    docs = run_stage_in_thread(segment_stage(docs, prefilter), max_queue_size)
+    docs = run_stage_in_thread(embed_stage(docs, sent_emb_model, embedding_batch_size, embedding_cache),
+                               max_queue_size)
+    results = score_stage(docs, clf_model, threshold)
+
+    # Emit: append every result to the CSV output as soon as it is scored
+    output_csv_path = os.path.join(output_folder, 'model_results.csv')
+    if os.path.exists(output_csv_path):
+        os.remove(output_csv_path)
+    try:
+        for result in results:
+            result.drop(columns=['Embedding']).to_csv(output_csv_path, mode='a', index=False,
+                                                      header=not os.path.exists(output_csv_path))
+            yield result
+    finally:
+        # Stops the stage threads when the caller stops early
+        results.close()
+        if embedding_cache is not None:
+            logging.info(f"Sentence embedding cache: {embedding_cache.stats}, "
+                         f"hit rate {embedding_cache.hit_rate():.1%}")
+            embedding_cache.close()
+    logging.info(f"Streaming pipeline finished. Results saved to: {output_csv_path}")
+
+
+class _StageError:
+    """
+    Carries an exception raised in a stage thread over to the consuming thread.
+    """
+    def __init__(self, error):
+        self.error = error
+
+
+# Marks the end of the items passed between two stages
+_END_OF_STREAM = object()
+
+
+def run_stage_in_thread(stage, max_queue_size, put_timeout=0.1):
+    """
+    Runs a generator stage in a background thread and yields its items through a
+    bounded queue, so the stage works ahead of its consumer by at most max_queue_size
+    items. An exception raised in the stage is raised again in the consumer.
+
+    When the consumer stops early (break, close() or an error), the thread stops too:
+    it checks every put_timeout seconds whether the consumer is gone while the queue is
+    full, and then closes the stage, which stops the threads of earlier stages in turn.
+    """
+    items = queue.Queue(maxsize=max_queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        # Wait for room in the queue, unless the consumer is gone
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=put_timeout)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in stage:
+                if not put(item):
+                    break
+        except Exception as e:
+            put(_StageError(e))
+        finally:
+            if stop.is_set() and hasattr(stage, 'close'):
+                stage.close()
+            put(_END_OF_STREAM)
+
+    threading.Thread(target=produce, name=f"stage-{getattr(stage, '__name__', 'stage')}", daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END_OF_STREAM:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+
+def ingest_stage(input_files, pdf_mode='auto', render_options=None, ocr_backend='pytesseract'):
+    """
+    Yields (filename, text) for each PDF or HTML file that text can be extracted from.
+    The filename is the name of the text file the batch pipeline would have written.
+    """
+    for file_path in input_files:
+        try:
+            if file_path.lower().endswith('.pdf'):
+                text = pdf_to_text(file_path, mode=pdf_mode, render_options=render_options,
+                                   ocr_backend=ocr_backend)
+            else:
+                text = html_to_text(file_path)
+        except Exception as e:
+            logging.error(f"Error processing file {file_path}: {e}")
+            continue
+        if not text:
+            logging.warning(f"No content extracted from file: {file_path}. Skipping.")
+            continue
+        logging.info(f"Successfully ingested file: {file_path}")
+        yield text_file_name(file_path), text
+
+
+def segment_stage(docs, prefilter=None):
+    """
+    Yields (filename, sentence DataFrame) for each document with at least one sentence,
+    keeping only the candidate sentences when a prefilter is given.
+    """
+    for filename, text in docs:
+        df = process_texts_to_dataframe([text], [filename])
+        if prefilter is not None:
+            df = prefilter.filter_dataframe(df)
+        if df.empty:
+            logging.warning(f"No sentences found in {filename}. Skipping.")
+            continue
+        yield filename, df
+
+
+def embed_stage(docs, sent_emb_model, embedding_batch_size=64, embedding_cache=None):
+    """
+    Yields (filename, sentence DataFrame, embedding matrix) for each document.
+    """
+    for filename, df in docs:
+        embeddings = embed_sentences(df['sentence_text'].tolist(), sent_emb_model,
+                                     batch_size=embedding_batch_size, cache=embedding_cache)
+        yield filename, df, embeddings
+
+
+def score_stage(docs, clf_model, threshold=0.5):
+    """
+    Yields the one-row classification result of each document.
+    """
+    for filename, df, embeddings in docs:
+        df['Embedding'] = list(embeddings)
+        yield run_classification_model(df, None, threshold=threshold, clf_model=clf_model,
+                                       embeddings=embeddings)
+
+
+def text_file_name(file_path):
+    """
+    Returns the name of the text file that an ingested PDF or HTML file is saved as.
+    """
+    base_name = os.path.basename(file_path)
+    if file_path.lower().endswith('.pdf'):
+        return base_name + '.txt'
+    if file_path.lower().endswith('.html'):
+        return base_name.replace('.html', '.txt')
+    return base_name.replace('.htm', '.txt')
+
+
+def pdf_cache_options(pdf_mode, render_options=None, ocr_backend='pytesseract'):
+    """
+    Returns the PDF extraction options that are part of the cache key of a PDF's text:
+    the PDF mode, and the render options and OCR backend that differ from the defaults.
+    """
+    changed = {key: value for key, value in (render_options or {}).items() if RENDER_DEFAULTS.get(key) != value}
+    if ocr_backend != 'pytesseract':
+        changed['ocr_backend'] = ocr_backend
+    return f"{pdf_mode}|{json.dumps(changed, sort_keys=True)}" if changed else pdf_mode
+
+
+def restore_cached_texts(cache, file_paths, text_dir, file_type, options, text_keys):
+    """
+    Writes the cached text (and OCR quality metrics) of each unchanged file to the text
+    files directory.
+
+    Args:
+        cache (DocumentCache): The document cache.
+        file_paths (list): Paths of the input files of one type.
+        text_dir (str): Folder the text files are written to.
+        file_type (str): 'pdf' or 'html', selects the extraction code version.
+        options (str): Extraction options that change the text (e.g. the PDF mode).
+        text_keys (dict): Filled with the cache key of the text of every file.
+
+    Returns:
+        list: The files that are not in the cache and still need to be ingested.
+    """
+    to_ingest = []
+    for file_path in file_paths:
+        try:
+            key = text_keys[file_path] = cache.text_key(file_path, STAGE_VERSIONS[file_type], options)
+        except OSError as e:
+            logging.error(f"Error reading file {file_path} for the cache: {e}")
+            continue
+        text = cache.get_text(key)
+        if text is None:
+            to_ingest.append(file_path)
+            continue
+        with open(os.path.join(text_dir, text_file_name(file_path)), 'w', encoding='utf-8') as f:
+            f.write(text)
+        quality = cache.get_text_quality(key)
+        if quality is not None:
+            with open(os.path.join(text_dir, os.path.basename(file_path) + QUALITY_SUFFIX), 'w', encoding='utf-8') as f:
+                json.dump(quality, f)
+    return to_ingest
+
+
+def segment_and_embed_with_cache(texts, filenames, sent_emb_model, cache, embedding_model_id,
+                                 embedding_batch_size=64, embedding_workers=0, embedding_cache=None,
+                                 spacy_batch_size=32, spacy_workers=1, prefilter=None):
+    """
+    Splits texts into sentences and embeds them, reusing the sentences and embeddings
+    of texts found in the cache. Only the cache misses are segmented and embedded,
+    each stage in one batch across all documents. With a prefilter, only the candidate
+    sentences of each document are embedded (and cached).
+
+    Returns:
+        tuple: The sentence DataFrame ('filename', 'sentence_index', 'sentence_text'),
+               the float32 embedding matrix aligned to its rows, and with a prefilter the
+               dict of filename -> all sentence texts of the document (None otherwise).
+    """
+    # Sentences: look up every text, and segment the misses together
+    sentence_keys = [cache.sentences_key(text, STAGE_VERSIONS['segment']) for text in texts]
+    sentences = [cache.get_sentences(key) for key in sentence_keys]
+    missing = [i for i, doc_sentences in enumerate(sentences) if doc_sentences is None]
+    if missing:
+        missing_df = process_texts_to_dataframe([texts[i] for i in missing], [filenames[i] for i in missing],
+                                                batch_size=spacy_batch_size, n_process=spacy_workers)
+        by_file = missing_df.groupby('filename', sort=False)['sentence_text'].apply(list)
+        for i in missing:
+            sentences[i] = by_file.get(filenames[i], [])
+            cache.put_sentences(sentence_keys[i], sentences[i])
+
+    # Candidates: the sentences of each document that go on to embedding, by index
+    document_sentences = None
+    if prefilter is not None:
+        document_sentences = dict(zip(filenames, sentences))
+        kept = [prefilter.select(doc_sentences) for doc_sentences in sentences]
+        sentences = [[doc_sentences[i] for i in doc_kept] for doc_sentences, doc_kept in zip(sentences, kept)]
+    else:
+        kept = [range(len(doc_sentences)) for doc_sentences in sentences]
+
+    # Embeddings: look up every sentence list, and embed the misses in one batched call
+    embedding_keys = [cache.embeddings_key(doc_sentences, STAGE_VERSIONS['embed'], embedding_model_id)
+                      for doc_sentences in sentences]
+    doc_embeddings = [cache.get_embeddings(key) for key in embedding_keys]
+    missing = [i for i, emb in enumerate(doc_embeddings) if emb is None]
+    if missing:
+        new_embeddings = embed_sentences([s for i in missing for s in sentences[i]], sent_emb_model,
+                                         batch_size=embedding_batch_size, num_workers=embedding_workers,
+                                         cache=embedding_cache)
+        start = 0
+        for i in missing:
+            doc_embeddings[i] = new_embeddings[start:start + len(sentences[i])]
+            start += len(sentences[i])
+            cache.put_embeddings(embedding_keys[i], doc_embeddings[i])
+
+    # Assemble the sentence table and the matching embedding matrix in document order
+    df = pd.DataFrame({
+        'filename': [filename for filename, doc_sentences in zip(filenames, sentences) for _ in doc_sentences],
+        'sentence_index': np.fromiter((i for doc_kept in kept for i in doc_kept), dtype=np.int32),
+        'sentence_text': [s for doc_sentences in sentences for s in doc_sentences],
+    })
+    non_empty = [emb for emb in doc_embeddings if len(emb)]
+    embeddings = np.vstack(non_empty).astype(np.float32, copy=False) if non_empty \
+        else embed_sentences([], sent_emb_model)
+    return df, embeddings, document_sentences
+
+
 # --- Main execution block ---
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -150,19 +712,322 @@ if __name__ == "__main__":
         default=0.5,
         help="Probability threshold below which to ignore/mask model predictions (default: 0.5)."
     )
+    parser.add_argument(
+        "--pdf_mode",
+        type=str,
+        choices=['auto', 'ocr', 'native'],
+        default='auto',
+        help="How PDF pages are read: 'auto' uses the text layer when usable and OCR otherwise (default: auto)."
+    )
+    parser.add_argument(
+        "--ocr_dpi",
+        type=str,
+        default='auto',
+        help="Resolution PDF pages are rendered at for OCR, or 'auto' to follow the resolution of each "
+             "page's scan within 150-300 dpi (default: auto)."
+    )
+    parser.add_argument(
+        "--ocr_binarize",
+        action="store_true",
+        help="Binarize rendered pages to black and white before OCR (default: grayscale)."
+    )
+    parser.add_argument(
+        "--blank_ink_ratio",
+        type=float,
+        default=RENDER_DEFAULTS['blank_ink_ratio'],
+        help="Rendered pages with a lower share of dark pixels are skipped as blank; 0 OCRs every page "
+             f"(default: {RENDER_DEFAULTS['blank_ink_ratio']})."
+    )
+    parser.add_argument(
+        "--ocr_backend",
+        type=str,
+        choices=['auto', *OCR_BACKENDS],
+        default='pytesseract',
+        help="OCR engine: 'pytesseract' starts tesseract for every page, 'tesseract_batch' once per batch of "
+             "pages, 'tesserocr' runs it in-process if installed, 'auto' picks tesserocr when available "
+             "(default: pytesseract)."
+    )
+    parser.add_argument(
+        "--ocr_batch_size",
+        type=int,
+        default=8,
+        help="Number of pages of a PDF OCRed by one tesseract run with --ocr_backend tesseract_batch (default: 8)."
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Process one document at a time through streaming stages and append results to a CSV file as they arrive."
+    )
+    parser.add_argument(
+        "--ocr_workers",
+        type=int,
+        default=0,
+        help="Number of worker processes that PDF pages are spread over (default: 0, no worker pool)."
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Folder of the incremental cache of texts, sentences and embeddings (default: no cache)."
+    )
+    parser.add_argument(
+        "--cache_max_gb",
+        type=float,
+        default=5.0,
+        help="Size limit of the cache in GB, beyond which least recently used entries are evicted (default: 5)."
+    )
+    parser.add_argument(
+        "--embedding_cache",
+        type=str,
+        default=None,
+        help="SQLite file of the sentence-level embedding cache (default: no cache)."
+    )
+    parser.add_argument(
+        "--embedding_cache_max_entries",
+        type=int,
+        default=2_000_000,
+        help="Number of sentence embeddings kept in the embedding cache (default: 2000000)."
+    )
+    parser.add_argument(
+        "--spacy_workers",
+        type=int,
+        default=1,
+        help="Number of processes spaCy splits and tokenizes texts with (default: 1)."
+    )
+    parser.add_argument(
+        "--embedding_batch_size",
+        type=int,
+        default=64,
+        help="Number of sentences encoded per forward pass of the embedding model (default: 64)."
+    )
+    parser.add_argument(
+        "--embedding_workers",
+        type=int,
+        default=0,
+        help="Number of CPU worker processes used to create embeddings (default: 0, no worker pool)."
+    )
+    parser.add_argument(
+        "--embedding_store_dtype",
+        type=str,
+        choices=['float32', 'float16'],
+        default='float32',
+        help="Dtype of the embeddings saved in the sentence store of the output folder (default: float32)."
+    )
+    parser.add_argument(
+        "--ann_index_dir",
+        type=str,
+        default=None,
+        help="Folder of a persistent nearest neighbor index that the sentences of new and changed documents "
+             "are added to, searchable with ann_index.py (default: no index)."
+    )
+    parser.add_argument(
+        "--onnx_model_dir",
+        type=str,
+        default=None,
+        help="Create embeddings with ONNX Runtime from a folder written by onnx_embedding.py export "
+             "(default: the PyTorch SentenceTransformer)."
+    )
+    parser.add_argument(
+        "--onnx_quantized",
+        action="store_true",
+        help="Use the int8 quantized model of --onnx_model_dir."
+    )
+    parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        help="Only embed and classify sentences that match the patterns of --prefilter_patterns; "
+             "documents without any match are processed in full."
+    )
+    parser.add_argument(
+        "--prefilter_patterns",
+        type=str,
+        nargs='+',
+        choices=list(PATTERN_SETS),
+        default=['payment_terms'],
+        help="Pattern sets of prefilter.py a candidate sentence may match; with several sets, "
+             "sentences matching any of them are kept (default: payment_terms, or the pattern sets "
+             "of the --clause names)."
+    )
+    parser.add_argument(
+        "--prefilter_min_score",
+        type=int,
+        default=1,
+        help="Number of prefilter patterns a candidate sentence must match (default: 1)."
+    )
+    parser.add_argument(
+        "--top_k",
+        type=int,
+        default=1,
+        help="Also save the top K sentences of each document, ranked with context, "
+             "to model_top_candidates.xlsx (default: 1, top sentence only)."
+    )
+    parser.add_argument(
+        "--context_sentences",
+        type=int,
+        default=1,
+        help="Number of neighboring sentences saved on each side of the top K candidates (default: 1)."
+    )
+    parser.add_argument(
+        "--html_workers",
+        type=int,
+        default=0,
+        help="Number of worker processes HTML files are parsed in (default: 0, in the main process)."
+    )
+    parser.add_argument(
+        "--clause",
+        action="append",
+        metavar="NAME=MODEL_FILE",
+        help="Clause classifier to score, as the clause name and the model file in --model_folder; "
+             "repeat for several clauses, which share one embedding pass "
+             "(default: the payment terms classifier only)."
+    )
+    parser.add_argument(
+        "--run_report",
+        type=str,
+        default=None,
+        help="Path of the JSON run report with the timings, CPU time, items and peak memory of each stage "
+             "(default: run_report.json in the output folder)."
+    )
+    parser.add_argument(
+        "--metrics_textfile",
+        type=str,
+        default=None,
+        help="Also write the stage metrics to this .prom file for the Prometheus node_exporter "
+             "textfile collector (default: not written)."
+    )
+    parser.add_argument(
+        "--profile_stage",
+        type=str,
+        default=None,
+        help="Profile one stage (e.g. 'pdf', 'segment', 'embed' or 'score'); the profile is written to "
+             "the output folder (default: no profiling)."
+    )
+    parser.add_argument(
+        "--profiler",
+        type=str,
+        default='sampling',
+        choices=list(PROFILERS),
+        help="'sampling' (low overhead, collapsed stacks for flame graphs) or 'cprofile' (exact, slower) "
+             "(default: sampling)."
+    )
+    parser.add_argument(
+        "--export_positions_excel",
+        action="store_true",
+        help="Also save the word positions of each PDF as an Excel file (default: Parquet only)."
+    )
 
     # Parse the command-line arguments
     args = parser.parse_args()
 
+    # The streaming pipeline has none of the batch pipeline's corpus-wide steps, so reject
+    # their options instead of silently ignoring them
+    if args.streaming:
+        batch_only = ['clause', 'top_k', 'context_sentences', 'cache_dir', 'ocr_workers', 'ocr_batch_size',
+                      'ann_index_dir', 'html_workers', 'spacy_workers', 'embedding_workers',
+                      'embedding_store_dtype', 'export_positions_excel', 'run_report', 'metrics_textfile',
+                      'profile_stage']
+        ignored = [f"--{dest}" for dest in batch_only if getattr(args, dest) != parser.get_default(dest)]
+        if ignored:
+            parser.error(f"{', '.join(ignored)} cannot be used with --streaming")
+
+    clause_models = None
+    if args.clause:
+        try:
+            clause_models = dict(clause.split('=', 1) for clause in args.clause)
+        except ValueError:
+            parser.error("--clause expects NAME=MODEL_FILE")
+
+    # With several clauses, the prefilter keeps the candidates of every clause, with the
+    # pattern set of the same name, so that no clause loses its sentences before scoring
+    prefilter = None
+    if args.prefilter:
+        pattern_names = args.prefilter_patterns
+        if clause_models and pattern_names == parser.get_default('prefilter_patterns'):
+            pattern_names = list(clause_models)
+        uncovered = [clause for clause in clause_models or []
+                     if clause not in pattern_names or clause not in PATTERN_SETS]
+        if uncovered:
+            parser.error(f"--prefilter has no patterns for the clauses {', '.join(uncovered)} "
+                         f"(pattern sets: {', '.join(PATTERN_SETS)})")
+        prefilter = SentencePrefilter(patterns={name: PATTERN_SETS[name] for name in pattern_names},
+                                      min_score=args.prefilter_min_score)
+
+    # Load the SentenceTransformer model (or its ONNX export) for model input features
+    try:
+        if args.onnx_model_dir:
+            sent_emb_model = OnnxSentenceEncoder(args.onnx_model_dir, quantized=args.onnx_quantized)
+            embedding_model_id = sent_emb_model.model_id
+        else:
+            sent_emb_model = get_sentence_model()
+            embedding_model_id = SENT_EMB_MODEL_NAME
+    except Exception as e:
+        logging.error(f"Error loading SentenceTransformer model: {e}")
+        exit(1)  # Exit if the model cannot be loaded
+
+    render_options = {'dpi': args.ocr_dpi if args.ocr_dpi == 'auto' else int(args.ocr_dpi),
+                      'binarize': args.ocr_binarize, 'blank_ink_ratio': args.blank_ink_ratio}
+
     # Call the main processing function with the parsed arguments
     logging.info("\n--- Starting File Processing and Classification Pipeline ---")
-    results_df = process_and_classify_files(
-        input_folder=args.input_folder,
-        output_folder=args.output_folder,
-        model_folder=args.model_folder,
-        sent_emb_model=sent_emb_model,
-        threshold=args.threshold
-    )
+    if args.streaming:
+        results = []
+        for result in stream_process_and_classify_files(
+                input_folder=args.input_folder,
+                output_folder=args.output_folder,
+                model_folder=args.model_folder,
+                sent_emb_model=sent_emb_model,
+                threshold=args.threshold,
+                pdf_mode=args.pdf_mode,
+                embedding_batch_size=args.embedding_batch_size,
+                embedding_cache_path=args.embedding_cache,
+                embedding_model_id=embedding_model_id,
+                prefilter=prefilter,
+                render_options=render_options,
+                ocr_backend=args.ocr_backend):
+            logging.info(f"Result for {result['filename'].iloc[0]}: probability {result['Probability'].iloc[0]}")
+            results.append(result)
+        results_df = pd.concat(results, ignore_index=True) if results else None
+    else:
+        exporters = [JsonReportExporter(args.run_report or os.path.join(args.output_folder, RUN_REPORT_FILE))]
+        if args.metrics_textfile:
+            exporters.append(PrometheusTextfileExporter(args.metrics_textfile))
+        instrumentation = Instrumentation(exporters=exporters, profile_stage=args.profile_stage,
+                                          profiler=args.profiler, profile_dir=args.output_folder,
+                                          labels={'input_folder': args.input_folder})
+        try:
+            results_df = process_and_classify_files(
+                input_folder=args.input_folder,
+                output_folder=args.output_folder,
+                model_folder=args.model_folder,
+                sent_emb_model=sent_emb_model,
+                threshold=args.threshold,
+                embedding_batch_size=args.embedding_batch_size,
+                embedding_workers=args.embedding_workers,
+                pdf_mode=args.pdf_mode,
+                ocr_workers=args.ocr_workers,
+                cache_dir=args.cache_dir,
+                cache_max_bytes=int(args.cache_max_gb * 1024 ** 3),
+                embedding_model_id=embedding_model_id,
+                embedding_cache_path=args.embedding_cache,
+                embedding_cache_max_entries=args.embedding_cache_max_entries,
+                spacy_workers=args.spacy_workers,
+                embedding_store_dtype=args.embedding_store_dtype,
+                export_positions_excel=args.export_positions_excel,
+                prefilter=prefilter,
+                top_k=args.top_k,
+                context_sentences=args.context_sentences,
+                clause_models=clause_models,
+                html_workers=args.html_workers,
+                instrumentation=instrumentation,
+                render_options=render_options,
+                ocr_backend=args.ocr_backend,
+                ocr_batch_size=args.ocr_batch_size,
+                ann_index_dir=args.ann_index_dir
+            )
+        except BaseException:
+            # Export the stages measured so far, so a failed run still reports where it stopped
+            instrumentation.finish(status='failed')
+            raise
     logging.info("\n--- Pipeline Execution Finished ---")
     if results_df is not None:
         logging.info(f"Results DataFrame head:\n{results_df.head()}")
@@ -0,0 +1,230 @@
+import argparse
+import json
+import logging
+import os
+import re
+from typing import List
+import numpy as np
+import pandas as pd
+
+# Default patterns of a payment terms sentence. They are deliberately broad: the
+# prefilter only has to discard sentences that clearly are not candidates, and the
+# classifier picks the clause among the rest.
+PAYMENT_TERMS_PATTERNS = [
+    r'\bpa(?:y|id|ying)',                        # pay, payment, payable, paid
+    r'\binvoic',                                 # invoice(s), invoiced, invoicing
+    r'\bnet\s*-?\s*\d+',                         # net 30, net-45
+    r'\b(?:\d+|[a-z]+teen|[a-z]+ty)\s*\(?\d*\)?\s*days?\b',  # 30 days, thirty (30) days
+    r'\bdue\b',
+    r'\bremit',
+    r'\bfees?\b',
+    r'\bcompensat',
+    r'\bbill(?:ed|ing|s)?\b',
+    r'\breceipt\b',
+]
+
+# Default patterns of a limitation of liability sentence, as broad as the payment terms ones
+LIABILITY_PATTERNS = [
+    r'\bliab(?:le|ilit)',                        # liable, liability, liabilities
+    r'\bindemni',                                # indemnify, indemnification, indemnity
+    r'\bdamages?\b',
+    r'\bconsequential\b',
+    r'\bin\s+no\s+event\b',
+    r'\bhold\s+harmless\b',
+    r'\bnegligen',                               # negligence, negligent
+    r'\bloss(?:es)?\b',
+    r'\bwarrant',                                # warranty, warranties, warrants
+]
+
+# Pattern sets by clause name (see models.CLAUSE_MODELS)
+PATTERN_SETS = {
+    'payment_terms': PAYMENT_TERMS_PATTERNS,
+    'liability': LIABILITY_PATTERNS,
+}
+
+
+class SentencePrefilter:
+    """
+    Cheap first stage of a cascade: scores sentences with regular expressions and keeps
+    only the candidates, so that embedding and classification skip page headers,
+    signature blocks, OCR garbage and other clearly irrelevant sentences.
+
+    A sentence is a candidate when it has at least min_words words, at least
+    min_alpha_ratio of its characters are letters, and at least min_score of the
+    patterns of one pattern set match it (case-insensitive). With several pattern sets,
+    the candidates are the union of the candidates of each set. With fallback, a document
+    in which no sentence is a candidate keeps all of its sentences, so it still goes the
+    full path.
+
+    Args:
+        patterns (list or dict, optional): Regular expressions of the clause, or a dict of
+                                   pattern set name -> regular expressions for several
+                                   clauses (see PATTERN_SETS). Defaults to PAYMENT_TERMS_PATTERNS.
+        min_score (int, optional): Number of patterns that must match. Defaults to 1.
+        min_words (int, optional): Minimum number of words. Defaults to 3.
+        min_alpha_ratio (float, optional): Minimum share of letters among the
+                                           non-space characters. Defaults to 0.5.
+        fallback (bool, optional): Keep every sentence of documents without candidates.
+                                   Defaults to True.
+    """
+
+    def __init__(self, patterns: List = None, min_score: int = 1, min_words: int = 3,
+                 min_alpha_ratio: float = 0.5, fallback: bool = True):
+        if patterns is None:
+            patterns = {'payment_terms': PAYMENT_TERMS_PATTERNS}
+        elif not isinstance(patterns, dict):
+            patterns = {'patterns': patterns}
+        self.pattern_sets = {name: [re.compile(p, re.IGNORECASE) for p in set_patterns]
+                             for name, set_patterns in patterns.items()}
+        self.min_score = min_score
+        self.min_words = min_words
+        self.min_alpha_ratio = min_alpha_ratio
+        self.fallback = fallback
+        self.stats = {'documents': 0, 'sentences': 0, 'kept': 0, 'fallback_documents': 0}
+
+    def score(self, sentence: str) -> int:
+        """
+        Returns the highest number of patterns of one pattern set that match the
+        sentence, or 0 when it is too short or too garbled to be a candidate.
+        """
+        if len(sentence.split()) < self.min_words:
+            return 0
+        characters = [c for c in sentence if not c.isspace()]
+        if sum(c.isalpha() for c in characters) < self.min_alpha_ratio * len(characters):
+            return 0
+        return max(sum(1 for pattern in patterns if pattern.search(sentence))
+                   for patterns in self.pattern_sets.values())
+
+    def select(self, sentences: List) -> List:
+        """
+        Returns the indices of the candidate sentences of one document, or of all its
+        sentences when none is a candidate and fallback is on.
+        """
+        kept = [i for i, sentence in enumerate(sentences) if self.score(sentence) >= self.min_score]
+        self.stats['documents'] += 1
+        self.stats['sentences'] += len(sentences)
+        if not kept and sentences and self.fallback:
+            kept = list(range(len(sentences)))
+            self.stats['fallback_documents'] += 1
+        self.stats['kept'] += len(kept)
+        return kept
+
+    def mask(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Returns a boolean array marking the candidate rows of a sentence DataFrame
+        (see process_texts_to_dataframe), selected document by document.
+        """
+        keep = np.zeros(len(df), dtype=bool)
+        sentence_texts = df['sentence_text'].tolist()
+        for rows in df.groupby('filename', sort=False).indices.values():
+            keep[rows[self.select([sentence_texts[row] for row in rows])]] = True
+        return keep
+
+    def filter_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Keeps the candidate rows of a sentence DataFrame. The original 'sentence_index'
+        of each row is kept.
+        """
+        return df[self.mask(df)].reset_index(drop=True)
+
+
+def evaluate_prefilter(df: pd.DataFrame, embeddings: np.ndarray, clf_model, prefilter: SentencePrefilter,
+                       label_column: str = 'Label', threshold: float = 0.5) -> dict:
+    """
+    Measures the recall lost by the prefilter against the full path, on a set of
+    sentences labeled 1 (clause) or 0.
+
+    A document is found when its top-scoring sentence is a labeled clause sentence
+    with a probability of at least the threshold.
+
+    Args:
+        df (pd.DataFrame): Labeled sentences with 'filename', 'sentence_text' and label_column.
+        embeddings (np.ndarray): Embedding matrix aligned to the rows of df.
+        clf_model: The loaded classification model.
+        prefilter (SentencePrefilter): The prefilter to evaluate.
+        label_column (str, optional): Name of the label column. Defaults to 'Label'.
+        threshold (float, optional): Probability threshold of the classifier.
+
+    Returns:
+        dict: 'sentences', 'kept_fraction', 'sentence_recall' (share of clause sentences
+              kept), 'document_recall_full' and 'document_recall_cascade' (share of
+              documents with a clause that are found), 'recall_loss' and the prefilter stats.
+    """
+    df = df.reset_index(drop=True)
+    probabilities = pd.Series(clf_model.predict_proba(np.asarray(embeddings, dtype=np.float32))[:, 1])
+    in_cascade = prefilter.mask(df)
+
+    labels = df[label_column].astype(int)
+    positive_docs = set(df.loc[labels == 1, 'filename'])
+
+    def document_recall(candidates):
+        top = probabilities[candidates].groupby(df.loc[candidates, 'filename']).idxmax()
+        found = [doc for doc, row in top.items()
+                 if doc in positive_docs and labels[row] == 1 and probabilities[row] >= threshold]
+        return len(found) / len(positive_docs) if positive_docs else None
+
+    full = document_recall(np.ones(len(df), dtype=bool))
+    cascade = document_recall(in_cascade)
+    return {
+        'sentences': len(df),
+        'kept_fraction': float(in_cascade.mean()) if len(df) else None,
+        'sentence_recall': float(in_cascade[(labels == 1).to_numpy()].mean()) if (labels == 1).any() else None,
+        'document_recall_full': full,
+        'document_recall_cascade': cascade,
+        'recall_loss': full - cascade if positive_docs else None,
+        'prefilter_stats': dict(prefilter.stats),
+    }
+
+
+if __name__ == "__main__":
+    # Configure logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from models import CLAUSE_MODELS
+
+    parser = argparse.ArgumentParser(
+        description="Report the recall the candidate prefilter loses against the full path on a labeled set."
+    )
+    parser.add_argument("--store_dir", type=str, required=True,
+                        help="Sentence store of a pipeline run (the 'sentence_store' output folder).")
+    parser.add_argument("--labels", type=str, required=True,
+                        help="CSV with 'filename', 'sentence_index' and 'Label' (1 for clause sentences) columns.")
+    parser.add_argument("--model_folder", type=str, required=True,
+                        help="Path to the folder containing the clause classifiers.")
+    parser.add_argument("--model_name", type=str, default=None,
+                        help="Classifier file of the clause in --model_folder (default: the classifier of the "
+                             "--patterns clause in models.CLAUSE_MODELS).")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="Probability threshold for model predictions (default: 0.5).")
+    parser.add_argument("--min_score", type=int, default=1,
+                        help="Number of patterns a candidate sentence must match (default: 1).")
+    parser.add_argument("--patterns", type=str, nargs='+', choices=list(PATTERN_SETS), default=['payment_terms'],
+                        help="Pattern sets of the clauses; a sentence matching any set is a candidate "
+                             "(default: payment_terms).")
+    args = parser.parse_args()
+
+    # The recall is only meaningful against the classifier of the clause the patterns are for
+    model_name = args.model_name
+    if model_name is None:
+        missing = [name for name in args.patterns if name not in CLAUSE_MODELS]
+        if missing:
+            parser.error(f"No classifier of the pattern sets {', '.join(missing)} in models.CLAUSE_MODELS; "
+                         f"pass it with --model_name")
+        model_names = {CLAUSE_MODELS[name] for name in args.patterns}
+        if len(model_names) > 1:
+            parser.error(f"The pattern sets {', '.join(args.patterns)} have different classifiers; "
+                         f"choose one with --model_name")
+        model_name = model_names.pop()
+
+    from sentence_store import load_sentence_store
+    from models import get_classifier
+
+    sentences, embeddings = load_sentence_store(args.store_dir)
+    labels = pd.read_csv(args.labels)[['filename', 'sentence_index', 'Label']]
+    labeled = sentences.reset_index().merge(labels, on=['filename', 'sentence_index'], how='left')
+    labeled['Label'] = labeled['Label'].fillna(0)
+    report = evaluate_prefilter(labeled, embeddings[labeled['index'].to_numpy()],
+                                get_classifier(os.path.join(args.model_folder, model_name)),
+                                SentencePrefilter(patterns={name: PATTERN_SETS[name] for name in args.patterns},
+                                                  min_score=args.min_score), threshold=args.threshold)
+    print(json.dumps(report, indent=1))
@@ -0,0 +1,144 @@
+import glob
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+class SentenceStore:
+    """
+    Columnar on-disk store of the segmented sentences and their embeddings, replacing
+    the pickled DataFrame (data_df.pkl) with one object array per sentence.
+
+    The store is a folder with:
+    - sentences-<n>.parquet: the sentence metadata ('filename', 'sentence_index',
+      'sentence_text', ...), one Parquet file per append
+    - embeddings.bin: all embeddings as one contiguous row-major matrix of raw float32
+      (or float16) values, in the same row order as the sentences
+    - meta.json: the embedding dtype and dimension, the row count and the Parquet files
+
+    meta.json is only replaced once the data of an append is written, so an append that
+    is interrupted leaves the store as it was before. The embeddings are loaded as a
+    read-only memory map, so reloading a store for re-scoring neither copies nor reads
+    the whole matrix into memory.
+
+    Args:
+        store_dir (str): Folder of the store (created if needed).
+        dtype (str, optional): 'float32' or 'float16', the dtype of new stores. An
+                               existing store keeps the dtype it was created with.
+                               Defaults to 'float32'.
+    """
+
+    DTYPES = ('float32', 'float16')
+
+    def __init__(self, store_dir: str, dtype: str = 'float32'):
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Unknown embedding dtype '{dtype}', expected one of {list(self.DTYPES)}")
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self.meta = self._read_meta() or {'dtype': dtype, 'dim': None, 'rows': 0, 'parts': []}
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.store_dir, 'meta.json')
+
+    @property
+    def _embeddings_path(self) -> str:
+        return os.path.join(self.store_dir, 'embeddings.bin')
+
+    def _read_meta(self):
+        if not os.path.exists(self._meta_path):
+            return None
+        with open(self._meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_meta(self, meta: dict):
+        tmp_path = f"{self._meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path)
+        self.meta = meta
+
+    def __len__(self) -> int:
+        return self.meta['rows']
+
+    def append(self, df: pd.DataFrame, embeddings: np.ndarray):
+        """
+        Appends sentences and their embeddings (one row of `embeddings` per row of `df`)
+        to the store. An 'Embedding' column in `df` is not stored.
+        """
+        embeddings = np.asarray(embeddings)
+        if embeddings.ndim != 2 or len(embeddings) != len(df):
+            raise ValueError(f"Expected one embedding row per sentence, got {embeddings.shape} "
+                             f"for {len(df)} sentences")
+        dim = self.meta['dim'] if self.meta['dim'] is not None else int(embeddings.shape[1])
+        if embeddings.shape[1] != dim:
+            raise ValueError(f"Expected embeddings of dimension {dim}, got {embeddings.shape[1]}")
+        if not len(df):
+            return
+
+        part = f"sentences-{len(self.meta['parts']):05d}.parquet"
+        df.drop(columns=['Embedding'], errors='ignore').reset_index(drop=True) \
+            .to_parquet(os.path.join(self.store_dir, part), index=False)
+
+        # Drop the bytes of an interrupted append before writing after the last full row
+        itemsize = np.dtype(self.meta['dtype']).itemsize
+        with open(self._embeddings_path, 'ab') as f:
+            f.truncate(self.meta['rows'] * dim * itemsize)
+            f.write(np.ascontiguousarray(embeddings, dtype=self.meta['dtype']).tobytes())
+
+        self._write_meta({**self.meta, 'dim': dim, 'rows': self.meta['rows'] + len(df),
+                          'parts': self.meta['parts'] + [part]})
+
+    def load_sentences(self, columns=None) -> pd.DataFrame:
+        """
+        Returns the sentence metadata of all appends, in row order.
+
+        Args:
+            columns (list, optional): Columns to read. Defaults to all columns.
+        """
+        if not self.meta['parts']:
+            return pd.DataFrame(columns=columns or ['filename', 'sentence_index', 'sentence_text'])
+        return pd.concat([pd.read_parquet(os.path.join(self.store_dir, part), columns=columns)
+                          for part in self.meta['parts']], ignore_index=True)
+
+    def load_embeddings(self) -> np.ndarray:
+        """
+        Returns the embedding matrix (rows x dim) as a read-only memory map of the
+        store, in the dtype it was stored in.
+        """
+        if not self.meta['rows']:
+            return np.empty((0, self.meta['dim'] or 0), dtype=self.meta['dtype'])
+        return np.memmap(self._embeddings_path, dtype=self.meta['dtype'], mode='r',
+                         shape=(self.meta['rows'], self.meta['dim']))
+
+    def clear(self, dtype: str = None):
+        """
+        Removes all sentences and embeddings from the store, and optionally changes
+        the dtype the embeddings are stored in.
+        """
+        if dtype is not None and dtype not in self.DTYPES:
+            raise ValueError(f"Unknown embedding dtype '{dtype}', expected one of {list(self.DTYPES)}")
+        meta = {'dtype': dtype or self.meta['dtype'], 'dim': None, 'rows': 0, 'parts': []}
+        self._write_meta(meta)
+        for path in glob.glob(os.path.join(self.store_dir, 'sentences-*.parquet')) + [self._embeddings_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def load_sentence_store(store_dir: str):
+    """
+    Loads a sentence store saved by the pipeline, e.g. to re-score it with another
+    classifier or threshold without segmenting and embedding the documents again.
+
+    Args:
+        store_dir (str): Folder of the store.
+
+    Returns:
+        tuple: The sentence metadata (DataFrame) and the embeddings (read-only
+               memory-mapped array, one row per sentence).
+    """
+    if not os.path.exists(os.path.join(store_dir, 'meta.json')):
+        raise FileNotFoundError(f"No sentence store found in {store_dir}")
+    store = SentenceStore(store_dir)
+    return store.load_sentences(), store.load_embeddings()
@@ -0,0 +1,377 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+
+from helper_functions import pdf_to_text, html_to_text, process_texts_to_dataframe, \
+    run_classification_model, embed_sentences
+from models import get_sentence_model, get_spacy_pipeline, get_classifier
+from onnx_embedding import OnnxSentenceEncoder
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# File types the service accepts, by extension
+SUPPORTED_EXTENSIONS = ('.pdf', '.html', '.htm')
+
+# Largest upload the service reads into memory, in bytes
+DEFAULT_MAX_BODY_BYTES = 50 * 1024 * 1024
+
+
+class MicroBatcher:
+    """
+    Collects the segmented documents of concurrent requests into micro-batches, so that
+    one embedding call and one classification call serve all the requests of a batch.
+
+    A background thread takes the first waiting document, then waits up to max_wait_ms
+    for more, and scores at most max_batch_size documents together. submit() returns a
+    Future with the one-row result of the document and the timings of its batch.
+
+    Args:
+        sent_emb_model (SentenceTransformer): Model used to create the sentence embeddings.
+        clf_model: The loaded classification model.
+        threshold (float, optional): Probability threshold below which to mask predictions.
+        max_batch_size (int, optional): Maximum number of documents per batch. Defaults to 16.
+        max_wait_ms (float, optional): Time to wait for more documents after the first one
+                                       of a batch. Defaults to 10 ms.
+        embedding_batch_size (int, optional): Number of sentences encoded per forward pass.
+    """
+
+    def __init__(self, sent_emb_model, clf_model, threshold: float = 0.5, max_batch_size: int = 16,
+                 max_wait_ms: float = 10, embedding_batch_size: int = 64):
+        self.sent_emb_model = sent_emb_model
+        self.clf_model = clf_model
+        self.threshold = threshold
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.embedding_batch_size = embedding_batch_size
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, df: pd.DataFrame) -> Future:
+        """
+        Queues the sentence DataFrame of one document (see process_texts_to_dataframe).
+        """
+        future = Future()
+        self._queue.put((df, future, time.perf_counter()))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        """
+        Blocks for the first document, then collects more until the batch is full or
+        max_wait_ms has passed. Returns None once the batcher is closed.
+        """
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # Close after this batch
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._score_batch(batch)
+            except Exception as e:
+                logging.error(f"Error scoring a batch of {len(batch)} documents: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _score_batch(self, batch):
+        start = time.perf_counter()
+
+        # Key the sentences of each request by its position in the batch, as documents
+        # of different requests may share a filename
+        df = pd.concat([doc_df.assign(request=i) for i, (doc_df, _, _) in enumerate(batch)],
+                       ignore_index=True)
+        embeddings = embed_sentences(df['sentence_text'].tolist(), self.sent_emb_model,
+                                     batch_size=self.embedding_batch_size)
+        embedded = time.perf_counter()
+
+        results = run_classification_model(df.rename(columns={'filename': 'document', 'request': 'filename'}),
+                                           None, threshold=self.threshold, clf_model=self.clf_model,
+                                           embeddings=embeddings)
+        classified = time.perf_counter()
+
+        for _, row in results.iterrows():
+            _, future, queued = batch[row['filename']]
+            future.set_result({
+                'result': row.drop(labels=['filename']).rename({'document': 'filename'}),
+                'timings_ms': {'queue': (start - queued) * 1000, 'embed': (embedded - start) * 1000,
+                               'classify': (classified - embedded) * 1000},
+                'batch_size': len(batch),
+            })
+        for _, future, _ in batch:
+            if not future.done():
+                future.set_exception(RuntimeError("The document was not scored"))
+
+
+class ExtractionService:
+    """
+    Keeps the models loaded and extracts the top clause sentence of single documents.
+
+    Text extraction and segmentation run on the thread of each request; embedding and
+    classification are shared by concurrent requests through a MicroBatcher.
+
+    Args:
+        model_folder (str): The path to the directory where the pre-trained model file is stored.
+        model_name (str, optional): The name of the pickled model file.
+        sent_emb_model (SentenceTransformer, optional): Model used to create the sentence
+                            embeddings. Defaults to the shared model from models.get_sentence_model()
+        threshold (float, optional): Probability threshold below which to mask predictions.
+        pdf_mode (str, optional): How PDF pages are read - 'auto', 'ocr' or 'native'.
+        max_batch_size (int, optional): Maximum number of documents scored together.
+        max_wait_ms (float, optional): Time a batch waits for more documents.
+        embedding_batch_size (int, optional): Number of sentences encoded per forward pass.
+        max_body_bytes (int, optional): Largest accepted upload, in bytes; larger requests
+                            are answered with 413.
+    """
+
+    def __init__(self, model_folder: str, model_name: str = "ml_classifier_gbc.pkl", sent_emb_model=None,
+                 threshold: float = 0.5, pdf_mode: str = 'auto', max_batch_size: int = 16,
+                 max_wait_ms: float = 10, embedding_batch_size: int = 64,
+                 max_body_bytes: int = DEFAULT_MAX_BODY_BYTES):
+        # Load every model up front, so that the first request does not pay for it. A service
+        # loads the sentence model from the local cache only: it never downloads at start up
+        if sent_emb_model is None:
+            sent_emb_model = get_sentence_model(local_files_only=True)
+        get_spacy_pipeline('sentences')
+        clf_model = get_classifier(os.path.join(model_folder, model_name))
+        self.pdf_mode = pdf_mode
+        self.max_body_bytes = max_body_bytes
+        self.batcher = MicroBatcher(sent_emb_model, clf_model, threshold=threshold,
+                                    max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+                                    embedding_batch_size=embedding_batch_size)
+
+    def extract(self, filename: str, content: bytes) -> dict:
+        """
+        Extracts the top clause sentence of one uploaded document.
+
+        Args:
+            filename (str): Name of the uploaded file; its extension selects the reader.
+            content (bytes): The bytes of the file.
+
+        Returns:
+            dict: 'filename', 'sentence_index', 'sentence_text' and 'probability' (None when
+                  below the threshold), 'batch_size' and 'timings_ms', the latency of each stage.
+
+        Raises:
+            ValueError: If the file type is not supported or no text can be extracted.
+        """
+        start = time.perf_counter()
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in SUPPORTED_EXTENSIONS:
+            raise ValueError(f"Unsupported file type '{extension}', expected one of {list(SUPPORTED_EXTENSIONS)}")
+
+        # The readers take file paths, so the upload is written to a temporary file
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'document' + extension)
+            with open(path, 'wb') as f:
+                f.write(content)
+            text = pdf_to_text(path, mode=self.pdf_mode) if extension == '.pdf' else html_to_text(path)
+        ingested = time.perf_counter()
+
+        df = process_texts_to_dataframe([text], [filename]) if text else pd.DataFrame()
+        if df.empty:
+            raise ValueError(f"No text could be extracted from {filename}")
+        segmented = time.perf_counter()
+
+        scored = self.batcher.submit(df).result()
+        result = scored['result']
+        timings_ms = {'ingest': (ingested - start) * 1000, 'segment': (segmented - ingested) * 1000,
+                      **scored['timings_ms']}
+        timings_ms['total'] = (time.perf_counter() - start) * 1000
+        return {
+            'filename': filename,
+            'sentence_index': None if pd.isna(result['sentence_index']) else int(result['sentence_index']),
+            'sentence_text': None if pd.isna(result['sentence_text']) else str(result['sentence_text']),
+            'probability': None if pd.isna(result['Probability']) else float(result['Probability']),
+            'batch_size': scored['batch_size'],
+            'timings_ms': {stage: round(ms, 2) for stage, ms in timings_ms.items()},
+        }
+
+    def close(self):
+        self.batcher.close()
+
+
+class ExtractionRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of the ExtractionService held by the server:
+    - POST /extract?filename=<name>: the body is the raw bytes of one PDF or HTML file
+    - GET /health: returns {"status": "ok"} once the models are loaded
+    """
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/extract':
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        filename = parse_qs(url.query).get('filename', [self.headers.get('X-Filename', '')])[0]
+        try:
+            length = int(self.headers['Content-Length'])
+            if length < 0:
+                raise ValueError(length)
+        except (TypeError, ValueError):
+            self._send_json(400, {'error': "Expected a valid Content-Length header"})
+            return
+        if length > self.server.service.max_body_bytes:
+            # The body is not read, so the connection cannot be reused
+            self.close_connection = True
+            self._send_json(413, {'error': f"The file is larger than {self.server.service.max_body_bytes} bytes"})
+            return
+        content = self.rfile.read(length)
+        if not filename or not content:
+            self._send_json(400, {'error': "Expected a file in the request body and a 'filename' parameter"})
+            return
+
+        try:
+            self._send_json(200, self.server.service.extract(os.path.basename(filename), content))
+        except ValueError as e:
+            self._send_json(422, {'error': str(e)})
+        except Exception as e:
+            logging.error(f"Error extracting {filename}: {e}")
+            self._send_json(500, {'error': f"{type(e).__name__}: {e}"})
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} - {format % args}")
+
+
+def make_server(service: ExtractionService, host: str = '127.0.0.1', port: int = 8000) -> ThreadingHTTPServer:
+    """
+    Creates the HTTP server of a service; each request is handled in its own thread.
+    Call serve_forever() on the result to start serving.
+    """
+    server = ThreadingHTTPServer((host, port), ExtractionRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+if __name__ == "__main__":
+    # Set up argument parser
+    parser = argparse.ArgumentParser(
+        description="Serve top clause extraction for single PDF/HTML documents over HTTP, with warm models."
+    )
+    parser.add_argument(
+        "--model_folder",
+        type=str,
+        required=True,
+        help="Path to the folder containing the pre-trained model (e.g., 'ml_classifier_gbc.pkl')."
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default='127.0.0.1',
+        help="Address to listen on (default: 127.0.0.1, local requests only)."
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Port to listen on (default: 8000)."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.5,
+        help="Probability threshold for model predictions (default: 0.5)."
+    )
+    parser.add_argument(
+        "--pdf_mode",
+        type=str,
+        choices=['auto', 'ocr', 'native'],
+        default='auto',
+        help="How PDF pages are read: 'auto' uses the text layer when usable and OCR otherwise (default: auto)."
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=16,
+        help="Maximum number of concurrent documents embedded and classified together (default: 16)."
+    )
+    parser.add_argument(
+        "--max_wait_ms",
+        type=float,
+        default=10,
+        help="Time a batch waits for more documents before it is scored, in ms (default: 10)."
+    )
+    parser.add_argument(
+        "--onnx_model_dir",
+        type=str,
+        default=None,
+        help="Create embeddings with ONNX Runtime from a folder written by onnx_embedding.py export "
+             "(default: the PyTorch SentenceTransformer)."
+    )
+    parser.add_argument(
+        "--onnx_quantized",
+        action="store_true",
+        help="Use the int8 quantized model of --onnx_model_dir."
+    )
+    parser.add_argument(
+        "--max_body_mb",
+        type=float,
+        default=DEFAULT_MAX_BODY_BYTES / (1024 * 1024),
+        help="Largest accepted upload in MB; larger requests get a 413 response (default: 50)."
+    )
+    args = parser.parse_args()
+
+    try:
+        sent_emb_model = OnnxSentenceEncoder(args.onnx_model_dir, quantized=args.onnx_quantized) \
+            if args.onnx_model_dir else None
+        service = ExtractionService(args.model_folder, sent_emb_model=sent_emb_model, threshold=args.threshold,
+                                    pdf_mode=args.pdf_mode, max_batch_size=args.max_batch_size,
+                                    max_wait_ms=args.max_wait_ms,
+                                    max_body_bytes=int(args.max_body_mb * 1024 * 1024))
+    except Exception as e:
+        logging.error(f"Error loading models: {e}")
+        exit(1)
+
+    server = make_server(service, args.host, args.port)
+    logging.info(f"Serving on http://{args.host}:{args.port} (POST /extract?filename=<name> with the file as body)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
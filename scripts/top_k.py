@@ -0,0 +1,121 @@
+import heapq
+from collections import deque
+import pandas as pd
+
+
+class TopKReducer:
+    """
+    Streaming reduction of sentence scores to the k best sentences of each document.
+
+    Scores are added as they are computed, in sentence order within each document, and
+    only a bounded heap of k candidates (plus a few context sentences) is kept per
+    document, so memory grows with the number of documents rather than sentences.
+    Each candidate keeps up to `context` neighboring sentences on either side.
+
+    When only some sentences of each document are added (e.g. the candidates of a
+    prefilter), the context is taken from document_sentences, the full sentence list of
+    each document indexed by 'sentence_index', so that it holds the true neighbors of a
+    candidate rather than the neighboring added sentences.
+
+    Ties keep the sentence that was added first, like DataFrame.idxmax. Every added
+    sentence gets a running row number ('row' in the results), which is its position
+    in the concatenation of everything added.
+
+    Args:
+        k (int, optional): Number of candidates kept per document. Defaults to 3.
+        context (int, optional): Number of neighboring sentences kept on each side of a
+                                 candidate. Defaults to 1.
+        document_sentences (dict, optional): Filename -> list of all sentence texts of the
+                                 document, by sentence index. Defaults to the context of
+                                 the added sentences.
+    """
+
+    def __init__(self, k: int = 3, context: int = 1, document_sentences: dict = None):
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        self.k = k
+        self.context = context
+        self.document_sentences = document_sentences
+        self._rows = 0
+        self._heaps = {}     # filename -> min-heap of (probability, -row, candidate)
+        self._previous = {}  # filename -> the last `context` sentence texts
+        self._pending = {}   # filename -> candidates still collecting following context
+
+    def add(self, filename, sentence_index, sentence_text, probability: float):
+        """
+        Adds the score of one sentence.
+        """
+        row = self._rows
+        self._rows += 1
+        if self.document_sentences is not None:
+            self._add_with_document_context(filename, row, sentence_index, sentence_text, probability)
+            return
+
+        # Complete the following context of earlier candidates that are still kept
+        pending = self._pending.get(filename)
+        if pending:
+            for candidate in pending:
+                candidate['context_after'].append(sentence_text)
+            self._pending[filename] = [c for c in pending
+                                       if c['kept'] and len(c['context_after']) < self.context]
+
+        previous = self._previous.setdefault(filename, deque(maxlen=self.context))
+        heap = self._heaps.setdefault(filename, [])
+        entry = (probability, -row)
+        if len(heap) < self.k or entry > heap[0][:2]:
+            candidate = {'row': row, 'sentence_index': sentence_index, 'sentence_text': sentence_text,
+                         'Probability': probability, 'context_before': list(previous),
+                         'context_after': [], 'kept': True}
+            if len(heap) < self.k:
+                heapq.heappush(heap, (*entry, candidate))
+            else:
+                heapq.heapreplace(heap, (*entry, candidate))[2]['kept'] = False
+            if self.context:
+                self._pending.setdefault(filename, []).append(candidate)
+        if self.context:
+            previous.append(sentence_text)
+
+    def _add_with_document_context(self, filename, row, sentence_index, sentence_text, probability):
+        """
+        Adds the score of one sentence, with its context read from document_sentences.
+        """
+        heap = self._heaps.setdefault(filename, [])
+        entry = (probability, -row)
+        if len(heap) < self.k or entry > heap[0][:2]:
+            sentences = self.document_sentences.get(filename, [])
+            index = int(sentence_index)
+            candidate = {'row': row, 'sentence_index': sentence_index, 'sentence_text': sentence_text,
+                         'Probability': probability,
+                         'context_before': sentences[max(index - self.context, 0):index] if self.context else [],
+                         'context_after': sentences[index + 1:index + 1 + self.context] if self.context else []}
+            if len(heap) < self.k:
+                heapq.heappush(heap, (*entry, candidate))
+            else:
+                heapq.heapreplace(heap, (*entry, candidate))
+
+    def add_batch(self, filenames, sentence_indices, sentence_texts, probabilities):
+        """
+        Adds the scores of a batch of sentences (equal-length sequences).
+        """
+        for item in zip(filenames, sentence_indices, sentence_texts, probabilities):
+            self.add(*item)
+
+    def results(self) -> pd.DataFrame:
+        """
+        Returns the ranked candidates: one row per document and rank (1 = best), with
+        the columns 'filename', 'rank', 'row', 'sentence_index', 'sentence_text',
+        'Probability', 'context_before' and 'context_after' (the neighboring sentences
+        joined with spaces). Documents are sorted by filename.
+        """
+        records = []
+        for filename in sorted(self._heaps):
+            ranked = sorted(self._heaps[filename], key=lambda entry: entry[:2], reverse=True)
+            for rank, (_, _, candidate) in enumerate(ranked, start=1):
+                records.append({'filename': filename, 'rank': rank, 'row': candidate['row'],
+                                'sentence_index': candidate['sentence_index'],
+                                'sentence_text': candidate['sentence_text'],
+                                'Probability': candidate['Probability'],
+                                'context_before': ' '.join(candidate['context_before']),
+                                'context_after': ' '.join(candidate['context_after'])})
+        return pd.DataFrame(records, columns=['filename', 'rank', 'row', 'sentence_index', 'sentence_text',
+                                              'Probability', 'context_before', 'context_after'])
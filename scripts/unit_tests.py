@@ -1,7 +1,38 @@
 import unittest
 import os
 import shutil
-from helper_functions import pdf_to_text_with_ocr, pull_text_from_html, read_text_files
+import importlib.util
+import json
+import pickle
+import subprocess
+import sys
+import threading
+import time
+import http.client
+import urllib.request
+import numpy as np
+from helper_functions import pdf_to_text_with_ocr, pull_text_from_html, read_text_files, embed_sentences, \
+    ocr_data_to_text, extract_pdf_page, text_layer_is_usable, ocr_pdfs_parallel, process_texts_to_dataframe, \
+    ocr_quality_metrics, read_ocr_quality, save_pdf_outputs, save_page_positions, load_page_positions, \
+    run_classification_model, run_clause_models, rank_top_sentences_by_clause, decode_html_bytes, html_to_text, \
+    iter_text_from_html, pdf_to_text, calculate_ocr_quality
+import helper_functions
+from document_cache import DocumentCache
+from sentence_store import SentenceStore, load_sentence_store
+from ann_index import SentenceAnnIndex
+from pipeline import run_stage_in_thread, stream_process_and_classify_files, process_and_classify_files
+from benchmark import generate_corpus, describe_corpus, compare_results, run_benchmark
+from instrumentation import Instrumentation, JsonReportExporter, PrometheusTextfileExporter
+from ocr_backends import OcrBackend, TesseractBatchBackend, get_ocr_backend
+from models import get_classifier
+from service import ExtractionService, make_server
+from onnx_embedding import OnnxSentenceEncoder, export_onnx_model, compare_embedding_backends
+from prefilter import SentencePrefilter, evaluate_prefilter, LIABILITY_PATTERNS, PATTERN_SETS
+from top_k import TopKReducer
+from embedding_cache import SentenceEmbeddingCache
+from unittest import mock
+import pandas as pd
+import fitz
 
 class TestPdfToTextWithOcr(unittest.TestCase):
     """
@@ -59,16 +90,17 @@ class TestPdfToTextWithOcr(unittest.TestCase):
     def test_successful_execution(self):
         """
         Tests the successful execution of pdf_to_text_with_ocr with a valid input.
-        Verifies that the function creates both a text file and an Excel file in
-        the designated output folder.
+        Verifies that the function creates a text file, a positions file and, when
+        requested, an Excel file in the designated output folder.
         """
         # 1. Arrange: Define the expected output file paths based on the input PDF name.
         file_name_base = os.path.basename(self.test_pdf_path)
         expected_txt_path = os.path.join(self.output_dir, file_name_base + '.txt')
+        expected_positions_path = os.path.join(self.output_dir, file_name_base + '.positions.parquet')
         expected_xlsx_path = os.path.join(self.output_dir, file_name_base + '.xlsx')
 
         # 2. Act: Call the function with the path to the existing PDF and the output directory.
-        pdf_to_text_with_ocr(self.test_pdf_path, self.output_dir)
+        pdf_to_text_with_ocr(self.test_pdf_path, self.output_dir, export_excel=True)
 
         # 3. Assert: Verify the expected behavior.
 
@@ -76,6 +108,10 @@ class TestPdfToTextWithOcr(unittest.TestCase):
         self.assertTrue(os.path.exists(expected_txt_path),
                         f"Expected text file not found at {expected_txt_path}")
 
+        # Check that the output positions file was created.
+        self.assertTrue(os.path.exists(expected_positions_path),
+                        f"Expected positions file not found at {expected_positions_path}")
+
         # Check that the output Excel file was created.
         self.assertTrue(os.path.exists(expected_xlsx_path),
                         f"Expected Excel file not found at {expected_xlsx_path}")
@@ -147,6 +183,453 @@ class TestPdfToTextWithOcr(unittest.TestCase):
                          f"Unexpectedly found output Excel file for irrelevant input at {expected_xlsx_path_irrelevant}")
 
 
+class TestExtractPdfPage(unittest.TestCase):
+    """
+    Unit tests for the native text-layer path of extract_pdf_page.
+    """
+
+    def setUp(self):
+        """
+        Opens one PDF with a text layer and one scanned (image-only) PDF from the 'docs' folder.
+        """
+        self.text_layer_pdf = fitz.open(os.path.join('tests/docs', '{0A9CB96C-5A24-4881-97F4-4D0BCFB29CC5}.pdf'))
+        self.scanned_pdf = fitz.open(os.path.join('tests/docs', '{3FE1EA5F-39D8-4F02-A3D2-D105E22CBB7B}.pdf'))
+
+    def tearDown(self):
+        self.text_layer_pdf.close()
+        self.scanned_pdf.close()
+
+    def test_successful_execution(self):
+        """
+        Tests that a page with a usable text layer is read natively, without OCR.
+        """
+        page_text, positions, method = extract_pdf_page(self.text_layer_pdf[0], mode='auto')
+
+        self.assertEqual(method, 'native')
+        self.assertIn('Modification Summary Report', page_text)
+        self.assertTrue(page_text.endswith('\f'))
+        self.assertTrue((positions['method'] == 'native').all())
+        self.assertIn('Modification', positions['text'].tolist())
+
+    def test_edge_case_scanned_page(self):
+        """
+        Tests that an image-only page is flagged for OCR.
+        """
+        words = self.scanned_pdf[0].get_text("words")
+        self.assertFalse(text_layer_is_usable(words))
+
+    def test_scanned_page_rendering(self):
+        """
+        Tests that a scanned page is rendered in grayscale at the resolution of its scan,
+        and that the OCR boxes are scaled back to PDF points.
+        """
+        # 1. Arrange: OCR that finds one word box of 150 x 30 pixels at (300, 600)
+        ocr_data = pd.DataFrame({'level': [5], 'page_num': [1], 'block_num': [1], 'par_num': [1],
+                                 'line_num': [1], 'word_num': [1], 'left': [300], 'top': [600],
+                                 'width': [150], 'height': [30], 'conf': [96.0], 'text': ['Invoice']})
+        timings = {}
+
+        # 2. Act
+        with mock.patch('pytesseract.image_to_data', return_value=ocr_data) as image_to_data:
+            page_text, positions, method = extract_pdf_page(self.scanned_pdf[0], mode='ocr', timings=timings)
+
+        # 3. Assert: The fixture is scanned at 150 dpi, so pixels are half points
+        self.assertEqual(method, 'ocr')
+        self.assertEqual(page_text, 'Invoice\n\f')
+        self.assertEqual(image_to_data.call_args[0][0].mode, 'L')
+        self.assertEqual(timings['dpi'], 150)
+        self.assertGreater(timings['ink_ratio'], 0.001)
+        self.assertGreaterEqual(timings['ocr_seconds'], 0)
+        self.assertEqual(positions.loc[0, ['left', 'top', 'width', 'height']].tolist(), [144, 288, 72, 14])
+
+    def test_edge_case_blank_page(self):
+        """
+        Tests that a blank page is detected from its pixels and not sent to OCR.
+        """
+        with fitz.open() as blank_pdf:
+            blank_pdf.new_page()
+            with mock.patch('pytesseract.image_to_data') as image_to_data:
+                page_text, positions, method = extract_pdf_page(blank_pdf[0], mode='auto',
+                                                                render_options={'dpi': 72})
+
+        self.assertEqual(method, 'blank')
+        self.assertEqual(page_text, '\f')
+        self.assertTrue(positions.empty)
+        image_to_data.assert_not_called()
+
+    def test_edge_case_garbled_text_layer(self):
+        """
+        Tests that a text layer made of unmapped glyphs is not used.
+        """
+        words = [(0, 0, 10, 10, '\ufffd' * 20, 0, 0, i) for i in range(5)]
+        self.assertFalse(text_layer_is_usable(words))
+
+    def test_edge_case_scanned_page_with_text_line(self):
+        """
+        Tests that a page covered by a scan with only a short typed line on top (e.g. a
+        Bates stamp) is sent to OCR, while the same line on a page without images is not.
+        """
+        from PIL import Image
+        import io
+
+        # 1. Arrange: A full-page image and one line of text of more than min_chars
+        buffer = io.BytesIO()
+        Image.new('L', (100, 130), 200).save(buffer, format='PNG')
+        stamp = 'CONFIDENTIAL - PRODUCED IN LITIGATION BY DEFENDANT - BATES ABC0001234'
+        with fitz.open() as pdf:
+            for with_scan in (True, False):
+                page = pdf.new_page()
+                if with_scan:
+                    page.insert_image(page.rect, stream=buffer.getvalue())
+                page.insert_text((72, 770), stamp, fontsize=8)
+            scanned_page, text_page = pdf[0], pdf[1]
+
+            # 2. Act
+            scanned_usable = text_layer_is_usable(scanned_page.get_text("words"), page=scanned_page)
+            text_usable = text_layer_is_usable(text_page.get_text("words"), page=text_page)
+            _, _, method = extract_pdf_page(text_page, mode='auto')
+
+        # 3. Assert
+        self.assertFalse(scanned_usable)
+        self.assertTrue(text_usable)
+        self.assertEqual(method, 'native')
+
+
+class RecordingBatchBackend(OcrBackend):
+    """
+    Batching OCR backend that finds one word per page and records the size of each batch.
+    """
+
+    supports_batches = True
+
+    def __init__(self):
+        self.batches = []
+
+    def images_to_data(self, images, dpis=None):
+        self.batches.append(len(images))
+        return [pd.DataFrame({'level': [5], 'page_num': [1], 'block_num': [1], 'par_num': [1], 'line_num': [1],
+                              'word_num': [1], 'left': [0], 'top': [0], 'width': [10], 'height': [10],
+                              'conf': [90.0], 'text': ['Scanned']}) for _ in images]
+
+
+class TestOcrBackends(unittest.TestCase):
+    """
+    Unit tests for the OCR backends and the batched OCR of pdf_to_text_with_ocr.
+    """
+
+    def setUp(self):
+        """
+        Creates an output folder and points at the scanned 5-page PDF in the 'docs' folder.
+        """
+        self.output_dir = 'test_ocr_backends_env'
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        self.scanned_pdf_path = os.path.join('tests/docs', '{3FE1EA5F-39D8-4F02-A3D2-D105E22CBB7B}.pdf')
+
+    def test_successful_execution(self):
+        """
+        Tests that the rendered pages of a PDF are OCRed in batches of ocr_batch_size,
+        and that every page gets its own text and a share of the batch's OCR time.
+        """
+        # 1. Arrange
+        backend = RecordingBatchBackend()
+
+        # 2. Act
+        page_report = pdf_to_text_with_ocr(self.scanned_pdf_path, self.output_dir, mode='ocr',
+                                           ocr_backend=backend, ocr_batch_size=2)
+
+        # 3. Assert
+        self.assertEqual(backend.batches, [2, 2, 1])
+        self.assertEqual(page_report['method'].tolist(), ['ocr'] * 5)
+        self.assertTrue(page_report['ocr_seconds'].notna().all())
+        with open(os.path.join(self.output_dir, os.path.basename(self.scanned_pdf_path) + '.txt'),
+                  encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'Scanned\n\f' * 5)
+
+    def test_batch_backend_splits_pages(self):
+        """
+        Tests that the batch backend runs tesseract once on a list of the images and
+        splits its TSV output into one DataFrame per page.
+        """
+        # 1. Arrange: A tesseract run that reads two words on page 1 and one on page 2
+        from PIL import Image
+
+        tsv = ('level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n'
+               '1\t1\t0\t0\t0\t0\t0\t0\t100\t100\t-1\t\n'
+               '5\t1\t1\t1\t1\t1\t10\t10\t20\t10\t95.5\tPayment\n'
+               '5\t1\t1\t1\t1\t2\t35\t10\t20\t10\t91.0\t"terms\n'
+               '1\t2\t0\t0\t0\t0\t0\t0\t100\t100\t-1\t\n'
+               '5\t2\t1\t1\t1\t1\t10\t10\t20\t10\t88.0\t0042\n')
+        commands = []
+
+        def run_tesseract(command, **kwargs):
+            commands.append(command)
+            with open(command[1], encoding='utf-8') as f:
+                self.assertEqual(len(f.read().split()), 2)
+            with open(command[2] + '.tsv', 'w', encoding='utf-8') as f:
+                f.write(tsv)
+            return subprocess.CompletedProcess(command, 0, b'', b'')
+
+        images = [Image.new('L', (100, 100), 255) for _ in range(2)]
+
+        # 2. Act
+        with mock.patch('ocr_backends.subprocess.run', side_effect=run_tesseract):
+            pages = TesseractBatchBackend().images_to_data(images, [300, 150])
+
+        # 3. Assert
+        self.assertEqual(len(commands), 1)
+        self.assertEqual(commands[0][-1], 'tsv')
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(pages[0]['text'].dropna().tolist(), ['Payment', '"terms'])
+        self.assertEqual(pages[1]['text'].dropna().tolist(), ['0042'])
+        self.assertEqual(pages[1]['page_num'].tolist(), [1, 1])
+
+    def test_error_handling_tesseract_failure(self):
+        """
+        Tests that a failed tesseract run raises with its error output, and that unknown
+        backend names are rejected.
+        """
+        from PIL import Image
+
+        failure = subprocess.CompletedProcess([], 1, b'', b'Error opening data file eng.traineddata')
+        with mock.patch('ocr_backends.subprocess.run', return_value=failure):
+            with self.assertRaisesRegex(RuntimeError, 'eng.traineddata'):
+                TesseractBatchBackend().images_to_data([Image.new('L', (10, 10), 255)])
+        with self.assertRaises(ValueError):
+            get_ocr_backend('nonexistent')
+        self.assertIs(get_ocr_backend('tesseract_batch'), get_ocr_backend('tesseract_batch'))
+
+
+class TestOcrPdfsParallel(unittest.TestCase):
+    """
+    Unit tests for the ocr_pdfs_parallel function.
+    """
+
+    def setUp(self):
+        """
+        Creates an output folder and points at the PDF with a text layer in the 'docs' folder.
+        """
+        self.input_dir = 'tests/docs'
+        self.output_dir = 'test_parallel_ocr_env'
+        self.serial_dir = os.path.join(self.output_dir, 'serial')
+        os.makedirs(self.serial_dir, exist_ok=True)
+        self.test_pdf_path = os.path.join(self.input_dir, '{0A9CB96C-5A24-4881-97F4-4D0BCFB29CC5}.pdf')
+        self.txt_name = os.path.basename(self.test_pdf_path) + '.txt'
+
+    def tearDown(self):
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+
+    def test_successful_execution(self):
+        """
+        Tests that pages spread over worker processes are put back in order, giving the
+        same text file as the serial function.
+        """
+        # 1. Arrange: Extract the PDF serially
+        pdf_to_text_with_ocr(self.test_pdf_path, self.serial_dir, mode='native')
+
+        # 2. Act: Extract the same PDF over a small pool with few pages in flight
+        page_reports = ocr_pdfs_parallel([self.test_pdf_path], self.output_dir, mode='native',
+                                         max_workers=2, max_pending_pages=3)
+
+        # 3. Assert
+        with open(os.path.join(self.serial_dir, self.txt_name), encoding='utf-8') as f:
+            expected_text = f.read()
+        with open(os.path.join(self.output_dir, self.txt_name), encoding='utf-8') as f:
+            self.assertEqual(f.read(), expected_text)
+        self.assertEqual(page_reports[self.test_pdf_path]['page_num'].tolist(), list(range(1, 18)))
+
+    def test_error_handling_failing_page(self):
+        """
+        Tests that a failing page is reported while the rest of its document is saved,
+        and that unreadable files are skipped.
+        """
+        original_extract = helper_functions.extract_pdf_page
+
+        def extract_failing_second_page(page, mode='auto', **kwargs):
+            if page.number == 1:
+                raise RuntimeError('corrupt page')
+            return original_extract(page, mode=mode, **kwargs)
+
+        with mock.patch('helper_functions.extract_pdf_page', extract_failing_second_page):
+            page_reports = ocr_pdfs_parallel([self.test_pdf_path, 'nonexistent.pdf'], self.output_dir,
+                                             mode='native', max_workers=2)
+
+        report = page_reports[self.test_pdf_path]
+        self.assertNotIn('nonexistent.pdf', page_reports)
+        self.assertEqual(report.loc[1, 'method'], 'failed')
+        self.assertIn('corrupt page', report.loc[1, 'error'])
+        self.assertTrue((report.drop(index=1)['method'] == 'native').all())
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, self.txt_name)))
+
+
+class TestOcrDataToText(unittest.TestCase):
+    """
+    Unit tests for the ocr_data_to_text function.
+    """
+
+    def make_positions(self, words):
+        """
+        Builds a Tesseract-style positions DataFrame from (block, par, line, text) tuples,
+        including the structural (non-word) rows that image_to_data returns.
+        """
+        rows = [{'level': 1, 'block_num': 0, 'par_num': 0, 'line_num': 0, 'word_num': 0,
+                 'conf': -1, 'text': np.nan}]
+        for word_num, (block, par, line, text) in enumerate(words, start=1):
+            rows.append({'level': 4, 'block_num': block, 'par_num': par, 'line_num': line,
+                         'word_num': 0, 'conf': -1, 'text': np.nan})
+            rows.append({'level': 5, 'block_num': block, 'par_num': par, 'line_num': line,
+                         'word_num': word_num, 'conf': 95, 'text': text})
+        return pd.DataFrame(rows)
+
+    def test_successful_execution(self):
+        """
+        Tests that lines, paragraphs and blocks are laid out like image_to_string output.
+        """
+        # 1. Arrange: Two lines in one paragraph, then a second block
+        positions = self.make_positions([(1, 1, 1, 'Payment'), (1, 1, 1, 'terms'),
+                                         (1, 1, 2, 'net'), (1, 1, 2, '30'),
+                                         (2, 1, 1, 'Signature'), (2, 1, 1, ' ')])
+
+        # 2. Act
+        page_text = ocr_data_to_text(positions)
+
+        # 3. Assert
+        self.assertEqual(page_text, 'Payment terms\nnet 30\n\nSignature\n\f')
+
+    def test_edge_case_blank_page(self):
+        """
+        Tests that a page without any recognized words returns only the page separator.
+        """
+        self.assertEqual(ocr_data_to_text(self.make_positions([])), '\f')
+
+
+class TestOcrQualityMetrics(unittest.TestCase):
+    """
+    Unit tests for the ocr_quality_metrics and read_ocr_quality functions.
+    """
+
+    def make_positions(self, words):
+        """
+        Builds a Tesseract-style positions DataFrame from (text, conf) tuples.
+        """
+        rows = [{'level': 1, 'conf': -1, 'text': np.nan}]
+        rows += [{'level': 5, 'conf': conf, 'text': text} for text, conf in words]
+        return pd.DataFrame(rows)
+
+    def test_successful_execution(self):
+        """
+        Tests the confidence statistics and the share of dictionary words.
+        """
+        # 1. Arrange: Punctuation around a word does not stop it from matching
+        positions = self.make_positions([('Payment', 90), ('terms,', 80), ('xqzt', 20), ('30', 70)])
+        lexicon = {'payment', 'terms'}
+
+        # 2. Act
+        metrics = ocr_quality_metrics(positions, lexicon)
+
+        # 3. Assert
+        self.assertEqual(metrics['word_count'], 4)
+        self.assertAlmostEqual(metrics['mean_conf'], 65.0)
+        self.assertAlmostEqual(metrics['p50_conf'], 75.0)
+        self.assertAlmostEqual(metrics['p10_conf'], 35.0)
+        self.assertAlmostEqual(metrics['dictionary_ratio'], 0.5)
+
+    def test_edge_case_native_and_blank_pages(self):
+        """
+        Tests that native words have no confidence and that blank pages have no scores.
+        """
+        native = ocr_quality_metrics(self.make_positions([('Payment', np.nan)]), {'payment'})
+        blank = ocr_quality_metrics(pd.DataFrame({'level': []}), {'payment'})
+
+        self.assertIsNone(native['mean_conf'])
+        self.assertEqual(native['dictionary_ratio'], 1.0)
+        self.assertEqual(blank['word_count'], 0)
+        self.assertIsNone(blank['dictionary_ratio'])
+
+    def test_read_ocr_quality(self):
+        """
+        Tests that saved document scores are read back and missing ones are None.
+        """
+        # 1. Arrange: One PDF text with a quality file next to it, one HTML text without
+        output_dir = 'test_quality_output'
+        os.makedirs(output_dir, exist_ok=True)
+        self.addCleanup(shutil.rmtree, output_dir)
+        pages = [{'page_num': 0, 'text': 'Payment terms\n\f', 'method': 'ocr', 'error': None,
+                  'positions': self.make_positions([('Payment', 90), ('terms', 80)])}]
+        with mock.patch('helper_functions._load_lexicon_or_none', return_value={'payment'}):
+            page_report = save_pdf_outputs('contract.pdf', output_dir, pages)
+
+        # 2. Act
+        scores = read_ocr_quality(output_dir, ['contract.pdf.txt', 'contract.txt'])
+
+        # 3. Assert
+        self.assertEqual(scores, [0.5, None])
+        self.assertAlmostEqual(page_report.loc[0, 'mean_conf'], 85.0)
+        self.assertTrue(os.path.exists(os.path.join(output_dir, 'contract.pdf.quality.json')))
+
+    def test_pdf_and_html_scores_match(self):
+        """
+        Tests that a PDF scored from its word boxes and an HTML text scored by
+        calculate_ocr_quality get the same score for the same text.
+        """
+        # 1. Arrange: A text with punctuation, numbers and a non-word, as a native PDF page
+        text = 'Payment terms: net 30 days, (see Schedule B). Xqzt fees apply!'
+        output_dir = 'test_quality_match_output'
+        os.makedirs(output_dir, exist_ok=True)
+        self.addCleanup(shutil.rmtree, output_dir)
+        pdf_path = os.path.join(output_dir, 'contract.pdf')
+        with fitz.open() as pdf:
+            pdf.new_page().insert_text((72, 72), text, fontsize=10)
+            pdf.save(pdf_path)
+        lexicon = frozenset({'payment', 'terms', 'net', 'days', 'see', 'schedule', 'b', 'fees', 'apply'})
+
+        # 2. Act
+        with mock.patch('helper_functions.get_english_lexicon', return_value=lexicon):
+            pdf_to_text_with_ocr(pdf_path, output_dir, mode='native')
+            pdf_score = read_ocr_quality(output_dir, ['contract.pdf.txt'])[0]
+            html_score = calculate_ocr_quality([text])[0]
+
+        # 3. Assert: 9 of the 11 words are dictionary words
+        self.assertAlmostEqual(pdf_score, 9 / 11)
+        self.assertAlmostEqual(html_score, pdf_score)
+
+
+class TestPagePositions(unittest.TestCase):
+    """
+    Unit tests for the save_page_positions and load_page_positions functions.
+    """
+
+    def test_successful_execution(self):
+        """
+        Tests that positions are saved with their page numbers and types, and that one
+        page can be loaded on its own.
+        """
+        # 1. Arrange: A native page, a failed page without positions and an OCR page
+        output_dir = 'test_positions_output'
+        os.makedirs(output_dir, exist_ok=True)
+        self.addCleanup(shutil.rmtree, output_dir)
+        positions_path = os.path.join(output_dir, 'contract.pdf.positions.parquet')
+        word = {'level': 5, 'page_num': 1, 'block_num': 1, 'par_num': 1, 'line_num': 1,
+                'word_num': 1, 'left': 10, 'top': 20, 'width': 30, 'height': 10}
+        pages = [{'page_num': 1, 'method': 'native',
+                  'positions': pd.DataFrame([{**word, 'conf': np.nan, 'text': 'Payment', 'method': 'native'}])},
+                 {'page_num': 2, 'method': 'failed', 'positions': pd.DataFrame({'level': []})},
+                 {'page_num': 3, 'method': 'ocr',
+                  'positions': pd.DataFrame([{**word, 'conf': 91.5, 'text': 'terms', 'method': 'ocr'}])}]
+
+        # 2. Act
+        save_page_positions(positions_path, pages)
+        all_positions = load_page_positions(positions_path)
+        page_3 = load_page_positions(positions_path, page_num=3)
+
+        # 3. Assert
+        self.assertEqual(all_positions['page_num'].tolist(), [1, 3])
+        self.assertEqual(page_3['text'].tolist(), ['terms'])
+        self.assertEqual(page_3['method'].tolist(), ['ocr'])
+        self.assertEqual(page_3['left'].dtype, np.int32)
+
+
 class TestPullTextFromHtml(unittest.TestCase):
     """
     Unit tests for the pull_text_from_html function.
@@ -232,6 +715,47 @@ class TestPullTextFromHtml(unittest.TestCase):
         self.assertEqual(extracted_texts[1], None)  # Empty file should return an empty string
         self.assertEqual(extracted_texts[2], None)
 
+    def test_encoding_detection(self):
+        """
+        Tests that the encoding is detected from the bytes: BOM, meta charset, UTF-8, windows-1252.
+        """
+        # 1. Arrange
+        body = '<html><body><p>Fee of 100 € – net 30.</p></body></html>'
+        documents = {
+            'utf8.html': body.encode('utf-8'),
+            'bom.html': b'\xef\xbb\xbf' + body.encode('utf-8'),
+            'cp1252.html': body.encode('cp1252'),
+            'utf16.html': body.encode('utf-16'),
+            'meta.html': ('<html><head><meta charset="windows-1252"></head>' + body[6:]).encode('cp1252'),
+        }
+
+        # 2. Act
+        texts = {}
+        for name, data in documents.items():
+            with open(os.path.join(self.test_dir, name), 'wb') as f:
+                f.write(data)
+            texts[name] = decode_html_bytes(data)
+
+        # 3. Assert: Every variant decodes to the same text
+        for name, text in texts.items():
+            self.assertIn('Fee of 100 € – net 30.', text, name)
+        self.assertEqual(html_to_text(os.path.join(self.test_dir, 'cp1252.html')), 'Fee of 100 € – net 30.')
+
+    def test_parallel_stream_keeps_order(self):
+        """
+        Tests that the worker pool yields the texts in the order of the file list.
+        """
+        # 1. Arrange
+        file_list = [self.test_html_path_1, self.test_empty_html_path, self.test_html_path_2,
+                     self.nonexistent_html_path]
+
+        # 2. Act
+        streamed = list(iter_text_from_html(file_list, num_workers=2, max_pending=1))
+
+        # 3. Assert
+        self.assertEqual([file_path for file_path, _ in streamed], file_list)
+        self.assertEqual([text for _, text in streamed], pull_text_from_html(file_list))
+
 
 class TestReadTextFiles(unittest.TestCase):
     """
@@ -331,5 +855,1196 @@ class TestReadTextFiles(unittest.TestCase):
         self.assertIn('And this is the content of file two.', file_list)
 
 
+class FakeEmbeddingModel:
+    """
+    Deterministic stand-in for a SentenceTransformer: each sentence is embedded
+    from its own characters only, so results do not depend on batching.
+    """
+
+    def get_sentence_embedding_dimension(self):
+        return 3
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, show_progress_bar=False):
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else sentences
+        embeddings = np.array([[len(s), sum(map(ord, s)) % 97, s.count(' ')] for s in sentences],
+                              dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+
+class FakeEmbeddingModel384(FakeEmbeddingModel):
+    """
+    FakeEmbeddingModel with the 384 dimensions the test classifier expects.
+    """
+
+    def get_sentence_embedding_dimension(self):
+        return 384
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, show_progress_bar=False):
+        features = super().encode(sentences, batch_size, convert_to_numpy, show_progress_bar)
+        return np.tile(features, 128)
+
+
+class TestEmbedSentences(unittest.TestCase):
+    """
+    Unit tests for the embed_sentences function.
+    """
+
+    def setUp(self):
+        """
+        Sets up a list of sentences of varying length and a fake embedding model.
+        """
+        self.model = FakeEmbeddingModel()
+        self.sentences = ['Short.', 'A somewhat longer sentence here.', 'Mid length one.',
+                          'The payment is due within thirty days of the invoice date.', 'x']
+
+    def test_successful_execution(self):
+        """
+        Tests that the batched embeddings are one contiguous float32 matrix whose rows
+        match the per-sentence encodings, in the original sentence order.
+        """
+        # 1. Arrange: Encode each sentence on its own, as the pipeline used to do
+        expected = np.vstack([self.model.encode(s) for s in self.sentences])
+
+        # 2. Act: Encode the sentences in small, length-sorted batches
+        embeddings = embed_sentences(self.sentences, self.model, batch_size=2)
+
+        # 3. Assert: Verify shape, type, layout and row alignment
+        self.assertEqual(embeddings.shape, (5, 3))
+        self.assertEqual(embeddings.dtype, np.float32)
+        self.assertTrue(embeddings.flags['C_CONTIGUOUS'])
+        np.testing.assert_array_equal(embeddings, expected)
+
+    def test_worker_pool(self):
+        """
+        Tests that spreading the batches over worker processes gives the same result.
+        """
+        expected = embed_sentences(self.sentences, self.model, batch_size=2)
+        embeddings = embed_sentences(self.sentences, self.model, batch_size=2, num_workers=2)
+        np.testing.assert_array_equal(embeddings, expected)
+
+    def test_edge_case_empty_input(self):
+        """
+        Tests that an empty list of sentences returns an empty matrix.
+        """
+        embeddings = embed_sentences([], self.model)
+        self.assertEqual(embeddings.shape, (0, 3))
+
+    def test_sentence_cache(self):
+        """
+        Tests that repeated sentences are encoded once per run and reused across runs
+        through the persistent sentence embedding cache.
+        """
+        # 1. Arrange: A boilerplate sentence repeated with different whitespace
+        db_path = 'test_embedding_cache.sqlite'
+        self.addCleanup(lambda: os.path.exists(db_path) and os.remove(db_path))
+        sentences = self.sentences + ['Short.', '  Short.\n', 'Mid  length one.']
+        expected = embed_sentences(sentences, self.model)
+        cache = SentenceEmbeddingCache(db_path, model_id='fake')
+        self.addCleanup(cache.close)
+
+        with mock.patch.object(self.model, 'encode', wraps=self.model.encode) as encode:
+            # 2. Act: First run fills the cache, the second one only reads it
+            first = embed_sentences(sentences, self.model, cache=cache)
+            encoded_first = sum(len(call.args[0]) for call in encode.call_args_list)
+            second = embed_sentences(sentences, self.model, cache=cache)
+
+        # 3. Assert
+        np.testing.assert_array_equal(first, expected)
+        np.testing.assert_array_equal(second, expected)
+        self.assertEqual(encoded_first, 5)
+        self.assertEqual(encode.call_count, 1)  # the second run needs no forward pass
+        self.assertEqual(cache.stats, {'sentences': 16, 'unique': 10, 'hits': 5, 'misses': 5})
+        self.assertAlmostEqual(cache.hit_rate(), 11 / 16)
+
+    def test_sentence_cache_eviction(self):
+        """
+        Tests that the sentence embedding cache keeps at most max_entries entries.
+        """
+        db_path = 'test_embedding_cache_lru.sqlite'
+        self.addCleanup(lambda: os.path.exists(db_path) and os.remove(db_path))
+        cache = SentenceEmbeddingCache(db_path, model_id='fake', max_entries=3)
+        self.addCleanup(cache.close)
+
+        embed_sentences(self.sentences, self.model, cache=cache)
+        (count,) = cache.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        self.assertEqual(count, 3)
+
+
+class TestDocumentCache(unittest.TestCase):
+    """
+    Unit tests for the DocumentCache class.
+    """
+
+    def setUp(self):
+        """
+        Creates a cache folder and two input files with identical content.
+        """
+        self.test_dir = 'test_cache_env'
+        os.makedirs(self.test_dir, exist_ok=True)
+        self.cache = DocumentCache(os.path.join(self.test_dir, 'cache'))
+        self.file_1 = os.path.join(self.test_dir, 'contract.html')
+        self.file_2 = os.path.join(self.test_dir, 'contract_copy.html')
+        for path in (self.file_1, self.file_2):
+            with open(path, 'w') as f:
+                f.write("<p>Payment is due within 30 days.</p>")
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def test_successful_execution(self):
+        """
+        Tests that text, sentences and embeddings are returned as stored.
+        """
+        # 1. Arrange
+        text_key = self.cache.text_key(self.file_1, version='1')
+        sentences = ['Payment is due within 30 days.']
+        embeddings = np.arange(6, dtype=np.float32).reshape(1, 6)
+
+        # 2. Act: Store the three stages and read them back
+        self.cache.put_text(text_key, 'Payment is due within 30 days.')
+        sentences_key = self.cache.sentences_key(self.cache.get_text(text_key), version='1')
+        self.cache.put_sentences(sentences_key, sentences)
+        embeddings_key = self.cache.embeddings_key(sentences, version='1', model_id='model')
+        self.cache.put_embeddings(embeddings_key, embeddings)
+
+        # 3. Assert
+        self.assertEqual(self.cache.get_sentences(sentences_key), sentences)
+        np.testing.assert_array_equal(self.cache.get_embeddings(embeddings_key), embeddings)
+        self.assertEqual(self.cache.stats['text']['hits'], 1)
+
+    def test_keys_follow_content_and_versions(self):
+        """
+        Tests that keys depend on the file content and the stage versions, not on the file name.
+        """
+        self.assertEqual(self.cache.text_key(self.file_1, '1'), self.cache.text_key(self.file_2, '1'))
+        self.assertNotEqual(self.cache.text_key(self.file_1, '1'), self.cache.text_key(self.file_1, '2'))
+        self.assertNotEqual(self.cache.embeddings_key(['a'], '1', 'model-a'),
+                            self.cache.embeddings_key(['a'], '1', 'model-b'))
+
+        # A miss returns None and is counted
+        self.assertIsNone(self.cache.get_text(self.cache.text_key(self.file_1, '3')))
+        self.assertEqual(self.cache.stats['text']['misses'], 1)
+
+    def test_edge_case_eviction(self):
+        """
+        Tests that pruning removes the least recently used entries first.
+        """
+        # 1. Arrange: Store two entries, then use the first one again
+        self.cache.put_text('a' * 64, 'x' * 100)
+        os.utime(self.cache._path('text', 'a' * 64, '.txt'), (1, 1))
+        self.cache.put_text('b' * 64, 'y' * 100)
+        os.utime(self.cache._path('text', 'b' * 64, '.txt'), (2, 2))
+        self.cache.get_text('a' * 64)
+
+        # 2. Act: Shrink the cache to fit one entry
+        self.cache.max_bytes = 150
+        removed = self.cache.prune()
+
+        # 3. Assert
+        self.assertEqual(removed, 1)
+        self.assertIsNotNone(self.cache.get_text('a' * 64))
+        self.assertIsNone(self.cache.get_text('b' * 64))
+
+
+class TestSentenceStore(unittest.TestCase):
+    """
+    Unit tests for the SentenceStore class.
+    """
+
+    def setUp(self):
+        self.test_dir = 'test_store_env'
+        self.addCleanup(shutil.rmtree, self.test_dir, ignore_errors=True)
+
+    def make_documents(self, filename, n_sentences, dim=4):
+        df = pd.DataFrame({'filename': filename, 'sentence_index': range(n_sentences),
+                           'sentence_text': [f'Sentence {i}.' for i in range(n_sentences)]})
+        embeddings = np.random.default_rng(n_sentences).normal(size=(n_sentences, dim)).astype(np.float32)
+        return df, embeddings
+
+    def test_successful_execution(self):
+        """
+        Tests that appended documents are reloaded in order, with memory-mapped embeddings.
+        """
+        # 1. Arrange
+        df_1, embeddings_1 = self.make_documents('a.pdf.txt', 3)
+        df_2, embeddings_2 = self.make_documents('b.pdf.txt', 2)
+
+        # 2. Act: Append in two runs, then reopen the store
+        SentenceStore(self.test_dir).append(df_1, embeddings_1)
+        SentenceStore(self.test_dir).append(df_2, embeddings_2)
+        df, embeddings = load_sentence_store(self.test_dir)
+
+        # 3. Assert
+        self.assertEqual(df['filename'].tolist(), ['a.pdf.txt'] * 3 + ['b.pdf.txt'] * 2)
+        self.assertIsInstance(embeddings, np.memmap)
+        self.assertFalse(embeddings.flags.writeable)
+        np.testing.assert_array_equal(embeddings, np.vstack([embeddings_1, embeddings_2]))
+
+    def test_float16_and_clear(self):
+        """
+        Tests float16 storage and that clearing empties the store.
+        """
+        store = SentenceStore(self.test_dir, dtype='float16')
+        df, embeddings = self.make_documents('a.pdf.txt', 3)
+        store.append(df, embeddings)
+
+        self.assertEqual(store.load_embeddings().dtype, np.float16)
+        np.testing.assert_allclose(store.load_embeddings(), embeddings, atol=1e-2)
+
+        store.clear()
+        self.assertEqual(len(SentenceStore(self.test_dir)), 0)
+        self.assertEqual(store.load_embeddings().shape, (0, 0))
+
+    def test_edge_case_mismatched_rows(self):
+        """
+        Tests that an append with one embedding per sentence missing is refused.
+        """
+        store = SentenceStore(self.test_dir)
+        df, embeddings = self.make_documents('a.pdf.txt', 3)
+        with self.assertRaises(ValueError):
+            store.append(df, embeddings[:2])
+        self.assertEqual(len(store), 0)
+
+
+class TestSentenceAnnIndex(unittest.TestCase):
+    """
+    Unit tests for the SentenceAnnIndex class.
+    """
+
+    def setUp(self):
+        """
+        Creates an empty index folder and a helper making documents of random embeddings.
+        """
+        self.index_dir = 'test_ann_index_env'
+        self.addCleanup(shutil.rmtree, self.index_dir, ignore_errors=True)
+        self.rng = np.random.default_rng(0)
+
+    def documents(self, filenames, sentences=20, version=0):
+        df = pd.DataFrame([(filename, i, f"{filename} sentence {i} v{version}")
+                           for filename in filenames for i in range(sentences)],
+                          columns=['filename', 'sentence_index', 'sentence_text'])
+        return df, self.rng.normal(size=(len(df), 16)).astype(np.float32)
+
+    def test_successful_execution(self):
+        """
+        Tests that a query finds the indexed sentence of an embedding first, also after
+        the index is reopened from disk.
+        """
+        # 1. Arrange
+        df, embeddings = self.documents(['a.txt', 'b.txt'])
+        SentenceAnnIndex(self.index_dir, n_trees=10).add(df, embeddings)
+
+        # 2. Act
+        results = SentenceAnnIndex(self.index_dir).query(embeddings[25], k=3)
+
+        # 3. Assert
+        self.assertEqual(list(results.columns), ['rank', 'filename', 'sentence_index', 'sentence_text',
+                                                 'distance', 'similarity'])
+        self.assertEqual(results['rank'].tolist(), [1, 2, 3])
+        self.assertEqual(results.loc[0, ['filename', 'sentence_index']].tolist(), ['b.txt', 5])
+        self.assertAlmostEqual(results.loc[0, 'similarity'], 1.0, places=5)
+        self.assertTrue(results['distance'].is_monotonic_increasing)
+
+    def test_incremental_updates(self):
+        """
+        Tests that unchanged documents are skipped, that changed documents replace their
+        old sentences, and that shards are merged beyond max_shards.
+        """
+        # 1. Arrange
+        index = SentenceAnnIndex(self.index_dir, n_trees=10, max_shards=2)
+        df, embeddings = self.documents(['a.txt', 'b.txt'])
+        index.add(df, embeddings)
+
+        # 2. Act: Add the same documents, then a changed b.txt and a new c.txt
+        unchanged = index.add(df, embeddings)
+        changed_df, changed_embeddings = self.documents(['b.txt', 'c.txt'], sentences=10, version=1)
+        changed = index.add(changed_df, changed_embeddings)
+
+        # 3. Assert: The old sentences of b.txt are no longer found
+        self.assertEqual((unchanged, changed), (0, 2))
+        self.assertEqual(len(index), 40)
+        results = index.query(embeddings[25], k=40)
+        self.assertEqual(len(results), 40)
+        self.assertTrue(results.loc[results['filename'] == 'b.txt', 'sentence_text'].str.endswith('v1').all())
+        self.assertEqual(sorted(results['filename'].unique()), ['a.txt', 'b.txt', 'c.txt'])
+
+        # A third shard goes past max_shards, which merges the live sentences into one shard
+        index.add(*self.documents(['d.txt'], version=2))
+        self.assertEqual(len(index.meta['shards']), 1)
+        self.assertEqual(index.meta['shards'][0]['rows'], 60)
+        self.assertEqual(len(os.listdir(self.index_dir)), 3)
+        merged = index.query(embeddings[5], k=60)
+        self.assertEqual(merged.loc[0, ['filename', 'sentence_index']].tolist(), ['a.txt', 5])
+        self.assertEqual(merged.groupby('filename').size().to_dict(), {'a.txt': 20, 'b.txt': 10, 'c.txt': 10,
+                                                                       'd.txt': 20})
+
+    def test_error_handling_model_mismatch(self):
+        """
+        Tests that an index built with one embedding model refuses another model, and
+        embeddings of another dimension.
+        """
+        df, embeddings = self.documents(['a.txt'])
+        SentenceAnnIndex(self.index_dir, model_id='model-a').add(df, embeddings)
+
+        with self.assertRaises(ValueError):
+            SentenceAnnIndex(self.index_dir, model_id='model-b')
+        with self.assertRaises(ValueError):
+            SentenceAnnIndex(self.index_dir)  # The default model
+        with self.assertRaises(ValueError):
+            SentenceAnnIndex(self.index_dir, model_id=None)
+        with self.assertRaises(ValueError):
+            SentenceAnnIndex(self.index_dir, model_id='model-a').add(df, embeddings[:, :8])
+
+
+class TestStreamingPipeline(unittest.TestCase):
+    """
+    Unit tests for stream_process_and_classify_files and its threaded stages (run_stage_in_thread).
+    """
+
+    def setUp(self):
+        """
+        Creates an input folder of three HTML contracts and an output folder.
+        """
+        self.test_dir = 'test_streaming_env'
+        self.input_dir = os.path.join(self.test_dir, 'input')
+        self.output_dir = os.path.join(self.test_dir, 'output')
+        os.makedirs(self.input_dir, exist_ok=True)
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        for i in range(3):
+            with open(os.path.join(self.input_dir, f'contract_{i}.html'), 'w', encoding='utf-8') as f:
+                f.write(f"<html><body><p>Contract {i}. Payment is due within {30 + i} days of invoice.</p>"
+                        f"<p>Either party may terminate this agreement.</p></body></html>")
+
+    def wait_for(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_successful_execution(self):
+        """
+        Tests that every document yields one result, in the order its row is appended
+        to the CSV output.
+        """
+        # 1. Act
+        results = list(stream_process_and_classify_files(self.input_dir, self.output_dir,
+                                                          os.path.join('tests', 'model'),
+                                                          sent_emb_model=FakeEmbeddingModel384(),
+                                                          threshold=0.0, max_queue_size=1))
+
+        # 2. Assert
+        filenames = [result['filename'].iloc[0] for result in results]
+        self.assertEqual(sorted(filenames), [f'contract_{i}.txt' for i in range(3)])
+        csv_results = pd.read_csv(os.path.join(self.output_dir, 'model_results.csv'))
+        self.assertEqual(csv_results['filename'].tolist(), filenames)
+
+    def test_stage_order_and_bounded_queue(self):
+        """
+        Tests that a threaded stage keeps the order of its items and works ahead of its
+        consumer by at most max_queue_size items (plus the one it is putting).
+        """
+        produced = []
+
+        def stage():
+            for i in range(20):
+                produced.append(i)
+                yield i
+
+        items = run_stage_in_thread(stage(), max_queue_size=2)
+        first = next(items)
+        self.wait_for(lambda: len(produced) >= 4, timeout=0.5)
+
+        self.assertEqual(first, 0)
+        self.assertLessEqual(len(produced), 4)
+        self.assertEqual([first] + list(items), list(range(20)))
+
+    def test_error_handling_stage_error(self):
+        """
+        Tests that an exception raised in a stage reaches the consumer after the items
+        yielded before it.
+        """
+        def failing_stage():
+            yield 1
+            yield 2
+            raise RuntimeError('corrupt document')
+
+        received = []
+        with self.assertRaisesRegex(RuntimeError, 'corrupt document'):
+            for item in run_stage_in_thread(failing_stage(), max_queue_size=1):
+                received.append(item)
+        self.assertEqual(received, [1, 2])
+
+    def test_edge_case_consumer_stops_early(self):
+        """
+        Tests that closing the last stage stops the threads of every stage of a chain,
+        instead of leaving them blocked on a full queue.
+        """
+        # 1. Arrange: An endless source behind two threaded stages
+        closed = threading.Event()
+
+        def endless_source():
+            try:
+                i = 0
+                while True:
+                    yield i
+                    i += 1
+            finally:
+                closed.set()
+
+        def passthrough(items):
+            yield from items
+
+        items = run_stage_in_thread(passthrough(run_stage_in_thread(endless_source(), 1)), 1)
+
+        # 2. Act
+        self.assertEqual(next(items), 0)
+        items.close()
+
+        # 3. Assert
+        self.assertTrue(self.wait_for(closed.is_set))
+        self.assertTrue(self.wait_for(lambda: not any(thread.name.startswith('stage-')
+                                                      for thread in threading.enumerate())))
+
+
+class TestProcessTextsToDataframe(unittest.TestCase):
+    """
+    Unit tests for the process_texts_to_dataframe function.
+    """
+
+    def test_successful_execution(self):
+        """
+        Tests that texts are split on sentence punctuation and blank lines, with one
+        sentence index sequence per file.
+        """
+        # 1. Arrange
+        texts = ["Payment is due in 30 days. Late fees apply!\n\nSignature page",
+                 "Liability is limited? Yes."]
+        filenames = ['a.txt', 'b.txt']
+
+        # 2. Act
+        df = process_texts_to_dataframe(texts, filenames, batch_size=1)
+
+        # 3. Assert
+        self.assertEqual(list(df.columns), ['filename', 'sentence_index', 'sentence_text'])
+        self.assertEqual(df['filename'].tolist(), ['a.txt'] * 3 + ['b.txt'] * 2)
+        self.assertEqual(df['sentence_index'].tolist(), [0, 1, 2, 0, 1])
+        self.assertEqual(df['sentence_text'].str.strip().tolist(),
+                         ['Payment is due in 30 days.', 'Late fees apply!', 'Signature page',
+                          'Liability is limited?', 'Yes.'])
+
+    def test_multiple_processes(self):
+        """
+        Tests that splitting the texts over two spaCy processes gives the same result.
+        """
+        texts = ["First sentence. Second one.", "Third? Fourth!", "Fifth."]
+        filenames = ['a.txt', 'b.txt', 'c.txt']
+        expected = process_texts_to_dataframe(texts, filenames)
+        df = process_texts_to_dataframe(texts, filenames, batch_size=1, n_process=2)
+        pd.testing.assert_frame_equal(df, expected)
+
+    def test_edge_case_empty_input(self):
+        """
+        Tests that no texts give an empty DataFrame with the expected columns.
+        """
+        df = process_texts_to_dataframe([], [])
+        self.assertTrue(df.empty)
+        self.assertEqual(list(df.columns), ['filename', 'sentence_index', 'sentence_text'])
+
+    def test_chunked_long_text(self):
+        """
+        Tests that a text longer than max_chars is segmented in chunks into the same
+        sentences, with one continuous sentence index sequence, as in a single pass.
+        """
+        # 1. Arrange: Pages of sentences that run over line breaks, around a short text
+        page = "\n".join(f"Clause {i} of the agreement applies to the\nparties named above. See section {i}."
+                         for i in range(20))
+        texts = ["Short text. Two sentences.", "\f".join([page] * 10), "Last text."]
+        filenames = ['a.txt', 'b.txt', 'c.txt']
+        expected = process_texts_to_dataframe(texts, filenames)
+
+        # 2. Act: Chunks of less than a page, cut on line breaks inside sentences
+        df = process_texts_to_dataframe(texts, filenames, max_chars=1000)
+
+        # 3. Assert
+        pd.testing.assert_frame_equal(df, expected)
+        self.assertEqual(df['sentence_index'].dtype, np.int32)
+        self.assertEqual(df.loc[df['filename'] == 'b.txt', 'sentence_index'].tolist(), list(range(400)))
+
+
+class TestRunClassificationModel(unittest.TestCase):
+    """
+    Unit tests for run_classification_model and the classifier cache of models.get_classifier.
+    """
+
+    def setUp(self):
+        """
+        Copies the test classifier to a temporary model folder.
+        """
+        self.model_dir = 'test_model_env'
+        os.makedirs(self.model_dir, exist_ok=True)
+        self.addCleanup(shutil.rmtree, self.model_dir)
+        shutil.copy(os.path.join('tests', 'model', 'ml_classifier_gbc.pkl'), self.model_dir)
+        self.model_path = os.path.join(self.model_dir, 'ml_classifier_gbc.pkl')
+
+        self.embeddings = np.random.default_rng(0).normal(size=(5, 384)).astype(np.float32)
+        self.df = pd.DataFrame({'filename': ['a.txt'] * 3 + ['b.txt'] * 2,
+                                'sentence_index': [0, 1, 2, 0, 1],
+                                'sentence_text': [f'Sentence {i}.' for i in range(5)]})
+
+    def test_successful_execution(self):
+        """
+        Tests that scoring the embedding matrix matches scoring the 'Embedding' column.
+        """
+        # 1. Arrange
+        df_column = self.df.copy()
+        df_column['Embedding'] = list(self.embeddings)
+
+        # 2. Act
+        from_column = run_classification_model(df_column, self.model_dir, threshold=0.0)
+        from_matrix = run_classification_model(self.df.copy(), self.model_dir, threshold=0.0,
+                                               embeddings=self.embeddings)
+
+        # 3. Assert: One row per document, with the same probabilities
+        self.assertEqual(from_matrix['filename'].tolist(), ['a.txt', 'b.txt'])
+        np.testing.assert_allclose(from_matrix['Probability'].astype(float),
+                                   from_column['Probability'].astype(float))
+
+    def test_multiple_clauses(self):
+        """
+        Tests that every clause gets one top sentence per document, from one scoring pass.
+        """
+        # 1. Arrange: A second clause with its own model file and threshold
+        shutil.copy(self.model_path, os.path.join(self.model_dir, 'other_clause.pkl'))
+        clause_models = {'payment_terms': 'ml_classifier_gbc.pkl', 'other': 'other_clause.pkl'}
+
+        # 2. Act
+        results = run_clause_models(self.df.copy(), self.model_dir, clause_models,
+                                    threshold={'payment_terms': 0.0, 'other': 1.1}, embeddings=self.embeddings)
+        single = run_classification_model(self.df.copy(), self.model_dir, threshold=0.0, embeddings=self.embeddings)
+
+        # 3. Assert: One row per clause and document, masked with the threshold of its clause
+        self.assertEqual(results['clause'].tolist(), ['payment_terms'] * 2 + ['other'] * 2)
+        payment_terms = results[results['clause'] == 'payment_terms'].reset_index(drop=True)
+        self.assertEqual(payment_terms['sentence_text'].tolist(), single['sentence_text'].tolist())
+        self.assertTrue(results.loc[results['clause'] == 'other', 'sentence_text'].isna().all())
+
+    def test_one_predict_proba_per_clause(self):
+        """
+        Tests that adding a clause costs one predict_proba call on the shared embeddings.
+        """
+        # 1. Arrange
+        first, second = FirstFeatureClassifier(), FirstFeatureClassifier()
+
+        # 2. Act
+        with mock.patch.object(first, 'predict_proba', wraps=first.predict_proba) as first_calls, \
+                mock.patch.object(second, 'predict_proba', wraps=second.predict_proba) as second_calls:
+            candidates = rank_top_sentences_by_clause(self.df, {'first': first, 'second': second}, k=1,
+                                                      context=0, embeddings=self.embeddings)
+
+        # 3. Assert
+        self.assertEqual(first_calls.call_count, 1)
+        self.assertEqual(second_calls.call_count, 1)
+        self.assertIs(first_calls.call_args[0][0], second_calls.call_args[0][0])
+        self.assertEqual(candidates['first']['row'].tolist(), candidates['second']['row'].tolist())
+
+    def test_classifier_is_loaded_once(self):
+        """
+        Tests that the classifier stays loaded until its file changes.
+        """
+        first = get_classifier(self.model_path)
+        with mock.patch('models.pickle.load') as pickle_load:
+            self.assertIs(get_classifier(self.model_path), first)
+            pickle_load.assert_not_called()
+
+        # A newer modification time makes the next call load the file again
+        stat = os.stat(self.model_path)
+        os.utime(self.model_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNot(get_classifier(self.model_path), first)
+
+
+class TestExtractionService(unittest.TestCase):
+    """
+    Unit tests for the HTTP extraction service and its micro-batching.
+    """
+
+    def setUp(self):
+        self.service = ExtractionService(os.path.join('tests', 'model'), sent_emb_model=FakeEmbeddingModel384(),
+                                         threshold=0.0, max_wait_ms=200)
+        self.addCleanup(self.service.close)
+
+    def test_successful_execution(self):
+        """
+        Tests that an uploaded HTML file returns its top sentence and the stage timings.
+        """
+        # 1. Arrange: Serve on a free local port
+        server = make_server(self.service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        with open(os.path.join('tests', 'docs', 'googlecontract.html'), 'rb') as f:
+            content = f.read()
+
+        # 2. Act
+        url = f"http://127.0.0.1:{server.server_address[1]}/extract?filename=googlecontract.html"
+        with urllib.request.urlopen(urllib.request.Request(url, data=content, method='POST')) as response:
+            result = json.loads(response.read())
+
+        # 3. Assert
+        self.assertEqual(result['filename'], 'googlecontract.html')
+        self.assertIsInstance(result['sentence_text'], str)
+        self.assertGreaterEqual(result['probability'], 0.0)
+        self.assertEqual(set(result['timings_ms']), {'ingest', 'segment', 'queue', 'embed', 'classify', 'total'})
+
+    def test_concurrent_requests_share_a_batch(self):
+        """
+        Tests that documents submitted together are embedded in one call.
+        """
+        docs = [pd.DataFrame({'filename': 'same.txt', 'sentence_index': [0, 1],
+                              'sentence_text': [f'Payment {i}.', f'Terms {i}.']}) for i in range(3)]
+        with mock.patch('service.embed_sentences', wraps=helper_functions.embed_sentences) as embed:
+            futures = [self.service.batcher.submit(df) for df in docs]
+            results = [future.result(timeout=30) for future in futures]
+
+        embed.assert_called_once()
+        self.assertEqual([r['batch_size'] for r in results], [3, 3, 3])
+        self.assertEqual([r['result']['sentence_text'][-2] for r in results], ['0', '1', '2'])
+
+    def test_error_handling_request_body(self):
+        """
+        Tests that a missing or malformed Content-Length gets 400 and an oversized body 413.
+        """
+        # 1. Arrange: Serve with a 1 KB upload limit
+        self.service.max_body_bytes = 1024
+        server = make_server(self.service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        def post(headers, body=b''):
+            connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=30)
+            self.addCleanup(connection.close)
+            connection.putrequest('POST', '/extract?filename=doc.html')
+            for name, value in headers.items():
+                connection.putheader(name, value)
+            connection.endheaders(body)
+            return connection.getresponse().status
+
+        # 2. Act
+        statuses = [post({}), post({'Content-Length': 'abc'}, b'abc'), post({'Content-Length': '-1'}),
+                    post({'Content-Length': '2048'}, b'x' * 2048)]
+
+        # 3. Assert
+        self.assertEqual(statuses, [400, 400, 400, 413])
+
+    def test_edge_case_loads_local_model_only(self):
+        """
+        Tests that the service never downloads the sentence model when it starts.
+        """
+        with mock.patch('service.get_sentence_model', return_value=FakeEmbeddingModel384()) as get_model:
+            ExtractionService(os.path.join('tests', 'model'), threshold=0.0).close()
+
+        get_model.assert_called_once_with(local_files_only=True)
+
+
+@unittest.skipUnless(importlib.util.find_spec('onnxruntime') and importlib.util.find_spec('onnx'),
+                     "onnx and onnxruntime are not installed")
+class TestOnnxSentenceEncoder(unittest.TestCase):
+    """
+    Unit tests for the ONNX Runtime embedding backend, on a tiny randomly initialized
+    BERT model built locally (no download).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        from transformers import BertConfig, BertModel, BertTokenizerFast
+        from sentence_transformers import SentenceTransformer, models as st_models
+
+        cls.test_dir = 'test_onnx_env'
+        bert_dir = os.path.join(cls.test_dir, 'bert')
+        os.makedirs(bert_dir, exist_ok=True)
+        vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'payment', 'terms', 'is', 'due', '.'] + \
+            list('abcdefghijklmnopqrstuvwxyz')
+        with open(os.path.join(bert_dir, 'vocab.txt'), 'w') as f:
+            f.write('\n'.join(vocab))
+        BertTokenizerFast(vocab_file=os.path.join(bert_dir, 'vocab.txt')).save_pretrained(bert_dir)
+        BertModel(BertConfig(vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                             intermediate_size=64, max_position_embeddings=64)).save_pretrained(bert_dir)
+        transformer = st_models.Transformer(bert_dir, max_seq_length=32)
+        cls.model_path = os.path.join(cls.test_dir, 'sentence_model')
+        SentenceTransformer(modules=[transformer, st_models.Pooling(32, 'mean')]).save(cls.model_path)
+
+        cls.reference = SentenceTransformer(cls.model_path, device='cpu', local_files_only=True)
+        cls.onnx_dir = export_onnx_model(cls.model_path, os.path.join(cls.test_dir, 'onnx'), quantize=True)
+        cls.sentences = ['Payment is due.', 'payment terms', 'a b c d e f g h i j k l m n o p.']
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.test_dir, ignore_errors=True)
+
+    def test_successful_execution(self):
+        """
+        Tests that the ONNX model gives the embeddings of the PyTorch model.
+        """
+        encoder = OnnxSentenceEncoder(self.onnx_dir)
+
+        embeddings = encoder.encode(self.sentences, batch_size=2)
+
+        self.assertEqual(embeddings.dtype, np.float32)
+        np.testing.assert_allclose(embeddings, self.reference.encode(self.sentences), atol=1e-4)
+
+    def test_quantized_model_and_pickling(self):
+        """
+        Tests that the int8 model stays close to the PyTorch model and that the encoder
+        can be sent to worker processes.
+        """
+        encoder = pickle.loads(pickle.dumps(OnnxSentenceEncoder(self.onnx_dir, quantized=True)))
+
+        report = compare_embedding_backends([' '.join(self.sentences)], ['doc.txt'], self.reference, encoder,
+                                            FirstFeatureClassifier())
+
+        self.assertGreater(report['mean_cosine_similarity'], 0.95)
+        self.assertEqual(report['documents'], 1)
+        self.assertIn(report['top_sentence_agreement'], (0.0, 1.0))
+
+    def test_query_index_of_quantized_model(self):
+        """
+        Tests that an index built with the int8 model can be queried from the command line.
+        """
+        # 1. Arrange: Index the sentences under the model id the pipeline stores for int8
+        encoder = OnnxSentenceEncoder(self.onnx_dir, quantized=True)
+        index_dir = os.path.join(self.test_dir, 'index')
+        self.addCleanup(shutil.rmtree, index_dir, ignore_errors=True)
+        df = pd.DataFrame({'filename': 'doc.txt', 'sentence_index': range(len(self.sentences)),
+                           'sentence_text': self.sentences})
+        SentenceAnnIndex(index_dir, n_trees=2, model_id=encoder.model_id).add(df, encoder.encode(self.sentences))
+
+        # 2. Act
+        output = subprocess.run([sys.executable, 'ann_index.py', 'query', '--index_dir', index_dir,
+                                 '--text', self.sentences[0], '--k', '1', '--onnx_model_dir', self.onnx_dir,
+                                 '--onnx_quantized'], capture_output=True, text=True, timeout=120)
+
+        # 3. Assert
+        self.assertEqual(output.returncode, 0, output.stderr)
+        self.assertIn(self.sentences[0], output.stdout)
+
+
+class FirstFeatureClassifier:
+    """
+    Stand-in classifier whose probability is the sigmoid of the first embedding feature.
+    """
+
+    def predict_proba(self, embeddings):
+        positive = 1 / (1 + np.exp(-np.asarray(embeddings)[:, 0]))
+        return np.column_stack([1 - positive, positive])
+
+
+class TestCompareEmbeddingBackends(unittest.TestCase):
+    """
+    Unit tests for the labels of compare_embedding_backends.
+    """
+
+    def setUp(self):
+        self.texts = ['Payment is due within thirty days of the invoice date. Signed.',
+                      'Fees. The customer pays all fees within sixty days of receipt.']
+        self.filenames = ['a.txt', 'b.txt']
+        df = process_texts_to_dataframe(self.texts, self.filenames)
+        # The long sentences (the larger first embedding feature) are the clause sentences
+        self.labels = df.assign(Label=(df['sentence_text'].str.len() > 20).astype(int))
+
+    def test_successful_execution(self):
+        """
+        Tests that labels are matched to sentences by filename and sentence index, not by row order.
+        """
+        # In another document order, where matching by position would pair the wrong labels
+        labels = self.labels.sort_values('filename', ascending=False)[['filename', 'sentence_index', 'Label']]
+        self.assertEqual(labels['Label'].tolist(), [0, 1, 1, 0])
+
+        report = compare_embedding_backends(self.texts, self.filenames, FakeEmbeddingModel(), FakeEmbeddingModel(),
+                                            FirstFeatureClassifier(), labels=labels)
+
+        self.assertEqual(report['auc_reference'], 1.0)
+        self.assertEqual(report['auc_candidate'], 1.0)
+
+    def test_error_handling_label_count(self):
+        """
+        Tests that missing labels are an error.
+        """
+        with self.assertRaises(ValueError):
+            compare_embedding_backends(self.texts, self.filenames, FakeEmbeddingModel(), FakeEmbeddingModel(),
+                                       FirstFeatureClassifier(), labels=self.labels.iloc[1:])
+
+
+class TestSentencePrefilter(unittest.TestCase):
+    """
+    Unit tests for the SentencePrefilter class and evaluate_prefilter.
+    """
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'filename': ['a.txt'] * 4 + ['b.txt'] * 2,
+            'sentence_index': [0, 1, 2, 3, 0, 1],
+            'sentence_text': ['Page 3 of 17', 'Payment is due within thirty (30) days of invoice.',
+                              '~~|| ## 33 ,, ..', 'IN WITNESS WHEREOF the parties have signed.',
+                              'This Agreement is governed by the laws of Delaware.', 'Signature'],
+        })
+
+    def test_successful_execution(self):
+        """
+        Tests that only candidates are kept, with their original sentence indices, and that
+        a document without candidates is kept in full.
+        """
+        prefilter = SentencePrefilter()
+
+        filtered = prefilter.filter_dataframe(self.df)
+
+        self.assertEqual(filtered['filename'].tolist(), ['a.txt', 'b.txt', 'b.txt'])
+        self.assertEqual(filtered['sentence_index'].tolist(), [1, 0, 1])
+        self.assertEqual(prefilter.stats, {'documents': 2, 'sentences': 6, 'kept': 3, 'fallback_documents': 1})
+
+    def test_edge_case_no_fallback(self):
+        """
+        Tests that without fallback a document without candidates loses all sentences.
+        """
+        filtered = SentencePrefilter(fallback=False).filter_dataframe(self.df)
+
+        self.assertEqual(filtered['filename'].tolist(), ['a.txt'])
+
+    def test_evaluate_prefilter(self):
+        """
+        Tests the recall report against the full path on a labeled set.
+        """
+        # 1. Arrange: The classifier scores the labeled clause of a.txt highest, and the
+        # labeled clause of b.txt is not matched by any pattern
+        df = self.df.assign(Label=[0, 1, 0, 0, 1, 0])
+        embeddings = np.array([[-1], [3], [2], [-1], [2], [-2]], dtype=np.float32)
+
+        # 2. Act
+        report = evaluate_prefilter(df, embeddings, FirstFeatureClassifier(), SentencePrefilter(fallback=False))
+
+        # 3. Assert
+        self.assertEqual(report['sentence_recall'], 0.5)
+        self.assertEqual(report['document_recall_full'], 1.0)
+        self.assertEqual(report['document_recall_cascade'], 0.5)
+        self.assertEqual(report['recall_loss'], 0.5)
+
+    def test_evaluate_prefilter_liability(self):
+        """
+        Tests the liability patterns, alone and in union with the payment terms patterns.
+        """
+        # 1. Arrange: The liability clause of a.txt matches no payment terms pattern
+        df = pd.DataFrame({
+            'filename': ['a.txt'] * 3 + ['b.txt'] * 2,
+            'sentence_index': [0, 1, 2, 0, 1],
+            'sentence_text': ['Page 3 of 17', 'In no event shall either party be liable for consequential damages.',
+                              'Payment is due within thirty (30) days of invoice.',
+                              'Supplier shall indemnify and hold harmless the Customer.', 'Signature'],
+            'Label': [0, 1, 0, 1, 0],
+        })
+        embeddings = np.array([[-1], [3], [2], [2], [-2]], dtype=np.float32)
+
+        # 2. Act
+        payment = evaluate_prefilter(df, embeddings, FirstFeatureClassifier(), SentencePrefilter(fallback=False))
+        liability = evaluate_prefilter(df, embeddings, FirstFeatureClassifier(),
+                                       SentencePrefilter(LIABILITY_PATTERNS, fallback=False))
+        union = SentencePrefilter(dict(PATTERN_SETS), fallback=False).filter_dataframe(df)
+
+        # 3. Assert
+        self.assertEqual(payment['document_recall_cascade'], 0.0)
+        self.assertEqual(liability['sentence_recall'], 1.0)
+        self.assertEqual(liability['kept_fraction'], 0.4)
+        self.assertEqual(liability['recall_loss'], 0.0)
+        self.assertEqual(union['sentence_text'].tolist(), df['sentence_text'][[1, 2, 3]].tolist())
+
+    def test_error_handling_pattern_set_without_classifier(self):
+        """
+        Tests that the recall report refuses pattern sets it has no classifier for, rather
+        than scoring them with the classifier of another clause.
+        """
+        output = subprocess.run([sys.executable, 'prefilter.py', '--store_dir', 'none', '--labels', 'none.csv',
+                                 '--model_folder', os.path.join('tests', 'model'), '--patterns', 'liability'],
+                                capture_output=True, text=True, timeout=60)
+
+        self.assertEqual(output.returncode, 2)
+        self.assertIn('--model_name', output.stderr)
+
+    def test_multiple_clauses_in_pipeline(self):
+        """
+        Tests that with several clauses the pipeline scores the candidates of every clause,
+        and that a prefilter without the patterns of a clause is rejected.
+        """
+        # 1. Arrange: A contract with a payment terms and a liability sentence
+        test_dir = 'test_prefilter_env'
+        input_dir = os.path.join(test_dir, 'input')
+        os.makedirs(input_dir, exist_ok=True)
+        self.addCleanup(shutil.rmtree, test_dir)
+        with open(os.path.join(input_dir, 'contract.html'), 'w', encoding='utf-8') as f:
+            f.write("<html><body><p>Payment is due within thirty (30) days of invoice.</p>"
+                    "<p>In no event shall either party be liable for consequential damages.</p>"
+                    "<p>This Agreement is governed by the laws of Delaware.</p></body></html>")
+        clause_models = {'payment_terms': 'ml_classifier_gbc.pkl', 'liability': 'ml_classifier_gbc.pkl'}
+
+        # 2. Act
+        with mock.patch('helper_functions.get_english_lexicon', return_value={'payment', 'invoice'}):
+            process_and_classify_files(input_dir, os.path.join(test_dir, 'output'), os.path.join('tests', 'model'),
+                                       sent_emb_model=FakeEmbeddingModel384(), threshold=0.0, top_k=3,
+                                       clause_models=clause_models, prefilter=SentencePrefilter(dict(PATTERN_SETS)))
+        candidates = pd.read_excel(os.path.join(test_dir, 'output', 'model_top_candidates.xlsx'))
+
+        # 3. Assert: Both clauses rank both candidates, and nothing the prefilter dropped
+        for clause in clause_models:
+            self.assertEqual(sorted(candidates.loc[candidates['clause'] == clause, 'sentence_index']), [0, 1])
+        with self.assertRaises(ValueError):
+            process_and_classify_files(input_dir, os.path.join(test_dir, 'output'), os.path.join('tests', 'model'),
+                                       sent_emb_model=FakeEmbeddingModel384(), clause_models=clause_models,
+                                       prefilter=SentencePrefilter())
+
+
+class TestTopKReducer(unittest.TestCase):
+    """
+    Unit tests for the TopKReducer class.
+    """
+
+    def test_successful_execution(self):
+        """
+        Tests that the k best sentences of each document are ranked with their context.
+        """
+        # 1. Arrange
+        reducer = TopKReducer(k=2, context=1)
+        texts = ['Header.', 'Payment is due in 30 days.', 'Invoices are sent monthly.', 'Signature.']
+
+        # 2. Act: Two documents whose scores arrive interleaved
+        for i, (text, probability) in enumerate(zip(texts, [0.1, 0.9, 0.6, 0.2])):
+            reducer.add('a.txt', i, text, probability)
+            reducer.add('b.txt', i, text, 1 - probability)
+        results = reducer.results()
+
+        # 3. Assert
+        a = results[results['filename'] == 'a.txt']
+        self.assertEqual(a['sentence_index'].tolist(), [1, 2])
+        self.assertEqual(a['rank'].tolist(), [1, 2])
+        self.assertEqual(a['context_before'].tolist(), ['Header.', 'Payment is due in 30 days.'])
+        self.assertEqual(a['context_after'].tolist(), ['Invoices are sent monthly.', 'Signature.'])
+        self.assertEqual(results[results['filename'] == 'b.txt']['sentence_index'].tolist(), [0, 3])
+
+    def test_edge_case_ties(self):
+        """
+        Tests that equal scores keep the sentence added first, like idxmax.
+        """
+        reducer = TopKReducer(k=1, context=0)
+        reducer.add_batch(['a.txt'] * 3, [0, 1, 2], ['x', 'y', 'z'], [0.5, 0.7, 0.7])
+
+        self.assertEqual(reducer.results()['sentence_index'].tolist(), [1])
+
+    def test_edge_case_prefiltered_sentences(self):
+        """
+        Tests that the context of a candidate is its true neighbors when only some
+        sentences (with a gap in sentence_index) are added.
+        """
+        # 1. Arrange: The prefilter kept sentences 1 and 4 of a.txt
+        texts = ['Header.', 'Payment is due in 30 days.', 'Page 2 of 9', 'Signature.', 'Invoices are sent monthly.']
+        reducer = TopKReducer(k=2, context=1, document_sentences={'a.txt': texts})
+
+        # 2. Act
+        reducer.add_batch(['a.txt'] * 2, [1, 4], [texts[1], texts[4]], [0.9, 0.6])
+        results = reducer.results()
+
+        # 3. Assert
+        self.assertEqual(results['sentence_index'].tolist(), [1, 4])
+        self.assertEqual(results['context_before'].tolist(), ['Header.', 'Signature.'])
+        self.assertEqual(results['context_after'].tolist(), ['Page 2 of 9', ''])
+
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Unit tests for the synthetic corpus generator and the regression check of benchmark.py.
+    """
+
+    def setUp(self):
+        self.test_dir = 'test_benchmark_env'
+        self.addCleanup(shutil.rmtree, self.test_dir, ignore_errors=True)
+
+    def test_generate_corpus(self):
+        """
+        Tests that the corpus has the requested document types and is reproducible.
+        """
+        # 1. Arrange
+        first_dir, second_dir = os.path.join(self.test_dir, 'first'), os.path.join(self.test_dir, 'second')
+
+        # 2. Act
+        manifest = generate_corpus(first_dir, num_documents=4, pages_per_document=2, seed=1)
+        generate_corpus(second_dir, num_documents=4, pages_per_document=2, seed=1)
+
+        # 3. Assert
+        self.assertEqual([d['type'] for d in manifest['documents']], ['html', 'html', 'pdf_scanned', 'pdf_text'])
+        corpus = describe_corpus(first_dir)
+        self.assertEqual((corpus['html_documents'], corpus['pdf_documents'], corpus['pdf_pages']), (2, 2, 4))
+        for document in manifest['documents']:
+            if document['type'] == 'html':
+                with open(os.path.join(first_dir, document['filename']), 'rb') as first, \
+                        open(os.path.join(second_dir, document['filename']), 'rb') as second:
+                    self.assertEqual(first.read(), second.read())
+        text_pdf = os.path.join(first_dir, manifest['documents'][3]['filename'])
+        scanned_pdf = os.path.join(first_dir, manifest['documents'][2]['filename'])
+        self.assertIn('SERVICES AGREEMENT', pdf_to_text(text_pdf, mode='native'))
+        self.assertEqual(pdf_to_text(scanned_pdf, mode='native').strip(), '')
+
+    def test_compare_results(self):
+        """
+        Tests that only metrics worse than the baseline by more than the tolerance are flagged.
+        """
+        # 1. Arrange
+        baseline = {'stages': {'embed': {'seconds': 2.0, 'sentences_per_s': 100.0},
+                               'quality': {'seconds': 1.0, 'documents_per_s': None}},
+                    'peak_rss_mb': 1000.0}
+        current = {'stages': {'embed': {'seconds': 2.5, 'sentences_per_s': 80.0},
+                              'quality': {'seconds': 1.05, 'documents_per_s': None}},
+                   'peak_rss_mb': 1200.0}
+
+        # 2. Act
+        comparison = compare_results(baseline, current, tolerance=0.1).set_index(['stage', 'metric'])
+
+        # 3. Assert
+        self.assertTrue(comparison.loc[('embed', 'sentences_per_s'), 'regression'])
+        self.assertFalse(comparison.loc[('quality', 'seconds'), 'regression'])
+        self.assertTrue(comparison.loc[('process', 'peak_rss_mb'), 'regression'])
+
+    def test_run_benchmark(self):
+        """
+        Tests that the stage times and counts are read from the run report of the pipeline.
+        """
+        # 1. Arrange: One HTML document and one PDF with a text layer
+        corpus_dir, output_dir = os.path.join(self.test_dir, 'corpus'), os.path.join(self.test_dir, 'results')
+        generate_corpus(corpus_dir, num_documents=2, pages_per_document=2, scanned_fraction=0.0, seed=1)
+
+        # 2. Act
+        with mock.patch('helper_functions.get_english_lexicon', return_value={'payment', 'invoice'}):
+            results = run_benchmark(corpus_dir, output_dir, os.path.join('tests', 'model'),
+                                    sent_emb_model=FakeEmbeddingModel384(), repeats=2, threshold=0.0)
+
+        # 3. Assert: Every stage of the report is reported, with the counts it recorded
+        with open(os.path.join(output_dir, 'run', 'run_report.json'), 'r', encoding='utf-8') as f:
+            report = json.load(f)
+        self.assertEqual(list(results['stages']), [stage['name'] for stage in report['stages']] + ['total'])
+        stages = {stage['name']: stage for stage in report['stages']}
+        self.assertEqual(results['sentences'], {'segmented': stages['segment']['items'],
+                                                'embedded': stages['embed']['items']})
+        pdf = results['stages']['pdf']
+        self.assertAlmostEqual(pdf['pages_per_s'] / pdf['documents_per_s'], 2.0)
+        self.assertIs(sys.modules['pipeline'].embed_sentences, helper_functions.embed_sentences)
+
+
+class TestInstrumentation(unittest.TestCase):
+    """
+    Unit tests for the Instrumentation class and its exporters.
+    """
+
+    def setUp(self):
+        self.test_dir = 'test_instrumentation_env'
+        self.addCleanup(shutil.rmtree, self.test_dir, ignore_errors=True)
+
+    def test_stage_records_and_exporters(self):
+        """
+        Tests that stages and documents are measured and exported to JSON and Prometheus.
+        """
+        # 1. Arrange
+        report_path = os.path.join(self.test_dir, 'run_report.json')
+        prom_path = os.path.join(self.test_dir, 'pipeline.prom')
+        instrumentation = Instrumentation(exporters=[JsonReportExporter(report_path),
+                                                     PrometheusTextfileExporter(prom_path)])
+
+        # 2. Act
+        with instrumentation.stage('segment') as stage:
+            for filename, text in stage.timed_documents(iter([('a.txt', 'one'), ('b.txt', 'two')])):
+                pass
+            stage.items = 7
+        with instrumentation.stage('embed') as stage:
+            with stage.document('a.txt') as document:
+                document['items'] = 3
+        instrumentation.finish()
+
+        # 3. Assert
+        with open(report_path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+        self.assertEqual(report['status'], 'success')
+        self.assertEqual([stage['name'] for stage in report['stages']], ['segment', 'embed'])
+        segment = report['stages'][0]
+        self.assertEqual(segment['items'], 7)
+        self.assertEqual([d['filename'] for d in segment['documents']], ['a.txt', 'b.txt'])
+        self.assertGreaterEqual(segment['wall_seconds'], 0)
+        self.assertEqual(report['stages'][1]['documents'][0]['items'], 3)
+        with open(prom_path, 'r', encoding='utf-8') as f:
+            metrics = f.read()
+        self.assertIn('contract_pipeline_run_success 1.0', metrics)
+        self.assertIn('contract_pipeline_stage_items{stage="segment"} 7.0', metrics)
+        self.assertIn('# TYPE contract_pipeline_stage_wall_seconds gauge', metrics)
+
+    def test_failed_stage_and_sampling_profile(self):
+        """
+        Tests that an error is recorded on its stage and that the profiled stage writes its stacks.
+        """
+        # 1. Arrange
+        instrumentation = Instrumentation(profile_stage='busy', profile_dir=self.test_dir, sample_interval=0.001)
+
+        # 2. Act
+        with instrumentation.stage('busy'):
+            deadline = time.perf_counter() + 0.1
+            while time.perf_counter() < deadline:
+                pass
+        with self.assertRaises(ValueError):
+            with instrumentation.stage('broken'):
+                raise ValueError("bad input")
+        report = instrumentation.finish(status='failed')
+
+        # 3. Assert
+        self.assertEqual(report['status'], 'failed')
+        self.assertEqual(report['stages'][1]['error'], 'ValueError: bad input')
+        with open(report['stages'][0]['profile_path'], 'r', encoding='utf-8') as f:
+            stacks = f.read()
+        self.assertIn('test_failed_stage_and_sampling_profile', stacks)
+
+
+class TestStartupTime(unittest.TestCase):
+    """
+    Startup benchmark: importing the package and its modules must stay fast, with
+    heavy dependencies and models only loaded on first use.
+    """
+
+    # Import time budget in seconds, measured in a fresh interpreter
+    IMPORT_TIME_BUDGET = 2.0
+    HEAVY_MODULES = ['torch', 'sentence_transformers', 'spacy', 'fitz', 'pytesseract',
+                     'matplotlib', 'bs4', 'PIL', 'sklearn']
+
+    def measure_import(self, statement, cwd):
+        """
+        Runs an import statement in a fresh interpreter and returns its duration and
+        the heavy modules it loaded.
+        """
+        code = (f"import sys, time; start = time.perf_counter(); {statement}; "
+                f"print(time.perf_counter() - start); "
+                f"print(','.join(m for m in {self.HEAVY_MODULES!r} if m in sys.modules))")
+        output = subprocess.run([sys.executable, '-c', code], cwd=cwd, capture_output=True,
+                                text=True, check=True).stdout.splitlines()
+        return float(output[0]), [m for m in output[1].split(',') if m] if len(output) > 1 else []
+
+    def test_package_import(self):
+        """
+        Tests that importing the package and accessing the pipeline stays under budget.
+        """
+        seconds, heavy = self.measure_import("import scripts; scripts.process_and_classify_files",
+                                             cwd=os.path.dirname(os.path.abspath('.')))
+        self.assertEqual(heavy, [])
+        self.assertLess(seconds, self.IMPORT_TIME_BUDGET)
+
+    def test_module_imports(self):
+        """
+        Tests that importing the helper and pipeline modules stays under budget.
+        """
+        seconds, heavy = self.measure_import("import helper_functions, pipeline", cwd='.')
+        self.assertEqual(heavy, [])
+        self.assertLess(seconds, self.IMPORT_TIME_BUDGET)
+
+
 if __name__ == '__main__':
     unittest.main(argv=['first-arg-is-ignored'], exit=False)
\ No newline at end of file